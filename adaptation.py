@@ -0,0 +1,134 @@
+"""在线模板更新
+
+模板只在录入时采集一次，光照和外貌慢慢变化后得分下降，用户开始频繁遇到
+"置信度不足"。识别得很有把握的探针（得分高出该用户识别阈值 margin 以上、
+一致性达标）可以补进该用户的模板：
+
+    每位用户最多 budget 个模板，录入时的前 pinned 个固定不动；
+    还有空位时直接追加；满了就在其余模板（录入的和后来补进的）中替换最冗余的
+    一个——与本人其余模板（连同新探针）平均相似度最高的那个；
+    新探针本身比所有候选都冗余时不更新。
+
+每位用户的模板数有上限，匹配代价不随运行时间增长。固定的录入模板保证
+即便混进一两次误判，模板也不会整体漂移到别人身上。
+同一用户两次更新至少间隔 min_interval_ms（一次到访的连续帧几乎一样）；
+写flash按 save_interval_ms 限速，只把变化的模板追加到更新日志。
+"""
+from decision import CONSISTENCY_MIN
+from template_store import JOURNAL_LIMIT, append_update, save_templates
+
+SKIP = -1
+
+
+class TemplateUpdater:
+    """按预算增删模板，并限速持久化
+
+    clock 提供 ticks_diff：now 是 ticks_ms 读数，会回绕，不能直接相减。
+    """
+
+    def __init__(self, gallery, clock, pinned, budget, margin=0.02, min_interval_ms=60000, save_interval_ms=600000):
+        self.gallery = gallery
+        self.clock = clock
+        self.pinned = pinned
+        self.budget = budget
+        self.margin = margin
+        self.min_interval_ms = min_interval_ms
+        self.save_interval_ms = save_interval_ms
+        self.last_update = {}    # 用户名 -> 上次更新时刻
+        self.last_save = None
+        self.dirty = []          # 还没写入flash的模板下标
+        self.evicted = {}        # 上次写入后被替换的模板下标 -> 替换前的内容（标定据此扣除旧模板）
+        self.updates = 0
+        self.appended = 0
+        self.replaced = 0
+        self.skipped = 0
+        self.saves = 0
+
+    def consider(self, name, probe, score, consistency, threshold, now):
+        """一次放行后调用；符合条件时更新模板，返回被改动的模板下标或 None"""
+        if score < threshold + self.margin or consistency < CONSISTENCY_MIN:
+            return None
+        last = self.last_update.get(name)
+        if last is not None and self.clock.ticks_diff(now, last) < self.min_interval_ms:
+            return None
+        gallery = self.gallery
+        if name not in gallery.names:
+            return None
+        label = gallery.names.index(name)
+
+        slot = self._choose_slot(label, probe)
+        if slot == SKIP:
+            self.skipped += 1
+            return None
+        if slot is None:
+            index = gallery.add(name, list(probe))
+            self.appended += 1
+        else:
+            if slot not in self.dirty:
+                # 标定只见过上次写入时的内容；之后新增或已替换过的模板不必再留
+                self.evicted[slot] = gallery.template(slot)
+            gallery.replace(slot, probe)
+            index = slot
+            self.replaced += 1
+        self.last_update[name] = now
+        if index not in self.dirty:
+            self.dirty.append(index)
+        self.updates += 1
+        return index
+
+    def _choose_slot(self, label, probe):
+        """None: 追加；SKIP: 探针太冗余；否则为要替换的模板下标"""
+        gallery = self.gallery
+        members = gallery.members()[label]
+        if len(members) < self.budget:
+            return None
+        count = len(members)
+        probe_scores = gallery.scores(probe, members)
+        probe_redundancy = sum(probe_scores) / count
+
+        best = None
+        best_redundancy = 0.0
+        for k in range(self.pinned, count):
+            t = members[k]
+            scores = gallery.scores(gallery.template(t), members)
+            # 与其余模板和新探针的平均相似度
+            redundancy = (sum(scores) - scores[k] + probe_scores[k]) / count
+            if best is None or redundancy > best_redundancy:
+                best = t
+                best_redundancy = redundancy
+        if best is None or probe_redundancy >= best_redundancy:
+            return SKIP
+        return best
+
+    def due(self, now):
+        """有未保存的更新且距上次写入已超过 save_interval_ms"""
+        if not self.dirty:
+            return False
+        return self.last_save is None or self.clock.ticks_diff(now, self.last_save) >= self.save_interval_ms
+
+    def flush(self, path, now):
+        """把未保存的模板追加到更新日志，日志过长时合并，返回写入的模板下标
+
+        调用前先取走 evicted 交给标定，写入后清空。
+        """
+        indices = self.dirty
+        self.dirty = []
+        self.evicted = {}
+        records = 0
+        for index in indices:
+            records = append_update(self.gallery, index, path)
+        if records >= JOURNAL_LIMIT:
+            save_templates(self.gallery, path)
+        self.last_save = now
+        self.saves += 1
+        return indices
+
+    def stats(self):
+        return {
+            "updates": self.updates,
+            "appended": self.appended,
+            "replaced": self.replaced,
+            "skipped": self.skipped,
+            "saves": self.saves,
+            "pending": len(self.dirty),
+        }
@@ -0,0 +1,1152 @@
+"""主机端性能基准
+
+用法: python bench.py [lbp] [grid] [roi] [gallery] [identify] [fixed] [store] [pipeline] [capture] [fusion] [scheduler] [link] [calibration] [adapt] [memory] [templates] [quality] [detect] [enroll] [events]
+
+在合成的人脸裁剪图上比较新旧实现的速度，并校验输出逐位一致。
+"""
+import io
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import calibration
+import enrollment
+import evaluate
+import event_log
+import face_features
+import lock
+import face_matcher
+import hal
+import template_store
+import uart_link
+import sim
+from sim import synthetic_face
+
+SIZES = (24, 32, 48, 64, 96, 128, 160, 200)
+GALLERY_USERS = (1, 10, 50, 100)
+
+
+def legacy_extract_stable_lbp_features(face_roi, radius=1, neighbors=8):
+    """原 lock.py 中基于 get_pixel 的实现，作为对照基准"""
+    width = face_roi.width()
+    height = face_roi.height()
+    if width < 24 or height < 24:
+        return None
+
+    offsets = []
+    for i in range(neighbors):
+        angle = 2 * math.pi * i / neighbors
+        offsets.append((int(radius * math.cos(angle)), int(radius * math.sin(angle))))
+
+    regions = [
+        (0.1, 0.1, 0.5, 0.5, "左上"),
+        (0.5, 0.1, 0.9, 0.5, "右上"),
+        (0.2, 0.3, 0.8, 0.7, "中央"),
+        (0.2, 0.6, 0.8, 0.95, "下部"),
+    ]
+
+    all_features = []
+    for x_start_r, y_start_r, x_end_r, y_end_r, region_name in regions:
+        x_start = int(width * x_start_r)
+        y_start = int(height * y_start_r)
+        x_end = int(width * x_end_r)
+        y_end = int(height * y_end_r)
+
+        lbp_hist = [0] * 256
+        total_pixels = 0
+        step = max(1, (x_end - x_start) // 12)
+
+        for y in range(y_start + radius, y_end - radius, step):
+            for x in range(x_start + radius, x_end - radius, step):
+                try:
+                    center_pixel = face_roi.get_pixel(x, y)
+                    if isinstance(center_pixel, tuple):
+                        center_pixel = sum(center_pixel) // len(center_pixel)
+                    lbp_value = 0
+                    valid_neighbors = 0
+                    for i, (dx, dy) in enumerate(offsets):
+                        nx, ny = x + dx, y + dy
+                        if 0 <= nx < width and 0 <= ny < height:
+                            neighbor_pixel = face_roi.get_pixel(nx, ny)
+                            if isinstance(neighbor_pixel, tuple):
+                                neighbor_pixel = sum(neighbor_pixel) // len(neighbor_pixel)
+                            if neighbor_pixel >= center_pixel:
+                                lbp_value |= (1 << i)
+                            valid_neighbors += 1
+                    if valid_neighbors == neighbors:
+                        lbp_hist[lbp_value] += 1
+                        total_pixels += 1
+                except:
+                    pass
+
+        if total_pixels > 0:
+            important_patterns = [
+                0, 1, 3, 7, 15, 31, 63, 127, 255,
+                2, 4, 6, 8, 12, 14, 16, 24, 28, 30,
+                32, 48, 56, 60, 62, 64, 96, 112, 120, 124
+            ]
+            for pattern in important_patterns[:16]:
+                all_features.append(min(255, (lbp_hist[pattern] * 100) // total_pixels))
+        else:
+            all_features.extend([0] * 16)
+
+    return all_features
+
+
+def legacy_grid_features(face_roi, grid_size=6):
+    """原 extract_simple_features 中逐像素隔点采样的网格均值"""
+    width = face_roi.width()
+    height = face_roi.height()
+    cell_w = width // grid_size
+    cell_h = height // grid_size
+    features = []
+    for i in range(grid_size):
+        for j in range(grid_size):
+            x_start = i * cell_w
+            y_start = j * cell_h
+            x_end = min(x_start + cell_w, width)
+            y_end = min(y_start + cell_h, height)
+            pixel_sum = 0
+            pixel_count = 0
+            for y in range(y_start, y_end, 2):
+                for x in range(x_start, x_end, 2):
+                    try:
+                        pixel = face_roi.get_pixel(x, y)
+                        if isinstance(pixel, tuple):
+                            pixel = sum(pixel) // len(pixel)
+                        pixel_sum += pixel
+                        pixel_count += 1
+                    except:
+                        pass
+            features.append(pixel_sum // pixel_count if pixel_count > 0 else 128)
+    return features
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_lbp(repeat=50):
+    print("LBP特征: 旧实现(get_pixel) vs 新实现(bytearray / NumPy)")
+    print(f"{'尺寸':>6} {'旧(us)':>10} {'bytearray(us)':>14} {'numpy(us)':>10} {'一致':>4}")
+    saved_np = face_features.np
+    for size in SIZES:
+        img = synthetic_face(size)
+        expected = legacy_extract_stable_lbp_features(img)
+
+        face_features.np = None
+        got_buf = face_features.extract_stable_lbp_features(img)
+        t_buf = timeit(lambda: face_features.extract_stable_lbp_features(img), repeat)
+
+        t_np = float("nan")
+        got_np = expected
+        if saved_np is not None:
+            face_features.np = saved_np
+            got_np = face_features.extract_stable_lbp_features(img)
+            t_np = timeit(lambda: face_features.extract_stable_lbp_features(img), repeat)
+        face_features.np = saved_np
+
+        t_old = timeit(lambda: legacy_extract_stable_lbp_features(img), repeat)
+        same = "是" if got_buf == expected and got_np == expected else "否"
+        print(f"{size:>6} {t_old:>10.1f} {t_buf:>14.1f} {t_np:>10.1f} {same:>4}")
+        if same != "是":
+            raise SystemExit(f"输出不一致: {size}x{size}")
+
+
+def bench_grid(repeat=50):
+    print("网格均值: 旧实现(36格逐像素) vs 积分图(只算保留的16格)；格宽为偶数时必须完全一致")
+    print(f"{'尺寸':>6} {'格宽':>4} {'旧(us)':>10} {'积分图(us)':>12} {'numpy(us)':>10} {'最大偏差':>8}")
+    saved_np = face_features.np
+    keep = face_features.FEATURE_DIM - face_features.DEFAULT_LBP_SPEC.dim
+
+    def run():
+        face = face_features.FaceGray(img)
+        return face_features.grid_means(face, face_features.GRID_SIZE, keep)
+
+    for size in SIZES:
+        img = synthetic_face(size)
+        expected = legacy_grid_features(img)[:keep]
+
+        face_features.np = None
+        got = run()
+        t_buf = timeit(run, repeat)
+
+        t_np = float("nan")
+        if saved_np is not None:
+            face_features.np = saved_np
+            if run() != got:
+                raise SystemExit(f"NumPy与bytearray路径不一致: {size}x{size}")
+            t_np = timeit(run, repeat)
+        face_features.np = saved_np
+
+        t_old = timeit(lambda: legacy_grid_features(img), repeat)
+        diff = max(abs(a - b) for a, b in zip(got, expected))
+        cell = size // face_features.GRID_SIZE
+        print(f"{size:>6} {cell:>4} {t_old:>10.1f} {t_buf:>12.1f} {t_np:>10.1f} {diff:>8}")
+        if cell % 2 == 0 and diff:
+            raise SystemExit(f"格宽为偶数时积分图网格均值应与原实现一致: {size}x{size}")
+
+
+def bench_roi(repeat=10):
+    print("人脸ROI: img.copy + 预处理副本 vs 预分配暂存图（每张脸的耗时与Python分配峰值）")
+    print(f"（暂存图把每张脸缩放到 {face_features.FACE_SIZE} 像素，耗时与尺寸无关；小脸比按原尺寸处理慢）")
+    print(f"{'尺寸':>6} {'copy(us)':>10} {'暂存图(us)':>12} {'copy峰值(B)':>12} {'暂存图峰值(B)':>14}")
+    scratch = face_features.FaceScratch(sim.SimImage(face_features.FACE_SIZE, face_features.FACE_SIZE))
+    out = bytearray(face_features.FEATURE_DIM)
+    saved_stdout = sys.stdout
+
+    def peak(fn):
+        tracemalloc.start()
+        try:
+            fn()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    for size in SIZES[:-1]:
+        frame = sim.SimImage(sim.FRAME_WIDTH, sim.FRAME_HEIGHT)
+        rect = (40, 20, size, size)
+        frame.draw_image(synthetic_face(size), rect[0], rect[1])
+
+        def copy_path():
+            return face_features.extract_simple_features(frame.copy(roi=rect))
+
+        def scratch_path():
+            return face_features.extract_simple_features(scratch.load(frame, rect), out=out)
+
+        sys.stdout = io.StringIO()
+        try:
+            t_copy = timeit(copy_path, repeat)
+            t_scratch = timeit(scratch_path, repeat)
+            p_copy = peak(copy_path)
+            p_scratch = peak(scratch_path)
+        finally:
+            sys.stdout = saved_stdout
+        print(f"{size:>6} {t_copy:>10.1f} {t_scratch:>12.1f} {p_copy:>12} {p_scratch:>14}")
+
+
+def fusion_scenario(arrivals=6):
+    """本人到来时前两帧欠曝带噪，随后画面正常；中间穿插陌生人"""
+    plan = [(6, 0), (20, None)]
+    genuine = []
+    for k in range(arrivals):
+        genuine.append(sum(entry[0] for entry in plan))
+        plan += [(2, 0, 0.5), (120, 0), (100, None)]
+        if k % 2:
+            plan += [(1, 1, 0.5), (10, 1), (100, None)]
+    return plan, genuine
+
+
+def unlock_latencies(board, arrivals):
+    """每次本人到来（帧序号）到发出解锁消息的虚拟毫秒数，返回 (排序后的延迟, 未解锁次数)"""
+    times = board.camera.frame_times
+    unlocks = sim.unlock_times(board)
+    latencies = []
+    missed = 0
+    for k, start in enumerate(arrivals):
+        begin = times[start]
+        end = times[arrivals[k + 1]] if k + 1 < len(arrivals) else float("inf")
+        hits = [t for t in unlocks if begin <= t < end]
+        if hits:
+            latencies.append(hits[0] - begin)
+        else:
+            missed += 1
+    latencies.sort()
+    return latencies, missed
+
+
+def bench_scheduler(commands=20):
+    print("协作调度: 每帧sleep 50ms+单缓冲（原配置） vs 只让出CPU+三缓冲（虚拟时钟，传感器30帧/秒，"
+          f"串口 {sim.UART_BAUD} 波特率写出阻塞）")
+    print(f"{'配置':<16} {'识别帧率':>8} {'帧间隔P95':>10} {'解锁中位':>8} {'UART响应中位':>12} {'UART最慢':>8} "
+          f"{'单次写阻塞':>10} (ms) {'统计行':>9}")
+    plan, genuine = fusion_scenario()
+    frames = sim.synthetic_sequence(plan)
+    saved = lock.frame_sleep_ms, lock.camera_framebuffers, lock.uart_max_write
+    try:
+        for label, sleep_ms, framebuffers, max_write in (("sleep50/单缓冲", 50, 1, 16), ("让出/三缓冲/写16字节", 0, 3, 16),
+                                                         ("让出/三缓冲/写4字节", 0, 3, 4)):
+            lock.frame_sleep_ms = sleep_ms
+            lock.camera_framebuffers = framebuffers
+            lock.uart_max_write = max_write
+            board = sim.SimBoard(frames, lock.capture_mode, framebuffers)
+            # 识别阶段开始后每隔一段时间发一次 stats 命令
+            sent = []
+
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                lock.setup(board)
+                gallery = lock.load_or_enroll(os.path.join(tempfile.mkdtemp(), "faces.bin"))
+                thresholds = lock.compute_baseline(gallery)
+                start = board.clock.ticks_ms()
+                for k in range(commands):
+                    at = start + 500 + k * 1700
+                    sent.append(at)
+                    board.controller.command("stats", at_ms=at)
+                first_frame = board.camera.index
+                lock.recognition_loop(gallery, *thresholds)
+            finally:
+                sys.stdout = saved_stdout
+
+            times = board.camera.frame_times[first_frame:]
+            intervals = sorted(b - a for a, b in zip(times, times[1:]))
+            fps = (len(times) - 1) * 1000 / max(1, times[-1] - times[0])
+            p95 = intervals[min(len(intervals) - 1, len(intervals) * 95 // 100)]
+            latencies, _ = unlock_latencies(board, genuine)
+            unlock = latencies[len(latencies) // 2] if latencies else float("nan")
+            replies = []
+            reply_times = board.controller.times(uart_link.MSG_REPLY)
+            for at in sent:
+                after = [t for t in reply_times if t >= at]
+                if after:
+                    replies.append(after[0] - at)
+            replies.sort()
+            reply = replies[len(replies) // 2] if replies else float("nan")
+            worst = replies[-1] if replies else float("nan")
+            # 每条 stats 回复 "OK <行数> 行"，对比控制器实际收到的统计行
+            expected = sum(int(payload.split()[1]) for _, kind, payload in board.controller.events
+                           if kind == uart_link.MSG_REPLY and payload.startswith(b"OK "))
+            received = len(board.controller.times(uart_link.MSG_STATS))
+            stats_lines = f"{received}/{expected}"
+            blocking = max(len(data) for _, data in board.uart.tx) * 10000 / sim.UART_BAUD
+            print(f"{label:<16} {fps:>8.1f} {p95:>10} {unlock:>8} {reply:>12} {worst:>8} {blocking:>10.1f}      "
+                  f"{stats_lines:>9}")
+    finally:
+        lock.frame_sleep_ms, lock.camera_framebuffers, lock.uart_max_write = saved
+
+
+def bench_link(events=200, poll_ms=10, spacing_ms=100):
+    print(f"UART链路: 内存回环按字节丢失，{events} 个解锁事件，每 {poll_ms} ms 轮询一次")
+    print(f"{'丢字节率':>8} {'送达':>6} {'重复':>6} {'重发':>6} {'放弃':>6} {'CRC错':>6} {'延迟中位':>8} {'最慢':>6} (ms)")
+    for loss in (0.0, 0.01, 0.05):
+        clock = sim.SimClock()
+        device_uart, controller_uart = sim.loopback_pair(clock, loss, seed=7)
+        device = uart_link.UartLink(device_uart, clock, heartbeat_ms=0)
+        controller = uart_link.UartLink(controller_uart, clock, heartbeat_ms=0)
+        received = []
+        controller.on_message = lambda msg_type, payload: received.append((clock.ticks_ms(), payload))
+        sent = {}
+        end = events * spacing_ms + 3000
+        step = 0
+        while clock.ticks_ms() < end:
+            if step % (spacing_ms // poll_ms) == 0 and len(sent) < events:
+                payload = f"用户{len(sent)}".encode()
+                sent[payload] = clock.ticks_ms()
+                device.send(uart_link.MSG_UNLOCK, payload)
+            device.poll()
+            controller.poll()
+            clock.sleep_ms(poll_ms)
+            step += 1
+        first = {}
+        for t, payload in received:
+            first.setdefault(payload, t)
+        latencies = sorted(first[p] - sent[p] for p in first if p in sent)
+        median = latencies[len(latencies) // 2] if latencies else float("nan")
+        worst = latencies[-1] if latencies else float("nan")
+        stats = device.stats()
+        print(f"{loss:>8.0%} {len(first):>6} {len(received) - len(first):>6} {stats['retries']:>6} "
+              f"{stats['dropped']:>6} {controller.stats()['rx_errors']:>6} {median:>8} {worst:>6}")
+
+    # 线路噪声全是假帧头：重新找帧头是循环而不是递归
+    noise = bytes((uart_link.SOF,)) * 5000
+    received = []
+    parser = uart_link.FrameParser(lambda msg_type, seq, payload: received.append(payload))
+    start = time.perf_counter()
+    parser.feed(noise + uart_link.encode_frame(uart_link.MSG_UNLOCK, 1, "用户1".encode()))
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{len(noise)} 字节 0x{uart_link.SOF:02X} 噪声后接一帧: 收到 {len(received)} 帧，"
+          f"坏帧 {parser.errors}，{elapsed:.1f} ms")
+
+    # 伪终端：同一套帧经过真实的tty驱动
+    try:
+        master, slave = sim.PtyUART.pair()
+    except (OSError, AttributeError) as e:
+        print(f"伪终端不可用: {e}")
+        return
+    clock = hal_clock = sim.SimClock()
+    device = uart_link.UartLink(master, hal_clock, heartbeat_ms=0)
+    replies = []
+    device.on_message = lambda msg_type, payload: replies.append(payload)
+    controller = uart_link.UartLink(slave, clock, on_command=lambda text: [text.upper()], heartbeat_ms=0)
+    for k in range(events // 10):
+        device.send(uart_link.MSG_COMMAND, f"ping {k}")
+    deadline = time.perf_counter() + 5
+    while (len(replies) < events // 10 or not device.idle()) and time.perf_counter() < deadline:
+        device.poll()
+        controller.poll()
+        time.sleep(0.001)
+    expected = [f"PING {k}".encode() for k in range(events // 10)]
+    print(f"伪终端 {master.slave_name}: 命令 {events // 10} 条，回复 {len(replies)} 条，"
+          f"顺序一致 {replies == expected}，链路 {device.stats()}")
+
+
+def bench_events(count=1000, spacing_ms=10000, poll_ms=10):
+    print(f"事件日志: {count} 个事件（每 {spacing_ms // 1000} 秒一个），每条写flash vs 按页批量；随后经UART回环导出并解码为CSV")
+    print("（flash按扇区擦写，每次写入至少改写一个 512 字节扇区）")
+    print(f"{'模式':<8} {'flash写次数':>10} {'改写字节':>9} {'记录(us/条)':>11} {'写入(us/次)':>11}  统计")
+    with tempfile.TemporaryDirectory() as tmp:
+        # 原来没有日志；对照为每个事件立即追加一条到文件
+        path = os.path.join(tmp, "naive.log")
+        start = time.perf_counter()
+        for k in range(count):
+            with open(path, "ab") as f:
+                f.write(bytes(event_log.RECORD_SIZE))
+        elapsed = (time.perf_counter() - start) * 1e6
+        print(f"{'逐条追加':<8} {count:>10} {count * event_log.PAGE_SIZE:>9} {'-':>11} {elapsed / count:>11.1f}")
+
+        path = os.path.join(tmp, event_log.LOG_FILE)
+        log = event_log.EventLog(path, clock=sim.SimClock())
+        kinds = (event_log.EV_ACCEPT, event_log.EV_REJECT, event_log.EV_LOW_CONFIDENCE, event_log.EV_ACCEPT)
+        record_us = 0.0
+        flush_us = 0.0
+        writes = 0
+        for k in range(count):
+            now = k * spacing_ms
+            start = time.perf_counter()
+            log.record(kinds[k % len(kinds)], now, k % 3, 0.9 + (k % 50) / 1000, 0.5 + (k % 6) / 10, 1 + k % 6,
+                       (21000, 940, 4300, 330, 160, 180), 60000 - k)
+            record_us += time.perf_counter() - start
+            if log.due(now):
+                start = time.perf_counter()
+                writes += log.flush(now)
+                flush_us += time.perf_counter() - start
+        writes += log.flush(now)   # 关机前写出剩下的记录
+        stats = log.stats()
+        print(f"{'按页批量':<8} {writes:>10} {writes * event_log.PAGE_SIZE:>9} {record_us * 1e6 / count:>11.1f} "
+              f"{flush_us * 1e6 / max(1, writes):>11.1f}  {stats}")
+
+        # 重新上电：接着最新一页写，序号连续
+        kept = list(log.records())
+        reopened = event_log.EventLog(path)
+        print(f"重新打开: 下一条序号 {reopened.seq}（写入 {count} 条），flash中保留 {len(list(reopened.records()))} 条 "
+              f"（{log.pages} 页 × {event_log.PER_PAGE} 条循环覆盖）")
+
+        clock = sim.SimClock()
+        device_uart, controller_uart = sim.loopback_pair(clock)
+        device = uart_link.UartLink(device_uart, clock, heartbeat_ms=0)
+        controller = uart_link.UartLink(controller_uart, clock, heartbeat_ms=0)
+        finished = []
+        controller.on_message = lambda msg_type, payload: finished.append(clock.ticks_ms()) \
+            if msg_type == uart_link.MSG_EVENTS and not payload else None
+        exporter = event_log.Exporter(log, device)
+        start = clock.ticks_ms()
+        while not finished and clock.ticks_ms() - start < 600000:
+            exporter.pump()
+            device.poll()
+            controller.poll()
+            clock.sleep_ms(poll_ms)
+        capture = b"".join(data for _, data in device_uart.tx)
+        decoded = event_log.records_from_capture(capture)
+        out = io.StringIO()
+        event_log.write_csv(decoded, out, ["用户1", "用户2", "用户3"])
+        rows = out.getvalue().splitlines()
+        elapsed = (finished[0] - start) if finished else float("nan")
+        print(f"UART导出: {exporter.sent} 条 {len(capture)} 字节，用时 {elapsed / 1000:.1f} 秒（每 {poll_ms} ms 写 {device.max_write} 字节），"
+              f"解码 {len(decoded)} 条，与日志一致 {decoded == kept}，CSV {len(rows) - 1} 行")
+        print(f"  {rows[0]}")
+        print(f"  {rows[1]}")
+
+
+def drift_scenario(sessions=12, step=2):
+    """录入后每次到访环境光都比上次再偏一点；每三次中有一次陌生人在同样的光照下到访"""
+    plan = [(6, 0), (20, None)]
+    genuine = []
+    strangers = []
+    for k in range(1, sessions + 1):
+        light = k * step
+        genuine.append(sum(entry[0] for entry in plan))
+        plan += [(40, 0, 1.0, light), (100, None)]
+        if k % 3 == 0:
+            strangers.append(sum(entry[0] for entry in plan))
+            plan += [(40, 1, 1.0, light), (100, None)]
+    return plan, genuine, strangers
+
+
+def bench_adapt():
+    plan, genuine, strangers = drift_scenario()
+    print(f"在线模板更新: 录入后环境光逐次漂移（{len(genuine)} 次本人到访, {len(strangers)} 次陌生人到访）")
+    print(f"{'模式':<8} {'本人放行':>8} {'陌生人放行':>10} {'最后一次放行':>12} {'模板数':>6}  更新统计 / 判决统计")
+    frames = sim.synthetic_sequence(plan)
+    saved = lock.adapt_enabled, lock.adapt_min_interval_ms, lock.adapt_save_interval_ms
+    try:
+        for label, enabled in (("固定模板", False), ("在线更新", True)):
+            lock.adapt_enabled = enabled
+            lock.adapt_min_interval_ms = 2000      # 模拟中到访间隔只有几秒
+            lock.adapt_save_interval_ms = 5000
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                board, timings = sim.run(frames)
+            finally:
+                sys.stdout = saved_stdout
+            times = board.camera.frame_times
+            unlocks = sim.unlock_times(board)
+
+            def unlocked(start):
+                begin = times[start]
+                end = times[min(len(times) - 1, start + 100)]
+                return any(begin <= t < end for t in unlocks)
+
+            accepted = [unlocked(start) for start in genuine]
+            stranger_accepts = sum(unlocked(start) for start in strangers)
+            updates = lock.updater.stats() if lock.updater is not None else {}
+            print(f"{label:<8} {sum(accepted):>5}/{len(accepted)} {stranger_accepts:>7}/{len(strangers)} "
+                  f"{str(accepted[-1]):>12} {len(lock.updater.gallery) if lock.updater else lock.faces_per_user:>6}  "
+                  f"{updates} {timings['判决']}")
+    finally:
+        lock.adapt_enabled, lock.adapt_min_interval_ms, lock.adapt_save_interval_ms = saved
+
+
+def quality_scenario(arrivals=6):
+    """本人每次走近时前几帧欠曝带噪、随后几帧侧脸，再正对镜头；中间穿插同样走近的陌生人"""
+    plan = [(6, 0), (20, None)]
+    genuine = []
+    strangers = []
+    for k in range(arrivals):
+        genuine.append(sum(entry[0] for entry in plan))
+        plan += [(3, 0, 0.4), (3, 0, 1.0, 0, 0, 0.25), (60, 0), (100, None)]
+        if k % 2:
+            strangers.append(sum(entry[0] for entry in plan))
+            plan += [(3, 1, 0.4), (3, 1, 1.0, 0, 0, 0.25), (60, 1), (100, None)]
+    return plan, genuine, strangers
+
+
+def bench_quality():
+    print("人脸质量门控: 欠曝/侧脸的帧直接提取特征 vs 先过质量门控（走近时先3帧欠曝、3帧侧脸）")
+    print(f"{'模式':<6} {'解锁中位(ms)':>12} {'最慢(ms)':>10} {'未解锁':>6} {'陌生人放行':>10} "
+          f"{'LBP次数':>8} {'门控(ms)':>9}  判决统计 / 门控统计")
+    plan, genuine, strangers = quality_scenario()
+    frames = sim.synthetic_sequence(plan)
+    saved = lock.quality_gate_enabled
+    try:
+        for label, enabled in (("无门控", False), ("质量门控", True)):
+            lock.quality_gate_enabled = enabled
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                board, timings = sim.run(frames)
+            finally:
+                sys.stdout = saved_stdout
+            latencies, missed = unlock_latencies(board, genuine)
+            median = latencies[len(latencies) // 2] if latencies else float("nan")
+            worst = latencies[-1] if latencies else float("nan")
+            times = board.camera.frame_times
+            unlocks = sim.unlock_times(board)
+            stranger_accepts = sum(1 for start in strangers
+                                   if any(times[start] <= t < times[min(len(times) - 1, start + 166)] for t in unlocks))
+            stages = lock.profiler.stages
+            lbp = stages["lbp"].summary()[0] if "lbp" in stages else 0
+            gate = stages["quality"].summary()[2] / 1000 if "quality" in stages else 0.0
+            gate_stats = lock.quality_gate.stats() if lock.quality_gate is not None else {}
+            print(f"{label:<6} {median:>12} {worst:>10} {missed:>6} {stranger_accepts:>7}/{len(strangers)} "
+                  f"{lbp:>8} {gate:>9.2f}  {timings['判决']} {gate_stats}")
+    finally:
+        lock.quality_gate_enabled = saved
+
+
+def detect_scenario(arrivals=6):
+    """本人多次到访；最后一位个子更高的访客人脸更小、位置更靠上，落在已学到的范围之外
+
+    返回 (帧, 本人到访起点, 范围外访客的起始帧下标)。
+    """
+    plan = [(6, 0), (20, None)]
+    genuine = []
+    for _ in range(arrivals):
+        genuine.append(sum(entry[0] for entry in plan))
+        plan += [(30, 0), (100, None)]
+    frames = sim.synthetic_sequence(plan)
+    outside = len(frames)
+    frames += sim.synthetic_sequence([(40, 1), (100, None)], face_size=56, seed=1, offset_y=-70)
+    return frames, genuine, outside
+
+
+def bench_detect(window_us=0.3):
+    print(f"检测调度: 整帧全尺度扫描 vs 按学到的尺寸/高度限制（每窗口 {window_us} us 模拟耗时）")
+    print("召回按帧统计：范围内为本人到访，范围外为最后那位访客（受限扫描找不到，要等不受限扫描）；"
+          "负载为受限扫描耗时的滑动平均，超出预算才收紧阈值和级数")
+    print(f"{'模式':<10} {'检测(ms)':>9} {'负载(ms)':>8} {'窗口/次':>8} {'范围内召回':>10} {'范围外召回':>10} "
+          f"{'解锁中位(ms)':>12} {'未解锁':>6}  调度统计")
+    frames, genuine, outside = detect_scenario()
+    saved = lock.detect_schedule_enabled, lock.detect_budget_ms, sim.HAAR_WINDOW_US
+    sim.HAAR_WINDOW_US = window_us
+    try:
+        for label, enabled, budget in (("整帧扫描", False, 40), ("调度", True, 40), ("调度+预算5ms", True, 5)):
+            lock.detect_schedule_enabled = enabled
+            lock.detect_budget_ms = budget
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                board, timings = sim.run(frames)
+            finally:
+                sys.stdout = saved_stdout
+            camera = board.camera
+            detect_ms = camera.detect_us / max(1, camera.detect_calls) / 1000
+            latencies, missed = unlock_latencies(board, genuine)
+            median = latencies[len(latencies) // 2] if latencies else float("nan")
+            stats = lock.detector.stats() if lock.detector is not None else {}
+            stats.pop("avg_ms", None)
+            load = lock.detector.avg_us / 1000 if lock.detector is not None else detect_ms
+            inside_found = sum(1 for k in camera.found_indices if k < outside)
+            inside_total = sum(1 for k in camera.face_indices if k < outside)
+            recall_in = f"{inside_found}/{inside_total}"
+            recall_out = f"{camera.found_frames - inside_found}/{camera.face_frames - inside_total}"
+            print(f"{label:<10} {detect_ms:>9.1f} {load:>8.1f} {int(camera.detect_windows) // max(1, camera.detect_calls):>8} "
+                  f"{recall_in:>10} {recall_out:>10} {median:>12} {missed:>6}  {stats}")
+    finally:
+        lock.detect_schedule_enabled, lock.detect_budget_ms, sim.HAAR_WINDOW_US = saved
+
+
+ENROLL_STREAM = [(30, 0), (30, 0, 1.0, 6), (30, 0, 1.0, 0, 0, 0.05), (30, 0, 1.0, -6)]
+
+
+def enroll_scenario():
+    """录入时本人在镜头前站约4秒，期间光照和朝向略有变化；之后在不同光照/朝向下到访，穿插陌生人"""
+    plan = ENROLL_STREAM + [(30, None)]
+    genuine = []
+    strangers = []
+    for k, (light, yaw) in enumerate(((0, 0), (10, 0), (-10, 0), (0, 0.07), (8, 0.05), (-8, 0.05))):
+        genuine.append(sum(entry[0] for entry in plan))
+        plan += [(40, 0, 1.0, light, 0, yaw), (100, None)]
+        if k % 2:
+            strangers.append(sum(entry[0] for entry in plan))
+            plan += [(40, 1, 1.0, light, 0, yaw), (100, None)]
+    return plan, genuine, strangers
+
+
+def bench_enroll():
+    print("流式录入: 每张照片前等2秒取第一张合格人脸 vs 3秒窗口内挑最分散的6个（虚拟时钟，含两次2秒蓝灯提示）")
+    print(f"{'模式':<6} {'录入(ms)':>9} {'录入帧数':>8} {'模板平均相似':>12} {'最高':>6} "
+          f"{'本人放行':>8} {'陌生人放行':>10}  判决统计")
+    plan, genuine, strangers = enroll_scenario()
+    frames = sim.synthetic_sequence(plan)
+    enroll_frames = sim.synthetic_sequence(ENROLL_STREAM)
+    saved = lock.enroll_streaming, lock.adapt_enabled
+    try:
+        for label, streaming in (("逐张拍照", False), ("流式录入", True)):
+            lock.enroll_streaming = streaming
+            lock.adapt_enabled = False     # 只比较录入的模板
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                with tempfile.TemporaryDirectory() as tmp:
+                    board = sim.SimBoard(enroll_frames)
+                    lock.setup(board)
+                    start = board.clock.ticks_ms()
+                    gallery = lock.load_or_enroll(os.path.join(tmp, "faces.bin"))
+                    elapsed = board.clock.ticks_ms() - start
+                    used = board.camera.index
+                board, timings = sim.run(frames)
+            finally:
+                sys.stdout = saved_stdout
+            mean, high = enrollment.pairwise_spread([gallery.template(k) for k in range(len(gallery))])
+            times = board.camera.frame_times
+            unlocks = sim.unlock_times(board)
+
+            def unlocked(start):
+                begin = times[start]
+                end = times[min(len(times) - 1, start + 100)]
+                return any(begin <= t < end for t in unlocks)
+
+            accepted = sum(unlocked(start) for start in genuine)
+            stranger_accepts = sum(unlocked(start) for start in strangers)
+            print(f"{label:<6} {elapsed:>9} {used:>8} {mean:>12.3f} {high:>6.3f} "
+                  f"{accepted:>5}/{len(genuine)} {stranger_accepts:>7}/{len(strangers)}  {timings['判决']}")
+
+        # 录入超时：样本不足时整次作废并重新采集；一直录不完（这里帧用完）时不保存模板
+        lock.enroll_streaming = True
+        timeout = lock.enroll_timeout_ms
+        lock.enroll_timeout_ms = 2000
+        for label, plan in (("先超时再录入", [(60, None)] + ENROLL_STREAM), ("始终无人", [(200, None)])):
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = os.path.join(tmp, "faces.bin")
+                    board = sim.SimBoard(sim.synthetic_sequence(plan))
+                    lock.setup(board)
+                    gallery = lock.load_or_enroll(path)
+                    saved_file = os.path.exists(path)
+            finally:
+                sys.stdout = saved_stdout
+            print(f"  {label}: 模板 {len(gallery)} 个, 用户 {len(gallery.names)} 位, 已保存 {saved_file}")
+        lock.enroll_timeout_ms = timeout
+    finally:
+        lock.enroll_streaming, lock.adapt_enabled = saved
+
+
+def failing_extraction(pattern):
+    """按 pattern（True 为失败）循环让 lock 的特征提取失败，模拟内存不足等偶发故障"""
+    extract = face_features.extract_simple_features
+    calls = [0]
+
+    def extract_or_fail(face, profiler=None, out=None):
+        k = calls[0]
+        calls[0] += 1
+        if pattern[k % len(pattern)]:
+            return None
+        return extract(face, profiler, out)
+    return extract_or_fail
+
+
+def bench_fusion():
+    print("多帧融合判决: 单帧+3秒冷却 vs 序贯证据累积（本人到来的前两帧画质差）；"
+          "另加每3次特征提取失败2次（失败帧不计入判决）")
+    print(f"{'每次最多帧数':>10} {'提取失败':>8} {'解锁中位(ms)':>12} {'最慢(ms)':>10} {'未解锁':>6}  判决统计")
+    plan, genuine = fusion_scenario()
+    frames = sim.synthetic_sequence(plan)
+    saved = lock.fusion_max_frames, lock.extract_simple_features
+    try:
+        for max_frames, failures in ((1, None), (saved[0], None), (1, (True, True, False)),
+                                     (saved[0], (True, True, False))):
+            lock.fusion_max_frames = max_frames
+            lock.extract_simple_features = failing_extraction(failures) if failures else saved[1]
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                board, timings = sim.run(frames)
+            finally:
+                sys.stdout = saved_stdout
+            latencies, missed = unlock_latencies(board, genuine)
+            median = latencies[len(latencies) // 2] if latencies else float("nan")
+            worst = latencies[-1] if latencies else float("nan")
+            label = "2/3" if failures else "无"
+            print(f"{max_frames:>10} {label:>8} {median:>12} {worst:>10} {missed:>6}  {timings['判决']}")
+    finally:
+        lock.fusion_max_frames, lock.extract_simple_features = saved
+
+
+def random_templates(count, seed=0, dim=face_features.FEATURE_DIM):
+    rng = random.Random(seed)
+    return [[rng.randint(0, 120) for _ in range(dim)] for _ in range(count)]
+
+
+def bench_gallery(repeat=5, faces_per_user=6):
+    print(f"模板匹配: 逐模板 calculate_balanced_similarity vs Gallery.match（每人{faces_per_user}个模板）")
+    print(f"{'用户数':>6} {'旧(ms)':>10} {'定点(ms)':>10} {'numpy(ms)':>10} {'定点误差':>10} {'numpy误差':>10}")
+    saved_np = face_matcher.np
+    probe = random_templates(1, seed=99)[0]
+    for users in GALLERY_USERS:
+        templates = random_templates(users * faces_per_user, seed=users)
+        gallery = face_matcher.Gallery()
+        for k, t in enumerate(templates):
+            gallery.add(f"用户{k // faces_per_user + 1}", t)
+
+        def legacy():
+            return [face_matcher.calculate_balanced_similarity(probe, t) for t in templates]
+
+        expected = legacy()
+        face_matcher.np = None
+        got = gallery.scores(probe)
+        t_buf = timeit(lambda: gallery.match_users(probe), repeat) / 1000
+        err = max(abs(a - b) for a, b in zip(got, expected))
+        if err * face_matcher.SCORE_ONE > face_matcher.FIXED_TOLERANCE:
+            raise SystemExit(f"定点得分超出容差: {users} 用户, 误差 {err:.1e}")
+
+        t_np = err_np = float("nan")
+        if saved_np is not None:
+            face_matcher.np = saved_np
+            got_np = gallery.scores(probe)
+            err_np = max(abs(a - b) for a, b in zip(got_np, expected))
+            t_np = timeit(lambda: gallery.match_users(probe), repeat) / 1000
+        face_matcher.np = saved_np
+
+        t_old = timeit(legacy, repeat) / 1000
+        print(f"{users:>6} {t_old:>10.2f} {t_buf:>10.2f} {t_np:>10.2f} {err:>10.1e} {err_np:>10.1e}")
+
+
+def clustered_templates(users, faces_per_user, seed=0, spread=12, dim=face_features.FEATURE_DIM):
+    """每位用户围绕自己的基准向量加噪声，近似真实的类内/类间分布"""
+    rng = random.Random(seed)
+    templates = []
+    for _ in range(users):
+        base = [rng.randrange(256) for _ in range(dim)]
+        for _ in range(faces_per_user):
+            templates.append([min(255, max(0, v + rng.randint(-spread, spread))) for v in base])
+    return templates
+
+
+def bench_identify(repeat=5, faces_per_user=6, top_k=3, probes=20):
+    print(f"多用户识别: 全量 match_users vs 粗到精 identify（每人{faces_per_user}个模板, top_k={top_k}）")
+    print(f"{'用户数':>6} {'全量(ms)':>10} {'索引(ms)':>10} {'全量np(ms)':>11} {'索引np(ms)':>11} {'首位一致':>8}")
+    saved_np = face_matcher.np
+    rng = random.Random(7)
+    for users in GALLERY_USERS + (200,):
+        templates = clustered_templates(users, faces_per_user, seed=users)
+        gallery = face_matcher.Gallery()
+        for k, t in enumerate(templates):
+            gallery.add(f"用户{k // faces_per_user + 1}", t)
+        # 探针: 随机用户的某个模板再加噪声
+        probe_list = []
+        for _ in range(probes):
+            t = templates[rng.randrange(len(templates))]
+            probe_list.append([min(255, max(0, v + rng.randint(-12, 12))) for v in t])
+
+        def best(results):
+            return max(results, key=lambda r: r["avg_score"])["name"]
+
+        agree = sum(best(gallery.match_users(p)) == best(gallery.identify(p, top_k)) for p in probe_list)
+        probe = probe_list[0]
+        gallery.centroids()  # 平均模板在录入后构建一次，不计入识别耗时
+
+        timing = []
+        for use_np in (False, True):
+            if use_np and saved_np is None:
+                timing += [float("nan"), float("nan")]
+                continue
+            face_matcher.np = saved_np if use_np else None
+            timing.append(timeit(lambda: gallery.match_users(probe), repeat) / 1000)
+            timing.append(timeit(lambda: gallery.identify(probe, top_k), repeat) / 1000)
+        face_matcher.np = saved_np
+        print(f"{users:>6} {timing[0]:>10.2f} {timing[1]:>10.2f} {timing[2]:>11.2f} {timing[3]:>11.2f} "
+              f"{agree:>5}/{probes}")
+
+
+def legacy_baseline(user_faces):
+    """原 compute_baseline 每次上电做的用户内部两两比较"""
+    similarities = []
+    for user in user_faces:
+        faces = user["faces"]
+        for i in range(len(faces)):
+            for j in range(i + 1, len(faces)):
+                similarities.append(face_matcher.calculate_balanced_similarity(faces[i], faces[j]))
+    return similarities
+
+
+def calibration_matches(calib, gallery, impostors):
+    """增量标定与从头重算的阈值、异人样本数和异人最大值都一致"""
+    check = calibration.Calibration(lock.recognition_threshold)
+    check.rebuild(gallery, impostors)
+    for k, name in enumerate(check.names):
+        user = calib.names.index(name)
+        if (calib.impostor[user].count != check.impostor[k].count
+                or abs((calib.impostor[user].extreme or 0) - (check.impostor[k].extreme or 0)) > 1e-9):
+            return False
+    return (calib.thresholds.keys() == check.thresholds.keys()
+            and all(abs(calib.thresholds[name][0] - check.thresholds[name][0]) < 1e-9 for name in check.thresholds))
+
+
+def bench_calibration(faces_per_user=6, impostors=32, repeat=3):
+    print(f"按用户标定（设备定点路径，每人{faces_per_user}个模板，陌生人集{impostors}个模板）")
+    print(f"{'用户数':>6} {'原基线(ms)':>10} {'完整标定(ms)':>12} {'加载.cal(ms)':>12} {'新增一人(ms)':>12} {'增量=重算':>9} {'替换(ms)':>8} {'替换=重算':>9}")
+    saved_np = face_matcher.np
+    face_matcher.np = None
+    tmp = tempfile.mkdtemp()
+    try:
+        impostor_set = face_matcher.Gallery()
+        for k, t in enumerate(clustered_templates(impostors // 4, 4, seed=99)):
+            impostor_set.add(f"陌生人{k // 4}", t)
+        for users in (1, 5, 10, 20):
+            templates = clustered_templates(users + 1, faces_per_user, seed=users)
+            gallery = face_matcher.Gallery()
+            for k, t in enumerate(templates[:users * faces_per_user]):
+                gallery.add(f"用户{k // faces_per_user + 1}", t)
+            user_faces = gallery.user_faces()
+            legacy = timeit(lambda: legacy_baseline(user_faces), repeat) / 1000
+
+            calib = calibration.Calibration(lock.recognition_threshold)
+            full = timeit(lambda: calib.rebuild(gallery, impostor_set), repeat) / 1000
+            path = os.path.join(tmp, f"{users}.cal")
+            calib.save(path, gallery)
+            loaded = calibration.Calibration(lock.recognition_threshold)
+            load = timeit(lambda: loaded.load(path, gallery), repeat) / 1000
+
+            first = len(gallery)
+            for t in templates[first:]:
+                gallery.add(f"用户{users + 1}", t)
+            start = time.perf_counter()
+            calib.add_templates(gallery, range(first, len(gallery)), impostor_set)
+            incremental = (time.perf_counter() - start) * 1000
+            same = calibration_matches(calib, gallery, impostor_set)
+
+            # 在线更新替换模板：每位用户的第二个模板换成一个更像别人的新模板
+            evicted = {}
+            replacements = clustered_templates(users + 1, 1, seed=users + 50)
+            for label, members in enumerate(gallery.members()):
+                index = members[1]
+                evicted[index] = gallery.template(index)
+                gallery.replace(index, replacements[(label + 1) % len(replacements)])
+            start = time.perf_counter()
+            calib.add_templates(gallery, sorted(evicted), impostor_set, evicted)
+            replaced = (time.perf_counter() - start) * 1000
+            same_replaced = calibration_matches(calib, gallery, impostor_set)
+            print(f"{users:>6} {legacy:>10.1f} {full:>12.1f} {load:>12.2f} {incremental:>12.1f} {str(same):>9} "
+                  f"{replaced:>8.1f} {str(same_replaced):>9}")
+
+        # 家用的两人模板库：没有陌生人模板集时阈值不能低于默认阈值
+        gallery = face_matcher.Gallery()
+        for k, t in enumerate(clustered_templates(2, faces_per_user, seed=3, spread=24)):
+            gallery.add(f"用户{k // faces_per_user + 1}", t)
+        for label, impostors in (("无陌生人集", None), ("有陌生人集", impostor_set)):
+            calib = calibration.Calibration(lock.recognition_threshold)
+            calib.rebuild(gallery, impostors)
+            lowest = min(t[0] for t in calib.thresholds.values())
+            print(f"  两位用户、{label}: 最低识别阈值 {lowest:.3f}（默认 {lock.recognition_threshold}，"
+                  f"下限 {calibration.MIN_THRESHOLD}）")
+            if impostors is None and lowest < lock.recognition_threshold:
+                raise SystemExit("没有陌生人模板集时标定阈值低于默认阈值")
+    finally:
+        face_matcher.np = saved_np
+
+
+TEMPLATE_USERS = (1, 10, 100)
+
+
+def legacy_user_faces(templates, faces_per_user):
+    """原录入阶段保留的 [{"name", "faces": [[...], ...]}] 结构"""
+    users = []
+    for k, t in enumerate(templates):
+        if k % faces_per_user == 0:
+            users.append({"name": f"用户{k // faces_per_user + 1}", "faces": []})
+        users[-1]["faces"].append(list(t))
+    return users
+
+
+def packed_gallery(templates, faces_per_user, quantized):
+    gallery = face_matcher.Gallery(quantized=quantized)
+    for k, t in enumerate(templates):
+        gallery.add(f"用户{k // faces_per_user + 1}", t)
+    return gallery
+
+
+def traced(build):
+    """build() 的结果占用的Python堆字节数（tracemalloc 实测）"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, result
+
+
+def device_template_bytes(gallery):
+    """设备上每个模板的字节数：一行数据 + 用户下标(B) + 和(H) + 方差(I)"""
+    return gallery.row_bytes + 1 + 2 + 4
+
+
+def bench_templates(faces_per_user=6, repeat=5):
+    quantized = face_features.DEFAULT_LBP_SPEC.dim
+    print(f"模板存储（每人{faces_per_user}个模板，每用户字节数）: 列表字典 vs 紧凑 Gallery vs LBP 4位量化")
+    print("主机为 tracemalloc 实测；设备为估算（MicroPython 小整数不装箱，列表每元素4字节）")
+    print(f"{'用户数':>6} {'列表(主机)':>10} {'8位(主机)':>10} {'4位(主机)':>10} "
+          f"{'列表(设备)':>10} {'8位(设备)':>10} {'4位(设备)':>10}")
+    dim = face_features.FEATURE_DIM
+    for users in TEMPLATE_USERS:
+        templates = clustered_templates(users, faces_per_user, seed=users)
+        legacy, _ = traced(lambda: legacy_user_faces(templates, faces_per_user))
+        full, gallery = traced(lambda: packed_gallery(templates, faces_per_user, 0))
+        small, packed = traced(lambda: packed_gallery(templates, faces_per_user, quantized))
+        # 设备上列表: 16字节对象头 + 每元素4字节；外加每位用户的字典
+        legacy_device = faces_per_user * (16 + 4 * dim) + 64
+        print(f"{users:>6} {legacy / users:>10.0f} {full / users:>10.0f} {small / users:>10.0f} "
+              f"{legacy_device:>10} {faces_per_user * device_template_bytes(gallery):>10} "
+              f"{faces_per_user * device_template_bytes(packed):>10}")
+
+    # 量化的精度代价：评估数据集上的 EER，以及量化前后的得分偏差
+    samples = evaluate.synthetic_dataset()
+    features, _ = evaluate.extract_all(samples)
+    valid = [f for f in features if f is not None]
+    rounded = packed_gallery(valid, 1, quantized)
+    quantized_features = [list(rounded.template(k)) if f is not None else None
+                          for k, f in enumerate(features)]
+    exact, _ = evaluate.verification(samples, features, face_matcher.calculate_balanced_similarity)
+    coarse, _ = evaluate.verification(samples, quantized_features, face_matcher.calculate_balanced_similarity)
+    drift = max(abs(face_matcher.calculate_balanced_similarity(a, b)
+                    - face_matcher.calculate_balanced_similarity(a, rounded.template(k)))
+                for a in valid[:20] for k, b in enumerate(valid))
+    print(f"评估数据集 EER: 8位 {exact['eer']:.2%}, 4位 {coarse['eer']:.2%}；单侧量化的最大得分偏差 {drift:.4f}")
+
+    # 定点匹配速度：4位模板逐行解包的额外开销
+    saved_np = face_matcher.np
+    face_matcher.np = None
+    try:
+        templates = clustered_templates(100, faces_per_user)
+        probe = templates[0]
+        for label, q in (("8位", 0), ("4位", quantized)):
+            gallery = packed_gallery(templates, faces_per_user, q)
+            t = timeit(lambda: gallery.match_users(probe), repeat) / 1000
+            print(f"  100 用户定点匹配 {label}: {t:.2f} ms")
+    finally:
+        face_matcher.np = saved_np
+
+
+def bench_fixed(pairs=5000, repeat=200, seed=1):
+    print(f"定点相似度: calculate_fixed_similarity vs 浮点参考（{pairs} 对随机向量）")
+    one = face_matcher.SCORE_ONE
+    tolerance = face_matcher.FIXED_TOLERANCE
+    rng = random.Random(seed)
+    dim = face_features.FEATURE_DIM
+    results = []
+    for _ in range(pairs):
+        a = [rng.randrange(256) for _ in range(dim)]
+        # 从几乎相同到完全无关的各种距离
+        spread = rng.choice((1, 3, 8, 16, 32, 64, 128, 255))
+        b = [min(255, max(0, v + rng.randint(-spread, spread))) for v in a]
+        results.append((face_matcher.calculate_balanced_similarity(a, b),
+                        face_matcher.calculate_fixed_similarity(a, b)))
+
+    worst = max(abs(f * one - x) for f, x in results)
+    # 单调性: 浮点得分相差超过两倍容差时，定点顺序必须一致
+    results.sort()
+    inversions = 0
+    j = 0
+    best_fixed_below = -1
+    for f, x in results:
+        while results[j][0] < f - 2 * tolerance / one:
+            best_fixed_below = max(best_fixed_below, results[j][1])
+            j += 1
+        if x < best_fixed_below:
+            inversions += 1
+
+    a = [rng.randrange(256) for _ in range(dim)]
+    b = [min(255, max(0, v + rng.randint(-16, 16))) for v in a]
+    t_float = timeit(lambda: face_matcher.calculate_balanced_similarity(a, b), repeat)
+    t_fixed = timeit(lambda: face_matcher.calculate_fixed_similarity(a, b), repeat)
+    print(f"  定标: 1.0 = {one}, 容差 {tolerance} ({tolerance / one:.1e})")
+    print(f"  最大偏差: {worst:.2f} / {one} ({worst / one:.1e}), 顺序颠倒: {inversions}")
+    print(f"  耗时: 浮点 {t_float:.1f} us, 定点 {t_fixed:.1f} us")
+    if worst > tolerance or inversions:
+        raise SystemExit("定点相似度与浮点参考不一致")
+
+
+def bench_store(repeat=5, faces_per_user=6):
+    print(f"模板存储: 保存/加载耗时与文件大小（每人{faces_per_user}个模板）")
+    print(f"{'用户数':>6} {'字节':>8} {'保存(ms)':>10} {'加载(ms)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, template_store.TEMPLATE_FILE)
+        for users in GALLERY_USERS:
+            gallery = face_matcher.Gallery()
+            for k, t in enumerate(random_templates(users * faces_per_user, seed=users)):
+                gallery.add(f"用户{k // faces_per_user + 1}", t)
+
+            size = template_store.save_templates(gallery, path)
+            t_save = timeit(lambda: template_store.save_templates(gallery, path), repeat) / 1000
+            t_load = timeit(lambda: template_store.load_templates(path), repeat) / 1000
+            loaded = template_store.load_templates(path)
+            if loaded is None or list(loaded.data) != list(gallery.data):
+                raise SystemExit(f"加载结果不一致: {users} 位用户")
+            print(f"{users:>6} {size:>8} {t_save:>10.2f} {t_load:>10.2f}")
+
+        # 更新日志写到一半断电：之后追加的记录不能被坏记录吞掉
+        journal = template_store.journal_path(path)
+        for label, reload_first in (("断电后直接追加", False), ("断电后重启再追加", True)):
+            gallery = face_matcher.Gallery()
+            for k, t in enumerate(random_templates(2 * faces_per_user, seed=7)):
+                gallery.add(f"用户{k // faces_per_user + 1}", t)
+            template_store.save_templates(gallery, path)
+            updates = random_templates(2, seed=8)
+            gallery.replace(1, updates[0])
+            template_store.append_update(gallery, 1, path)
+            with open(journal, "ab") as f:
+                f.write(bytes(template_store._record_size(gallery.dim) // 2))
+            if reload_first:
+                gallery = template_store.load_templates(path)
+            gallery.replace(2, updates[1])
+            records = template_store.append_update(gallery, 2, path)
+            loaded = template_store.load_templates(path)
+            same = loaded is not None and list(loaded.data) == list(gallery.data)
+            print(f"  {label}: 日志剩 {records} 条，重新加载与内存一致 {same}")
+            if not same:
+                raise SystemExit(f"更新日志损坏后丢了更新: {label}")
+
+
+def bench_pipeline():
+    print("完整流程（模拟器默认场景）")
+    frames = sim.default_scenario()
+    saved_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        board, timings = sim.run(frames)
+    finally:
+        sys.stdout = saved_stdout
+    for stage in ("录入/加载", "基线", "识别"):
+        print(f"  {stage}: {timings[stage]:.1f} ms")
+    print(f"  识别吞吐: {timings['识别帧数'] * 1000 / timings['识别']:.1f} 帧/秒")
+    camera = board.camera
+    print(f"  人脸检测: {camera.detect_calls} 次, 平均扫描 {camera.scanned_pixels // max(1, camera.detect_calls)} 像素/次")
+    print(f"  空闲帧: {camera.idle_frames}, 模式切换: {camera.mode_switches} 次")
+    print(f"  UART发送: {len(board.uart.tx)} 次")
+
+
+def bench_memory(repeats=3):
+    print("内存回收策略（长时间运行，每帧回收 vs 水位线回收）")
+    # 主机上只能比较回收次数、吞吐和Python分配峰值；
+    # MicroPython 堆碎片需在设备上看 stats() 的最低空闲堆
+    frames = sim.default_scenario() * repeats
+    saved = lock.gc_every_frame
+    try:
+        for label, every_frame in (("每帧回收", True), ("水位线回收", False)):
+            lock.gc_every_frame = every_frame
+            saved_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            tracemalloc.start()
+            try:
+                board, timings = sim.run(frames)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                sys.stdout = saved_stdout
+            mem = lock.memory.stats()
+            fps = timings['识别帧数'] * 1000 / timings['识别']
+            print(f"  {label:<6}: {fps:8.1f} 帧/秒, 显式回收 {mem['collections']:>5} 次, "
+                  f"跳过 {mem['skipped']:>5} 次, 分配峰值 {peak // 1024} KB")
+    finally:
+        lock.gc_every_frame = saved
+
+
+def bench_capture():
+    print("采集格式（模拟器默认场景）: RGB565整帧 vs 灰度采集+显示时转彩色")
+    # 主机帧率只反映Python开销；设备上的收益看帧缓冲字节数、转换次数和 snapshot/render 阶段耗时
+    print(f"{'格式':<10} {'帧/秒':>8} {'帧缓冲(KB/帧)':>14} {'显示':>6} {'转换':>6} {'转换平均(us)':>12}")
+    for capture in (hal.CAPTURE_RGB, hal.CAPTURE_GRAY):
+        saved_stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            board, timings = sim.run(sim.default_scenario(), capture=capture)
+        finally:
+            sys.stdout = saved_stdout
+        camera = board.camera
+        active = max(1, timings['识别帧数'] - camera.idle_frames)
+        render = lock.profiler.stages.get("render")
+        render_avg = render.summary()[2] if render else 0
+        print(f"{capture:<10} {timings['识别帧数'] * 1000 / timings['识别']:>8.1f} "
+              f"{camera.frame_bytes / active / 1024:>14.1f} {len(board.display.frames):>6} "
+              f"{camera.display_conversions:>6} {render_avg:>12}")
+
+
+BENCHES = {
+    "lbp": bench_lbp,
+    "grid": bench_grid,
+    "roi": bench_roi,
+    "gallery": bench_gallery,
+    "identify": bench_identify,
+    "fixed": bench_fixed,
+    "store": bench_store,
+    "pipeline": bench_pipeline,
+    "capture": bench_capture,
+    "fusion": bench_fusion,
+    "scheduler": bench_scheduler,
+    "link": bench_link,
+    "calibration": bench_calibration,
+    "adapt": bench_adapt,
+    "memory": bench_memory,
+    "templates": bench_templates,
+    "quality": bench_quality,
+    "detect": bench_detect,
+    "enroll": bench_enroll,
+    "events": bench_events,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHES)
+    for name in names:
+        BENCHES[name]()
+        print()
@@ -0,0 +1,301 @@
+"""按用户标定识别阈值
+
+原来录入后算出的用户内部相似度基线只打印不使用，阈值固定为 0.9 / 0.89，
+而且每次上电都要对每位用户的模板两两比较一遍。现在为每位用户维护两组
+平均得分（与判决用的 avg_score 同义）的累计统计（次数、和、平方和、极值）：
+    同人: 本人每个模板对其余模板的平均得分
+    异人: 其他用户的模板、附带的陌生人模板集（impostors.bin）对本人模板的平均得分
+新增模板时只重算模板有变化的用户，其他用户各加一个异人样本
+（Gallery.scores 一次遍历），再推出该用户的阈值。在线更新替换的模板先扣除
+旧模板的异人样本；旧模板恰是某用户的异人最大值时（最大值无法扣除）整体重算
+该用户。阈值：
+
+    同人下界 = 同人均值 - GENUINE_SIGMA * 同人标准差
+    异人上界 = 异人最大值（异人得分分布偏斜，按标准差外推会远高于实际最大值）
+    识别阈值 = 异人上界 + (同人下界 - 异人上界) * SECURITY
+    拒绝阈值 = 识别阈值 - REJECT_GAP
+两者重叠时识别阈值落在重叠区内，按 SECURITY 在误放行和拒识之间折中，并提示重新录入。
+识别阈值最低为 MIN_THRESHOLD，但没有陌生人模板集时不低于默认阈值：家用的模板库
+只有几位用户，仅凭其他用户的几个模板不足以说明陌生人得不到更高的分。
+
+统计和阈值存在模板文件旁的 .cal 文件里，并记下模板库的校验和，
+模板有变化时整体重算。
+"""
+import math
+import struct
+
+from template_store import checksum, encode_templates, write_atomic
+
+MAGIC = b"VBCL"
+VERSION = 1
+HEADER_FORMAT = "<4sBBHII"   # 魔数, 版本, 保留, 用户数, 模板库校验和, 正文校验和
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+USER_FORMAT = "<IfffIffff"   # 同人: 次数,和,平方和,最小; 异人: 次数,和,平方和,最大; 识别阈值
+USER_SIZE = struct.calcsize(USER_FORMAT)
+IMPOSTOR_FILE = "impostors.bin"
+
+GENUINE_SIGMA = 2.0
+SECURITY = 0.5          # 0 贴着异人上界，1 贴着同人下界
+OVERLAP_MARGIN = 0.005  # 只有一个模板时高出异人上界的余量
+REJECT_GAP = 0.01       # 与原来 0.9 / 0.89 的间隔相同
+MIN_THRESHOLD = 0.8     # 有陌生人模板集时的下限
+MAX_THRESHOLD = 0.995
+
+
+def calibration_path(template_path):
+    """faces.bin -> faces.cal"""
+    base = template_path[:-4] if template_path.endswith(".bin") else template_path
+    return base + ".cal"
+
+
+def impostor_path(template_path):
+    """与模板文件同目录的陌生人模板集"""
+    slash = template_path.rfind("/")
+    return template_path[:slash + 1] + IMPOSTOR_FILE
+
+
+def gallery_checksum(gallery):
+    return checksum(encode_templates(gallery))
+
+
+def _average(scores):
+    return sum(scores) / len(scores)
+
+
+def _usable(gallery, impostors):
+    """陌生人模板集存在、非空且维度与模板库一致"""
+    return impostors is not None and len(impostors) > 0 and impostors.dim == gallery.dim
+
+
+class ScoreStats:
+    """成对得分的累计统计"""
+
+    def __init__(self, count=0, total=0.0, total_sq=0.0, extreme=None):
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.extreme = extreme   # 同人记最小值，异人记最大值
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def std(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.total / self.count
+        return math.sqrt(max(0.0, self.total_sq / self.count - mean * mean))
+
+
+class Calibration:
+    """每位用户的同人/异人得分统计和由此推出的阈值
+
+    thresholds 是 {用户名: (识别阈值, 拒绝阈值)}，直接交给 SequentialDecision；
+    还没有异人统计的用户不在其中，判决时退回默认阈值。
+    """
+
+    def __init__(self, default_threshold):
+        self.default_threshold = default_threshold
+        self.has_impostors = False   # 最近一次标定是否用上了陌生人模板集
+        self.names = []
+        self.genuine = []
+        self.impostor = []
+        self.thresholds = {}
+        self.gallery_crc = None
+
+    def _ensure_user(self, name):
+        if name not in self.names:
+            self.names.append(name)
+            self.genuine.append(ScoreStats())
+            self.impostor.append(ScoreStats())
+        return self.names.index(name)
+
+    def update_user(self, gallery, label, impostors=None):
+        """重新统计一位用户（其模板有变化时）
+
+        同人样本: 每个模板与本人其余模板的平均得分（留一法）
+        异人样本: 其他用户的每个模板、陌生人集的每个模板与本人全部模板的平均得分
+        都与识别时 match_users() 给出的 avg_score 同义。代价约为 模板总数 × 本人模板数 次比较。
+        """
+        members = gallery.members()[label]
+        self.has_impostors = _usable(gallery, impostors)
+        user = self._ensure_user(gallery.names[label])
+        genuine = self.genuine[user] = ScoreStats()
+        impostor = self.impostor[user] = ScoreStats()
+        count = len(members)
+        if count > 1:
+            for k, t in enumerate(members):
+                scores = gallery.scores(gallery.template(t), members)
+                self._add(genuine, (sum(scores) - scores[k]) / (count - 1), min)
+        if count:
+            for index, other in enumerate(gallery.labels):
+                if other != label:
+                    self._add(impostor, _average(gallery.scores(gallery.template(index), members)), max)
+            if self.has_impostors:
+                for index in range(len(impostors)):
+                    self._add(impostor, _average(gallery.scores(impostors.template(index), members)), max)
+        self._update_threshold(user)
+
+    def add_templates(self, gallery, indices, impostors=None, evicted=None):
+        """模板 indices 已加入 gallery（新增或替换）：增量更新
+
+        模板有变化的用户整体重算；其他用户的模板没变，只需把每个新模板
+        作为一个异人样本加进去（与其全部模板比较一次）。evicted 为
+        {被替换的模板下标: 替换前的内容}，这些旧模板的异人样本先扣除；
+        扣除的正是该用户的异人最大值时，整体重算该用户。
+        """
+        evicted = evicted or {}
+        self.has_impostors = _usable(gallery, impostors)
+        changed = set(gallery.labels[index] for index in indices)
+        for label in changed:
+            self.update_user(gallery, label, impostors)
+        members = gallery.members()
+        for label, name in enumerate(gallery.names):
+            if label in changed or not members[label]:
+                continue
+            user = self._ensure_user(name)
+            stats = self.impostor[user]
+            stale = False
+            for index in indices:
+                old = evicted.get(index)
+                if old is not None:
+                    stale = self._remove(stats, _average(gallery.scores(old, members[label]))) or stale
+                self._add(stats, _average(gallery.scores(gallery.template(index), members[label])), max)
+            if stale:
+                self.update_user(gallery, label, impostors)
+            else:
+                self._update_threshold(user)
+
+    def rebuild(self, gallery, impostors=None):
+        """从头标定整个模板库"""
+        self.names = []
+        self.genuine = []
+        self.impostor = []
+        self.thresholds = {}
+        for label in range(len(gallery.names)):
+            self.update_user(gallery, label, impostors)
+        self.gallery_crc = gallery_checksum(gallery)
+
+    @staticmethod
+    def _add(stats, score, pick):
+        stats.count += 1
+        stats.total += score
+        stats.total_sq += score * score
+        stats.extreme = score if stats.extreme is None else pick(stats.extreme, score)
+
+    @staticmethod
+    def _remove(stats, score):
+        """扣除一个异人样本，扣除的是最大值（或已无样本）时返回 True，需要重算"""
+        stats.count -= 1
+        stats.total -= score
+        stats.total_sq -= score * score
+        return stats.count <= 0 or score >= stats.extreme
+
+    def _update_threshold(self, user):
+        genuine = self.genuine[user]
+        impostor = self.impostor[user]
+        name = self.names[user]
+        if not impostor.count:
+            # 不知道陌生人能得多少分，不敢放宽默认阈值
+            self.thresholds.pop(name, None)
+            return
+        high = self.impostor_high(user)
+        if not genuine.count:
+            # 只有一个模板：没有同人统计，至少避开已知的异人得分
+            threshold = max(self.default_threshold, high + OVERLAP_MARGIN)
+        else:
+            threshold = high + (self.genuine_low(user) - high) * SECURITY
+        floor = MIN_THRESHOLD if self.has_impostors else self.default_threshold
+        threshold = max(floor, min(MAX_THRESHOLD, threshold))
+        self.thresholds[name] = (threshold, threshold - REJECT_GAP)
+
+    def genuine_low(self, user):
+        stats = self.genuine[user]
+        return stats.mean() - GENUINE_SIGMA * stats.std()
+
+    def impostor_high(self, user):
+        return self.impostor[user].extreme
+
+    def overlapping(self):
+        """同人下界不高于异人上界的用户（阈值落在重叠区，建议重新录入）"""
+        return [name for k, name in enumerate(self.names)
+                if self.genuine[k].count and self.impostor[k].count
+                and self.genuine_low(k) <= self.impostor_high(k)]
+
+    def baseline(self):
+        """全部用户合并的同人统计 (平均, 最低, 标准差)，与原来的系统基线含义相同"""
+        merged = ScoreStats()
+        for stats in self.genuine:
+            if stats.count:
+                merged.count += stats.count
+                merged.total += stats.total
+                merged.total_sq += stats.total_sq
+                merged.extreme = stats.extreme if merged.extreme is None else min(merged.extreme, stats.extreme)
+        return merged.mean(), merged.extreme, merged.std()
+
+    def encode(self):
+        body = bytearray()
+        for k, name in enumerate(self.names):
+            raw = name.encode("utf-8")
+            body.append(len(raw))
+            body.extend(raw)
+            g = self.genuine[k]
+            i = self.impostor[k]
+            threshold = self.thresholds.get(name, (0.0, 0.0))[0]
+            body.extend(struct.pack(USER_FORMAT,
+                                    g.count, g.total, g.total_sq, g.extreme if g.extreme is not None else 0.0,
+                                    i.count, i.total, i.total_sq, i.extreme if i.extreme is not None else 0.0,
+                                    threshold))
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, len(self.names),
+                             self.gallery_crc or 0, checksum(body))
+        return header + body
+
+    def decode(self, data):
+        """从 bytes 恢复，格式或校验和不符时抛出 ValueError"""
+        if len(data) < HEADER_SIZE:
+            raise ValueError("文件过短")
+        magic, version, _, n_users, gallery_crc, crc = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+        if magic != MAGIC:
+            raise ValueError("魔数不符")
+        if version != VERSION:
+            raise ValueError(f"不支持的版本: {version}")
+        body = memoryview(data)[HEADER_SIZE:]
+        if checksum(body) != crc:
+            raise ValueError("校验和不符")
+
+        self.names = []
+        self.genuine = []
+        self.impostor = []
+        self.thresholds = {}
+        pos = 0
+        for _ in range(n_users):
+            length = body[pos]
+            name = str(bytes(body[pos + 1:pos + 1 + length]), "utf-8")
+            pos += 1 + length
+            (g_count, g_total, g_sq, g_min,
+             i_count, i_total, i_sq, i_max, threshold) = struct.unpack(USER_FORMAT, body[pos:pos + USER_SIZE])
+            pos += USER_SIZE
+            self.names.append(name)
+            self.genuine.append(ScoreStats(g_count, g_total, g_sq, g_min if g_count else None))
+            self.impostor.append(ScoreStats(i_count, i_total, i_sq, i_max if i_count else None))
+            if threshold > 0:
+                self.thresholds[name] = (threshold, threshold - REJECT_GAP)
+        self.gallery_crc = gallery_crc
+
+    def save(self, path, gallery):
+        """保存标定，并记下它对应的模板库"""
+        self.gallery_crc = gallery_checksum(gallery)
+        write_atomic(path, self.encode())
+
+    def load(self, path, gallery):
+        """加载与 gallery 对应的标定，文件不存在、无效或模板已变化时返回 False"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+        try:
+            self.decode(data)
+        except ValueError as e:
+            print(f"标定文件无效 {path}: {e}")
+            return False
+        return self.gallery_crc == gallery_checksum(gallery)
@@ -0,0 +1,156 @@
+"""多帧证据累积的识别判决
+
+跟踪到人脸期间每帧都提取特征并匹配，把各用户的得分换算成证据累加到
+一个短滑动窗口里：证据足够就立即放行，连续明显不匹配就提前拒绝，
+到了帧数上限仍未决定时，按原来的单帧规则对窗口内的平均得分做最终判断。
+max_frames = 1 时与原来的单帧判决完全相同。
+user_thresholds 给出按用户标定的 (识别阈值, 拒绝阈值)，没有的用户用默认阈值。
+"""
+
+# 判决结果
+PENDING = "pending"                # 证据不足，继续下一帧
+ACCEPT = "accept"                  # 身份验证成功
+UNSTABLE = "unstable"              # 得分够高但一致性不足
+LOW_CONFIDENCE = "low_confidence"  # 介于识别阈值和拒绝阈值之间
+REJECT = "reject"                  # 未识别出已知用户
+
+CONSISTENCY_MIN = 0.5  # 至少50%的样本超过拒绝阈值
+
+
+def consistency(result, reject_threshold):
+    """一个用户的样本中超过拒绝阈值的比例"""
+    scores = result["scores"]
+    high_scores = [s for s in scores if s > reject_threshold]
+    return len(high_scores) / len(scores)
+
+
+class SequentialDecision:
+    """序贯判决
+
+    每帧对每个候选用户记一份证据 (平均得分 - 识别阈值) / margin，
+    截断到 [-1, cap]，一致性不足时只记负证据；窗口内某用户证据和达到
+    accept_evidence 且该用户是当前帧最佳时放行。
+    拒绝证据为 (拒绝阈值 - 最佳得分) / margin，截断到 [0, cap]，
+    窗口内累计达到 reject_evidence 且没有任何用户有正证据时提前拒绝。
+    """
+
+    def __init__(self, recognition_threshold, reject_threshold, max_frames=6, window=4,
+                 margin=0.02, cap=2.0, accept_evidence=2.0, reject_evidence=3.0, user_thresholds=None):
+        self.recognition_threshold = recognition_threshold
+        self.reject_threshold = reject_threshold
+        self.user_thresholds = user_thresholds if user_thresholds is not None else {}
+        self.max_frames = max_frames
+        self.window = window
+        self.margin = margin
+        self.cap = cap
+        self.accept_evidence = accept_evidence
+        self.reject_evidence = reject_evidence
+        self.counts = {}   # 各判决结果的累计次数
+        self.reset()
+
+    def reset(self):
+        """人脸跟丢或做出判决后重新开始"""
+        self.frames = 0
+        self.history = []      # 每帧 {用户名: (平均得分, 一致性, 证据)}
+        self.reject_history = []
+        self.best_name = None
+        self.best_score = 0.0
+        self.best_consistency = 0.0
+
+    def thresholds(self, name):
+        """某用户的 (识别阈值, 拒绝阈值)"""
+        return self.user_thresholds.get(name) or (self.recognition_threshold, self.reject_threshold)
+
+    def update(self, results):
+        """加入一帧的 identify()/match_users() 结果，返回判决"""
+        self.frames += 1
+        frame = {}
+        best = None
+        for result in results:
+            avg_score = result["avg_score"]
+            recognition_threshold, reject_threshold = self.thresholds(result["name"])
+            ratio = consistency(result, reject_threshold)
+            evidence = (avg_score - recognition_threshold) / self.margin
+            if ratio < CONSISTENCY_MIN and evidence > 0:
+                evidence = 0.0
+            frame[result["name"]] = (avg_score, ratio, max(-1.0, min(self.cap, evidence)))
+            if best is None or avg_score > best["avg_score"]:
+                best = result
+
+        best_score = best["avg_score"] if best else 0.0
+        reject_threshold = self.thresholds(best["name"])[1] if best else self.reject_threshold
+        rejection = (reject_threshold - best_score) / self.margin
+        self.history.append(frame)
+        self.reject_history.append(max(0.0, min(self.cap, rejection)))
+        if len(self.history) > self.window:
+            self.history.pop(0)
+            self.reject_history.pop(0)
+
+        if best is not None:
+            self.best_name = best["name"]
+            self.best_score = best_score
+            self.best_consistency = frame[best["name"]][1]
+
+            # 提前放行
+            if self.evidence(best["name"]) >= self.accept_evidence:
+                return self._decide(ACCEPT)
+
+        # 提前拒绝：持续明显低于拒绝阈值，且没有任何用户的正证据
+        if sum(self.reject_history) >= self.reject_evidence and not self._any_positive():
+            return self._decide(REJECT)
+
+        if self.frames >= self.max_frames:
+            return self._decide(self._final())
+        return PENDING
+
+    def evidence(self, name):
+        """窗口内某用户的证据和"""
+        total = 0.0
+        for frame in self.history:
+            entry = frame.get(name)
+            if entry is not None:
+                total += entry[2]
+        return total
+
+    def _any_positive(self):
+        for frame in self.history:
+            for entry in frame.values():
+                if entry[2] > 0:
+                    return True
+        return False
+
+    def _final(self):
+        """帧数用尽：按单帧规则判断窗口内平均得分最高的用户"""
+        totals = {}
+        for frame in self.history:
+            for name, (avg_score, ratio, _) in frame.items():
+                entry = totals.get(name)
+                if entry is None:
+                    totals[name] = [avg_score, ratio, 1]
+                else:
+                    entry[0] += avg_score
+                    entry[1] += ratio
+                    entry[2] += 1
+
+        best_name = None
+        best_score = 0.0
+        best_consistency = 0.0
+        for name, (score_sum, ratio_sum, count) in totals.items():
+            if score_sum / count > best_score:
+                best_name = name
+                best_score = score_sum / count
+                best_consistency = ratio_sum / count
+        self.best_name = best_name
+        self.best_score = best_score
+        self.best_consistency = best_consistency
+
+        recognition_threshold, reject_threshold = self.thresholds(best_name)
+        if best_score >= recognition_threshold:
+            return ACCEPT if best_consistency >= CONSISTENCY_MIN else UNSTABLE
+        if best_score >= reject_threshold:
+            return LOW_CONFIDENCE
+        return REJECT
+
+    def _decide(self, verdict):
+        self.counts[verdict] = self.counts.get(verdict, 0) + 1
+        return verdict
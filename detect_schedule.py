@@ -0,0 +1,164 @@
+"""人脸检测调度
+
+门口固定安装的摄像头，能识别的人脸只出现在很窄的尺寸范围和画面高度内，
+整帧从 24 像素窗口开始逐级放大扫描，大部分工作量花在不可能出现人脸的尺度上。
+调度器记下录入和识别中合格人脸（通过质量门控的 largest_face）的边长和上下位置，
+样本够了之后整帧扫描改为：
+    垂直ROI: 见过的人脸上下边界再外扩 roi_margin 倍人脸高
+    最小尺度: 先把ROI缩小 pool 倍再检测，pool = 最小边长 / min_window（按 1/4 取整，
+              可以是小数），比最小边长更小的尺度缩小后不足一个检测窗口，直接跳过
+    最大尺度: Haar 扫描本身没有上限参数，大尺度窗口少、代价低，照常扫描；
+              但边长超过最大边长的检测结果丢弃，由不受限扫描负责
+每 explore_every 次整帧扫描仍做一次不受限的扫描，范围外的人脸（个子更高、
+站得更近）也会被找到并计入分布。
+受限扫描（含跟踪ROI扫描）耗时的滑动平均超过 budget_ms 时先提高 Haar 阈值，
+再减少级联级数；降到一半以下时按相反顺序恢复。
+"""
+
+
+class DetectionScheduler:
+    """按已见人脸的尺寸和位置限制Haar扫描范围，并按耗时调整阈值和级数"""
+
+    def __init__(self, camera, clock, min_samples=8, history=64, size_margin=0.25, roi_margin=0.25,
+                 explore_every=10, min_window=24, max_pool=4, budget_ms=40,
+                 threshold=0.5, max_threshold=0.75, threshold_step=0.05,
+                 stages=20, min_stages=12, stage_step=4, adjust_every=8):
+        self.camera = camera
+        self.clock = clock
+        self.min_samples = min_samples      # 样本少于该数时仍整帧扫描
+        self.history = history              # 只保留最近这么多个样本
+        self.size_margin = size_margin      # 尺寸范围上下各放宽的比例
+        self.roi_margin = roi_margin        # 垂直ROI上下各外扩的人脸高度倍数
+        self.explore_every = explore_every  # 每隔多少次整帧扫描做一次不受限扫描
+        self.min_window = min_window        # 缩小后最小人脸的边长下限（Haar 检测窗口）
+        self.max_pool = max_pool
+        self.budget_us = budget_ms * 1000
+        self.base_threshold = threshold
+        self.max_threshold = max_threshold
+        self.threshold_step = threshold_step
+        self.base_stages = stages
+        self.min_stages = min_stages
+        self.stage_step = stage_step
+        self.adjust_every = adjust_every
+
+        self.sizes = []      # 最近的合格人脸边长
+        self.spans = []      # 对应的 (上边界, 下边界)
+        self.threshold = threshold
+        self.stages = stages
+        self.avg_us = 0
+        self._since_adjust = 0
+
+        # 统计
+        self.calls = 0
+        self.full_scans = 0
+        self.banded_scans = 0
+        self.explore_scans = 0
+        self.explore_found = 0   # 不受限扫描找到、但在当前范围之外的人脸
+        self.total_us = 0
+        self.adjustments = 0
+
+    def observe(self, rect):
+        """记录一个合格人脸框 (x, y, w, h)"""
+        x, y, w, h = rect
+        self.sizes.append(w)
+        self.spans.append((y, y + h))
+        if len(self.sizes) > self.history:
+            self.sizes.pop(0)
+            self.spans.pop(0)
+
+    def band(self):
+        """(最小边长, 最大边长)；样本不足时为 None"""
+        if len(self.sizes) < self.min_samples:
+            return None
+        return (int(min(self.sizes) * (1 - self.size_margin)),
+                int(max(self.sizes) * (1 + self.size_margin)) + 1)
+
+    def pool_for(self, size):
+        """最小可能边长为 size 时缩小多少倍检测（1/4 为步长，1 表示不缩小）"""
+        pool = int(size) * 4 // self.min_window / 4
+        return max(1, min(self.max_pool, pool))
+
+    def track_pool(self, size):
+        """跟踪扫描（上一帧人脸边长为 size）的缩小倍数"""
+        return self.pool_for(size * (1 - self.size_margin))
+
+    def full_scan(self, frame_w, frame_h):
+        """整帧扫描的 (roi, pool, max_size)；roi 为 None 表示不受限"""
+        self.full_scans += 1
+        band = self.band()
+        if band is None or self.full_scans % self.explore_every == 0:
+            self.explore_scans += 1
+            return None, 1, None
+        low, high = band
+        margin = int(high * self.roi_margin)
+        top = max(0, min(span[0] for span in self.spans) - margin)
+        bottom = min(frame_h, max(span[1] for span in self.spans) + margin)
+        self.banded_scans += 1
+        return (0, top, frame_w, bottom - top), self.pool_for(low), high
+
+    def detect(self, img, roi, pool, scale_factor, max_size=None):
+        """计时调用 camera.find_faces，丢弃边长超过 max_size 的结果，并按耗时调整阈值和级数"""
+        start = self.clock.ticks_us()
+        faces = self.camera.find_faces(img, threshold=self.threshold, scale_factor=scale_factor,
+                                       roi=roi, pool=pool)
+        elapsed = self.clock.ticks_diff(self.clock.ticks_us(), start)
+        if max_size is not None:
+            faces = [f for f in faces if f[2] <= max_size]
+        self.calls += 1
+        self.total_us += elapsed
+        if roi is None and faces:
+            band = self.band()
+            if band is not None:
+                size = max(f[2] for f in faces)
+                if size < band[0] or size > band[1]:
+                    self.explore_found += 1
+        if roi is not None:
+            # 不受限扫描是有意付出的代价，不计入负载
+            self._update_load(elapsed)
+        return faces
+
+    def _update_load(self, elapsed):
+        self.avg_us += (elapsed - self.avg_us) >> 3
+        self._since_adjust += 1
+        if self._since_adjust < self.adjust_every:
+            return
+        if self.avg_us > self.budget_us:
+            # 超出预算：先收紧阈值，再减少级数
+            if self.threshold < self.max_threshold:
+                self.threshold = min(self.max_threshold, self.threshold + self.threshold_step)
+            elif self.stages > self.min_stages:
+                self._set_stages(max(self.min_stages, self.stages - self.stage_step))
+            else:
+                return
+        elif self.avg_us < self.budget_us // 2:
+            # 宽裕：先恢复级数，再放宽阈值
+            if self.stages < self.base_stages:
+                self._set_stages(min(self.base_stages, self.stages + self.stage_step))
+            elif self.threshold > self.base_threshold:
+                self.threshold = max(self.base_threshold, self.threshold - self.threshold_step)
+            else:
+                return
+        else:
+            return
+        self._since_adjust = 0
+        self.adjustments += 1
+
+    def _set_stages(self, stages):
+        self.stages = stages
+        self.camera.set_stages(stages)
+
+    def stats(self):
+        band = self.band()
+        return {
+            "calls": self.calls,
+            "avg_ms": self.total_us / self.calls / 1000 if self.calls else 0.0,
+            "full_scans": self.full_scans,
+            "banded": self.banded_scans,
+            "explore": self.explore_scans,
+            "explore_found": self.explore_found,
+            "band": band,
+            "pool": self.pool_for(band[0]) if band else 1,
+            "threshold": round(self.threshold, 2),
+            "stages": self.stages,
+            "adjustments": self.adjustments,
+        }
@@ -0,0 +1,153 @@
+"""流式录入的样本挑选
+
+原来的录入每张照片前固定等 2 秒，再取第一张通过检查的人脸，6 张照片至少
+12 秒，而且相邻几张往往几乎一样。流式录入在一个短窗口内对每一帧合格人脸
+都提取特征，放进容量固定的候选池：
+
+    池未满时直接加入；满了以后，新样本与池中最相近的得分低于池里最冗余的
+    候选（与其最近邻得分最高的那个）时替换它，否则丢弃新样本。
+
+窗口结束后按贪心最大最小距离挑出 N 个：先取与其余候选平均得分最高的
+中心样本，排除与它得分低于 min_similarity 的离群样本（误检、路过的人），
+然后每次加入与已选样本最高得分最低的候选。候选池按 Gallery 紧凑存放，
+得分与识别时同义（设备上走定点路径）。
+"""
+from face_matcher import Gallery
+
+CANDIDATE = "候选"
+
+
+class EnrollmentPool:
+    """容量固定的候选特征池"""
+
+    def __init__(self, capacity=24):
+        self.capacity = capacity
+        self.gallery = Gallery()
+        self.nearest = []    # 每个候选与其余候选的最高得分
+        self.partner = []    # 该最高得分对应的候选下标
+        self.offered = 0
+        self.replaced = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.gallery)
+
+    def add(self, features):
+        """加入一个候选，返回是否被保留"""
+        self.offered += 1
+        gallery = self.gallery
+        count = len(gallery)
+        if not count:
+            gallery.add(CANDIDATE, features)
+            self.nearest.append(-1.0)
+            self.partner.append(-1)
+            return True
+        scores = gallery.scores(features)
+        if count < self.capacity:
+            self._link(count, scores, range(count))
+            gallery.add(CANDIDATE, features)
+            return True
+
+        # 池满：替换最冗余的候选
+        worst = 0
+        for k in range(1, count):
+            if self.nearest[k] > self.nearest[worst]:
+                worst = k
+        others = [k for k in range(count) if k != worst]
+        if max(scores[k] for k in others) >= self.nearest[worst]:
+            self.dropped += 1
+            return False
+        gallery.replace(worst, features)
+        self.replaced += 1
+        stale = [k for k in others if self.partner[k] == worst]
+        self._link(worst, scores, others)
+        for k in stale:
+            self._relink(k)
+        return True
+
+    def _link(self, index, scores, others):
+        """候选 index 与 others 的得分为 scores[k]：更新双方的最近邻"""
+        if index == len(self.nearest):
+            self.nearest.append(-1.0)
+            self.partner.append(-1)
+        best = -1.0
+        best_k = -1
+        for k in others:
+            score = scores[k]
+            if score > best:
+                best = score
+                best_k = k
+            if score > self.nearest[k]:
+                self.nearest[k] = score
+                self.partner[k] = index
+        self.nearest[index] = best
+        self.partner[index] = best_k
+
+    def _relink(self, index):
+        """最近邻被替换掉了：重新找"""
+        scores = self.gallery.scores(self.gallery.template(index))
+        best = -1.0
+        best_k = -1
+        for k, score in enumerate(scores):
+            if k != index and score > best:
+                best = score
+                best_k = k
+        self.nearest[index] = best
+        self.partner[index] = best_k
+
+    def select(self, count, min_similarity):
+        """贪心最大最小距离挑出至多 count 个候选，返回特征列表（第一个是中心样本）"""
+        gallery = self.gallery
+        n = len(gallery)
+        if not n:
+            return []
+        rows = [gallery.scores(gallery.template(k)) for k in range(n)]
+        center = 0
+        best_total = None
+        for k in range(n):
+            total = sum(rows[k])
+            if best_total is None or total > best_total:
+                center = k
+                best_total = total
+
+        eligible = [k for k in range(n) if k != center and rows[center][k] >= min_similarity]
+        chosen = [center]
+        closest = list(rows[center])   # 每个候选与已选样本的最高得分
+        while len(chosen) < count and eligible:
+            pick = eligible[0]
+            for k in eligible:
+                if closest[k] < closest[pick]:
+                    pick = k
+            eligible.remove(pick)
+            chosen.append(pick)
+            row = rows[pick]
+            for k in eligible:
+                if row[k] > closest[k]:
+                    closest[k] = row[k]
+        return [gallery.template(k) for k in chosen]
+
+    def stats(self):
+        return {
+            "offered": self.offered,
+            "kept": len(self.gallery),
+            "replaced": self.replaced,
+            "dropped": self.dropped,
+        }
+
+
+def pairwise_spread(features):
+    """一组特征两两得分的 (平均, 最高)，越低说明样本越分散"""
+    if len(features) < 2:
+        return 1.0, 1.0
+    gallery = Gallery()
+    for f in features:
+        gallery.add(CANDIDATE, f)
+    total = 0.0
+    high = None
+    pairs = 0
+    for k in range(len(features) - 1):
+        for score in gallery.scores(features[k], range(k + 1, len(features))):
+            total += score
+            high = score if high is None else max(high, score)
+            pairs += 1
+    return total / pairs, high
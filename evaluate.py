@@ -0,0 +1,513 @@
+"""离线评估：在带标签的人脸裁剪数据集上衡量识别准确率和速度
+
+用法: python evaluate.py [数据集目录] [--save 结果.json] [--check 基准.json] [--roc roc.csv] [--sweep]
+                        [--impostors 陌生人.bin] [--export-impostors 陌生人.bin]
+
+数据集目录下每个子目录是一个人，子目录名即标签，里面是该人的人脸裁剪
+（.pgm / .ppm；装了 Pillow 时也可以是 .png / .jpg / .bmp）。
+不给目录时用 sim.synthetic_face 生成一份固定的合成数据集。
+
+每张裁剪走与设备相同的路径：FaceScratch.load 缩放到 FACE_SIZE、直方图均衡、
+降噪，再 extract_simple_features；两两比较用 calculate_balanced_similarity
+（参考实现）和 calculate_fixed_similarity（设备上的定点实现）。输出：
+    验证: 同人/异人得分分布、当前阈值下的 FAR/FRR、EER、ROC（--roc 写成CSV）
+    识别: 每人前 lock.faces_per_user 张录入模板，其余作探针，部分人不录入作陌生人，
+          按单帧判决规则统计放行/误放行/拒绝；固定阈值和按用户标定（calibration.py）各统计一次，
+          标定用的陌生人模板集由 --impostors 给出（可用 --export-impostors 从另一份数据集生成）
+    速度: 各阶段每秒处理人脸数、每秒比较次数
+    内存: 每个模板在 Gallery 中和模板文件中的字节数
+--save 把指标存成JSON，--check 与之前存的基准比较，变差超过容差时退出码为 1，
+特征流水线改动后可以直接当回归测试用。--sweep 额外扫描 MAX_EUCLIDEAN / MAX_MANHATTAN。
+"""
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import calibration
+import decision as decision_module
+import face_features
+import face_matcher
+import lock
+import sim
+import template_store
+from face_features import FACE_SIZE, FaceScratch, extract_simple_features
+from face_matcher import Gallery, calculate_balanced_similarity, calculate_fixed_similarity
+from profiler import Profiler
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # 没有 Pillow 时只读 PGM/PPM
+
+PNM_SUFFIXES = (".pgm", ".ppm")
+PIL_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp")
+
+# 合成数据集：人数、每人张数、裁剪尺寸
+SYNTHETIC_PEOPLE = 16
+SYNTHETIC_FACES = 10
+SYNTHETIC_SIZES = (48, 64, 80, 96)
+
+# 阈值扫描步长（ROC 与 EER）
+THRESHOLD_STEP = 0.001
+
+# --check 的容差
+EER_TOLERANCE = 0.005        # EER 允许变差的绝对值
+RATE_TOLERANCE = 0.01        # 当前阈值下 FAR/FRR 允许变差的绝对值
+THROUGHPUT_TOLERANCE = 0.25  # 吞吐允许下降的比例（主机计时有抖动）
+
+STAGES = ("roi_copy", "preprocess", "lbp", "grid")
+
+
+def read_image(path):
+    """读取一张人脸裁剪为灰度 SimImage"""
+    if path.lower().endswith(PNM_SUFFIXES):
+        return sim.read_pnm(path)
+    img = Image.open(path).convert("L")
+    return sim.SimImage(img.width, img.height, bytearray(img.tobytes()))
+
+
+def load_dataset(directory):
+    """[(标签, 图像, 文件名)]，按标签和文件名排序"""
+    suffixes = PNM_SUFFIXES + (PIL_SUFFIXES if Image is not None else ())
+    samples = []
+    for label in sorted(os.listdir(directory)):
+        person = os.path.join(directory, label)
+        if not os.path.isdir(person):
+            continue
+        for name in sorted(os.listdir(person)):
+            if name.lower().endswith(suffixes):
+                samples.append((label, read_image(os.path.join(person, name)), name))
+    if not samples:
+        raise ValueError(f"{directory}: 没有找到人脸裁剪（每人一个子目录）")
+    return samples
+
+
+def synthetic_dataset(people=SYNTHETIC_PEOPLE, faces=SYNTHETIC_FACES):
+    """固定的合成数据集：不同尺寸，部分照片欠曝带噪"""
+    rng = random.Random(0)
+    samples = []
+    for identity in range(people):
+        for variant in range(faces):
+            size = SYNTHETIC_SIZES[(identity + variant) % len(SYNTHETIC_SIZES)]
+            img = sim.synthetic_face(size, identity, variant)
+            if variant % 4 == 3:
+                img = sim.degrade(img, 0.75, rng)
+            samples.append((f"p{identity:02d}", img, f"{variant}.pgm"))
+    return samples
+
+
+def extract_all(samples):
+    """按设备路径提取全部特征，返回 (特征列表, profiler)；提取失败的为 None"""
+    profiler = Profiler(sim.SimClock(), window=len(samples))
+    scratch = FaceScratch(sim.SimImage(FACE_SIZE, FACE_SIZE))
+    features = []
+    saved_stdout = sys.stdout
+    sys.stdout = io.StringIO()  # extract_simple_features 每次都打印特征维度
+    try:
+        for _, img, _ in samples:
+            face = scratch.load(img, (0, 0, img.width(), img.height()), profiler)
+            out = extract_simple_features(face, profiler)
+            features.append(list(out) if out is not None else None)
+    finally:
+        sys.stdout = saved_stdout
+    return features, profiler
+
+
+def pair_scores(samples, features, similarity):
+    """全部两两得分，返回 (同人得分, 异人得分, 每秒比较次数)"""
+    genuine = []
+    impostor = []
+    start = time.perf_counter()
+    for i in range(len(samples)):
+        if features[i] is None:
+            continue
+        for j in range(i + 1, len(samples)):
+            if features[j] is None:
+                continue
+            score = similarity(features[i], features[j])
+            if samples[i][0] == samples[j][0]:
+                genuine.append(score)
+            else:
+                impostor.append(score)
+    elapsed = time.perf_counter() - start
+    pairs = len(genuine) + len(impostor)
+    return genuine, impostor, pairs / elapsed if elapsed > 0 else 0.0
+
+
+def error_rates(genuine, impostor, threshold):
+    """(FAR, FRR)：得分 >= 阈值视为同一人"""
+    far = sum(1 for s in impostor if s >= threshold) / len(impostor) if impostor else 0.0
+    frr = sum(1 for s in genuine if s < threshold) / len(genuine) if genuine else 0.0
+    return far, frr
+
+
+def roc(genuine, impostor, step=THRESHOLD_STEP):
+    """[(阈值, FAR, FRR)]，阈值从 0 到 1
+
+    两组得分排好序后随阈值单调扫描，一次遍历得到全部点。
+    """
+    genuine = sorted(genuine)
+    impostor = sorted(impostor)
+    points = []
+    g = i = 0
+    steps = int(round(1 / step))
+    for k in range(steps + 1):
+        threshold = k * step
+        while g < len(genuine) and genuine[g] < threshold:
+            g += 1
+        while i < len(impostor) and impostor[i] < threshold:
+            i += 1
+        far = (len(impostor) - i) / len(impostor) if impostor else 0.0
+        frr = g / len(genuine) if genuine else 0.0
+        points.append((threshold, far, frr))
+    return points
+
+
+def equal_error_rate(points):
+    """(EER, 对应阈值)：取 FAR 与 FRR 最接近的点"""
+    best = min(points, key=lambda p: (abs(p[1] - p[2]), p[0]))
+    return (best[1] + best[2]) / 2, best[0]
+
+
+def distribution(scores):
+    if not scores:
+        return {"count": 0}
+    scores = sorted(scores)
+    n = len(scores)
+    return {
+        "count": n,
+        "min": scores[0],
+        "mean": sum(scores) / n,
+        "p05": scores[n * 5 // 100],
+        "p50": scores[n // 2],
+        "p95": scores[min(n - 1, n * 95 // 100)],
+        "max": scores[-1],
+    }
+
+
+def verification(samples, features, similarity):
+    genuine, impostor, pairs_per_s = pair_scores(samples, features, similarity)
+    points = roc(genuine, impostor)
+    eer, eer_threshold = equal_error_rate(points)
+    far, frr = error_rates(genuine, impostor, lock.recognition_threshold)
+    reject_far, reject_frr = error_rates(genuine, impostor, lock.reject_threshold)
+    return {
+        "genuine": distribution(genuine),
+        "impostor": distribution(impostor),
+        "eer": eer,
+        "eer_threshold": eer_threshold,
+        "far": far,
+        "frr": frr,
+        "reject_far": reject_far,
+        "reject_frr": reject_frr,
+        "pairs_per_s": pairs_per_s,
+    }, points
+
+
+def identification(samples, features, enroll=None, calibrate=False, impostors=None):
+    """每人前 enroll 张录入，其余作探针；每四个人中有一个不录入，只作陌生人
+
+    判决用 SequentialDecision(max_frames=1)，与设备上的单帧规则相同。
+    calibrate 为 True 时先用录入模板和 impostors 按用户标定阈值。
+    """
+    if enroll is None:
+        enroll = lock.faces_per_user
+    labels = sorted(set(label for label, _, _ in samples))
+    strangers = set(labels[3::4]) if len(labels) >= 4 else set()
+
+    gallery = Gallery()
+    probes = []
+    enrolled = {}
+    for (label, _, _), feature in zip(samples, features):
+        if feature is None:
+            continue
+        if label not in strangers and enrolled.get(label, 0) < enroll:
+            gallery.add(label, feature)
+            enrolled[label] = enrolled.get(label, 0) + 1
+        else:
+            probes.append((label, feature))
+
+    counts = {"genuine": 0, "stranger": 0, "rank1": 0, "accept": 0, "false_accept": 0,
+              "stranger_accept": 0, "uncertain": 0, "reject": 0}
+    if not len(gallery) or not probes:
+        return counts
+    user_thresholds = None
+    if calibrate:
+        calib = calibration.Calibration(lock.recognition_threshold)
+        calib.rebuild(gallery, impostors)
+        user_thresholds = calib.thresholds
+    judge = decision_module.SequentialDecision(lock.recognition_threshold, lock.reject_threshold, max_frames=1,
+                                               user_thresholds=user_thresholds)
+    start = time.perf_counter()
+    for label, feature in probes:
+        results = gallery.identify(feature, lock.identify_top_k)
+        judge.reset()
+        verdict = judge.update(results)
+        stranger = label in strangers
+        counts["stranger" if stranger else "genuine"] += 1
+        if not stranger and judge.best_name == label:
+            counts["rank1"] += 1
+        if verdict == decision_module.ACCEPT:
+            if stranger:
+                counts["stranger_accept"] += 1
+            elif judge.best_name == label:
+                counts["accept"] += 1
+            else:
+                counts["false_accept"] += 1
+        elif verdict == decision_module.REJECT:
+            counts["reject"] += 1
+        else:
+            counts["uncertain"] += 1
+    elapsed = time.perf_counter() - start
+    counts["templates"] = len(gallery)
+    counts["probes_per_s"] = len(probes) / elapsed if elapsed > 0 else 0.0
+    return counts
+
+
+def template_memory(features):
+    """每个模板的字节数：主机 Gallery（tracemalloc 实测）、设备 Gallery 估算、模板文件"""
+    valid = [f for f in features if f is not None]
+    if not valid:
+        return {}
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    gallery = Gallery()
+    for k, feature in enumerate(valid):
+        gallery.add(f"p{k % 255}", feature)
+    host = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    dim = gallery.dim
+    # 设备上: 一行 array('B') 数据 + 用户下标(B) + 和(H) + 方差(I)
+    device = gallery.row_bytes + 1 + 2 + 4
+    store = len(template_store.encode_templates(gallery))
+    return {
+        "dim": dim,
+        "host_bytes": host / len(gallery),
+        "device_bytes": device,
+        "file_bytes": (store - template_store.HEADER_SIZE) / len(gallery),
+    }
+
+
+def throughput(profiler):
+    """各阶段每秒处理的人脸数（按平均耗时）"""
+    rates = {}
+    total_us = 0
+    for stage in STAGES:
+        stats = profiler.stages.get(stage)
+        if stats is None:
+            continue
+        avg_us = stats.summary()[2]
+        total_us += avg_us
+        rates[stage] = 1000000 / avg_us if avg_us else 0.0
+    rates["total"] = 1000000 / total_us if total_us else 0.0
+    return rates
+
+
+def fingerprint(features):
+    """全部特征的校验和：特征流水线输出有任何一位变化都会改变"""
+    data = bytearray()
+    for feature in features:
+        if feature is None:
+            data.append(0xFF)
+        else:
+            data.extend(bytes(v & 0xFF for v in feature))
+    return template_store.checksum(data)
+
+
+def sweep(samples, features):
+    """扫描距离归一化参数，返回 [(MAX_EUCLIDEAN, MAX_MANHATTAN, EER, 阈值)]"""
+    saved = face_matcher.MAX_EUCLIDEAN, face_matcher.MAX_MANHATTAN
+    rows = []
+    try:
+        for max_euclidean in (20, 30, 40, 50, 60):
+            for max_manhattan in (30, 45, 60, 75, 90):
+                face_matcher.MAX_EUCLIDEAN = max_euclidean
+                face_matcher.MAX_MANHATTAN = max_manhattan
+                genuine, impostor, _ = pair_scores(samples, features, calculate_balanced_similarity)
+                eer, threshold = equal_error_rate(roc(genuine, impostor))
+                rows.append((max_euclidean, max_manhattan, eer, threshold))
+    finally:
+        face_matcher.MAX_EUCLIDEAN, face_matcher.MAX_MANHATTAN = saved
+    return rows
+
+
+def feature_gallery(samples, features):
+    """数据集特征组成的 Gallery（--export-impostors 保存为陌生人模板集）"""
+    gallery = Gallery()
+    for (label, _, _), feature in zip(samples, features):
+        if feature is not None:
+            gallery.add(label, feature)
+    return gallery
+
+
+def evaluate(samples, impostors=None):
+    """完整评估，返回 (指标字典, 参考实现的ROC点, 特征列表)"""
+    features, profiler = extract_all(samples)
+    reference, points = verification(samples, features, calculate_balanced_similarity)
+    fixed, _ = verification(samples, features,
+                            lambda a, b: calculate_fixed_similarity(a, b) / face_matcher.SCORE_ONE)
+    metrics = {
+        "dataset": {
+            "faces": len(samples),
+            "people": len(set(label for label, _, _ in samples)),
+            "failed": sum(1 for f in features if f is None),
+        },
+        "thresholds": {"recognition": lock.recognition_threshold, "reject": lock.reject_threshold,
+                       "max_euclidean": face_matcher.MAX_EUCLIDEAN, "max_manhattan": face_matcher.MAX_MANHATTAN},
+        "features": {"dim": face_features.FEATURE_DIM, "fingerprint": fingerprint(features)},
+        "verification": reference,
+        "fixed": fixed,
+        "identification": identification(samples, features),
+        "calibrated": identification(samples, features, calibrate=True, impostors=impostors),
+        "throughput": throughput(profiler),
+        "memory": template_memory(features),
+    }
+    return metrics, points, features
+
+
+def print_report(metrics):
+    data = metrics["dataset"]
+    print(f"数据集: {data['people']} 人, {data['faces']} 张, 提取失败 {data['failed']} 张")
+    th = metrics["thresholds"]
+    print(f"阈值: 识别 {th['recognition']:.3f}, 拒绝 {th['reject']:.3f}, "
+          f"MAX_EUCLIDEAN {th['max_euclidean']}, MAX_MANHATTAN {th['max_manhattan']}")
+
+    print("\n验证（两两比较）")
+    print(f"{'':<10} {'次数':>7} {'最小':>7} {'P05':>7} {'中位':>7} {'P95':>7} {'最大':>7}")
+    for key, label in (("genuine", "同人"), ("impostor", "异人")):
+        d = metrics["verification"][key]
+        if d["count"]:
+            print(f"{label:<10} {d['count']:>7} {d['min']:>7.3f} {d['p05']:>7.3f} {d['p50']:>7.3f} "
+                  f"{d['p95']:>7.3f} {d['max']:>7.3f}")
+    for key, label in (("verification", "参考实现"), ("fixed", "定点实现")):
+        v = metrics[key]
+        print(f"{label}: EER {v['eer']:.2%} @ {v['eer_threshold']:.3f}, "
+              f"识别阈值 FAR {v['far']:.2%} FRR {v['frr']:.2%}, "
+              f"拒绝阈值 FAR {v['reject_far']:.2%} FRR {v['reject_frr']:.2%}, "
+              f"{v['pairs_per_s']:.0f} 次比较/秒")
+
+    for key, label in (("identification", "固定阈值"), ("calibrated", "按用户标定")):
+        print_identification(metrics[key], label)
+
+    rates = metrics["throughput"]
+    print("\n速度（主机，人脸/秒）")
+    print("  " + ", ".join(f"{stage} {rates[stage]:.0f}" for stage in STAGES + ("total",) if stage in rates))
+
+    mem = metrics["memory"]
+    if mem:
+        print(f"\n内存（每个模板，{mem['dim']} 维）: 设备估算 {mem['device_bytes']:.0f} 字节, "
+              f"主机实测 {mem['host_bytes']:.0f} 字节, 模板文件 {mem['file_bytes']:.1f} 字节")
+    print(f"特征指纹: {metrics['features']['fingerprint']:08x}")
+
+
+def print_identification(ident, label):
+    if not (ident["genuine"] or ident["stranger"]):
+        return
+    print(f"\n识别（{label}，{ident.get('templates', 0)} 个模板，单帧判决）")
+    genuine = max(1, ident["genuine"])
+    print(f"  本人探针 {ident['genuine']}: Rank-1 {ident['rank1'] / genuine:.2%}, "
+          f"正确放行 {ident['accept'] / genuine:.2%}, 认错人放行 {ident['false_accept']}")
+    if ident["stranger"]:
+        print(f"  陌生人探针 {ident['stranger']}: 误放行 {ident['stranger_accept'] / ident['stranger']:.2%}")
+    print(f"  不确定 {ident['uncertain']}, 拒绝 {ident['reject']}, {ident.get('probes_per_s', 0):.0f} 次识别/秒")
+
+
+def check(metrics, baseline):
+    """与基准比较，返回变差项的说明列表"""
+    problems = []
+    for key, label in (("verification", "参考实现"), ("fixed", "定点实现")):
+        now, before = metrics[key], baseline[key]
+        if now["eer"] > before["eer"] + EER_TOLERANCE:
+            problems.append(f"{label} EER {before['eer']:.2%} → {now['eer']:.2%}")
+        for rate in ("far", "frr"):
+            if now[rate] > before[rate] + RATE_TOLERANCE:
+                problems.append(f"{label} {rate.upper()} {before[rate]:.2%} → {now[rate]:.2%}")
+
+    for section in ("identification", "calibrated"):
+        if section not in baseline:
+            continue
+        now, before = metrics[section], baseline[section]
+        for key in ("false_accept", "stranger_accept"):
+            if now[key] > before[key]:
+                problems.append(f"{section} {key} {before[key]} → {now[key]}")
+        if now["rank1"] < before["rank1"]:
+            problems.append(f"{section} Rank-1 {before['rank1']} → {now['rank1']}")
+
+    for stage, rate in baseline["throughput"].items():
+        current = metrics["throughput"].get(stage, 0.0)
+        if current < rate * (1 - THROUGHPUT_TOLERANCE):
+            problems.append(f"{stage} 吞吐 {rate:.0f} → {current:.0f} 人脸/秒")
+
+    if metrics["memory"] and baseline["memory"]:
+        if metrics["memory"]["device_bytes"] > baseline["memory"]["device_bytes"]:
+            problems.append(f"每模板内存 {baseline['memory']['device_bytes']:.0f} → "
+                            f"{metrics['memory']['device_bytes']:.0f} 字节")
+
+    if metrics["features"]["fingerprint"] != baseline["features"]["fingerprint"]:
+        print("注意: 特征输出与基准不同（流水线有改动时属正常，以上指标为准）")
+    return problems
+
+
+def main(argv):
+    options = {}
+    for flag in ("--save", "--check", "--roc", "--impostors", "--export-impostors"):
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            argv = argv[:i] + argv[i + 2:]
+    do_sweep = "--sweep" in argv
+    if do_sweep:
+        argv.remove("--sweep")
+
+    samples = load_dataset(argv[0]) if argv else synthetic_dataset()
+    impostors = None
+    if "--impostors" in options:
+        impostors = template_store.load_templates(options["--impostors"])
+        if impostors is None:
+            print(f"无法加载陌生人模板集 {options['--impostors']}")
+            return 2
+    metrics, points, features = evaluate(samples, impostors)
+    print_report(metrics)
+
+    if do_sweep:
+        print("\n距离归一化参数扫描（参考实现）")
+        print(f"{'MAX_EUCLIDEAN':>14} {'MAX_MANHATTAN':>14} {'EER':>8} {'阈值':>7}")
+        for max_euclidean, max_manhattan, eer, threshold in sweep(samples, features):
+            print(f"{max_euclidean:>14} {max_manhattan:>14} {eer:>8.2%} {threshold:>7.3f}")
+
+    if "--roc" in options:
+        with open(options["--roc"], "w") as f:
+            f.write("threshold,far,frr\n")
+            for threshold, far, frr in points:
+                f.write(f"{threshold:.3f},{far:.6f},{frr:.6f}\n")
+        print(f"ROC 已写入 {options['--roc']}")
+
+    if "--export-impostors" in options:
+        size = template_store.save_templates(feature_gallery(samples, features), options["--export-impostors"])
+        print(f"陌生人模板集已写入 {options['--export-impostors']} ({size} 字节)")
+
+    if "--save" in options:
+        with open(options["--save"], "w") as f:
+            json.dump(metrics, f, indent=2, ensure_ascii=False)
+        print(f"指标已保存到 {options['--save']}")
+
+    if "--check" in options:
+        with open(options["--check"]) as f:
+            baseline = json.load(f)
+        problems = check(metrics, baseline)
+        if problems:
+            print("\n回归:")
+            for problem in problems:
+                print(f"  {problem}")
+            return 1
+        print("\n与基准相比没有变差")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,453 @@
+"""结构化事件日志
+
+每次判决和失败原来只 print 到 REPL，断开串口就没了。现在每个事件写成一条
+定长二进制记录（小端，RECORD_SIZE = 32 字节）：
+    序号(I) | 时刻ms(I，上电以来) | 事件(B) | 融合帧数(B) | 用户下标(B) | 保留(B)
+    | 最高得分(H，×10000) | 一致性(H，×10000)
+    | 各阶段耗时(6×H，单位 0.1ms，见 STAGES) | 空闲堆(I，未知为 0xFFFFFFFF)
+记录先放进预分配的RAM环形缓冲区，攒够一页（PAGE_SIZE 字节，页头
+    魔数 b"EV" | 版本(B) | 记录数(B) | 记录区校验和(I)
+之后 PER_PAGE 条记录）才写一次flash。flash上的日志文件预先分配为 pages 页，
+按页循环覆盖最旧的一页；不满一页的记录最迟 flush_ms 写一次，写在下一页的位置上，
+页满时原地重写。上电时按页内序号找到最新的一页接着写，校验和不符的页
+（写到一半断电）整页忽略。
+
+导出: UART命令 events 把全部记录按 MSG_EVENTS 帧（每帧至多 RECORDS_PER_FRAME 条）
+排进链路的低优先级缓冲区，空载荷的 MSG_EVENTS 表示导出结束。
+
+主机端解码为CSV:
+    python event_log.py events.log [-o events.csv] [--templates faces.bin]
+    python event_log.py capture.bin                 # 串口原始抓包（链路帧）
+    python event_log.py --port /dev/ttyACM0 [--baud 9600] [-o events.csv]   # 发送 events 命令并接收
+--templates 给出模板文件时用户下标换成用户名。
+"""
+import struct
+
+from decision import ACCEPT, LOW_CONFIDENCE, REJECT, UNSTABLE
+from template_store import checksum
+from uart_link import MAX_PAYLOAD, MSG_EVENTS
+
+MAGIC = b"EV"
+VERSION = 1
+LOG_FILE = "events.log"
+PAGE_SIZE = 512
+PAGE_FORMAT = "<2sBBI"
+PAGE_HEADER = struct.calcsize(PAGE_FORMAT)
+RECORD_FORMAT = "<IIBBBBHHHHHHHHI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+PER_PAGE = (PAGE_SIZE - PAGE_HEADER) // RECORD_SIZE
+RECORDS_PER_FRAME = MAX_PAYLOAD // RECORD_SIZE
+
+# 事件类型
+EV_BOOT = 1
+EV_ACCEPT = 2
+EV_REJECT = 3
+EV_LOW_CONFIDENCE = 4
+EV_UNSTABLE = 5
+EV_NO_FEATURES = 6   # 特征提取失败
+EV_ENROLL = 7        # 融合帧数一栏为录入的模板数
+EV_ERROR = 8         # 识别循环异常
+
+EVENT_NAMES = {
+    EV_BOOT: "boot",
+    EV_ACCEPT: "accept",
+    EV_REJECT: "reject",
+    EV_LOW_CONFIDENCE: "low_confidence",
+    EV_UNSTABLE: "unstable",
+    EV_NO_FEATURES: "no_features",
+    EV_ENROLL: "enroll",
+    EV_ERROR: "error",
+}
+VERDICT_EVENTS = {
+    ACCEPT: EV_ACCEPT,
+    REJECT: EV_REJECT,
+    LOW_CONFIDENCE: EV_LOW_CONFIDENCE,
+    UNSTABLE: EV_UNSTABLE,
+}
+
+# 记录的阶段耗时（Profiler 的阶段名），判决时取各阶段最近一次的耗时
+STAGES = ("detect", "quality", "preprocess", "lbp", "grid", "match")
+NO_USER = 0xFF
+NO_HEAP = 0xFFFFFFFF
+SCORE_SCALE = 10000
+LATENCY_UNIT_US = 100
+
+CSV_COLUMNS = ("seq", "time_ms", "event", "frames", "user", "best_score", "consistency") + \
+    tuple(stage + "_ms" for stage in STAGES) + ("free_heap",)
+
+
+def events_path(template_path):
+    """与模板文件同目录的事件日志"""
+    slash = template_path.rfind("/")
+    return template_path[:slash + 1] + LOG_FILE
+
+
+class EventLog:
+    """RAM环形缓冲区 + flash按页循环的事件日志
+
+    path 为 None 时只保留RAM中最近 ram_records 条记录。clock 提供 ticks_diff
+    （ticks_ms 会回绕），due() 要用；主机上只读取日志时可以不给。
+    """
+
+    def __init__(self, path=None, pages=64, ram_records=64, flush_ms=60000, clock=None):
+        if ram_records < PER_PAGE:
+            raise ValueError(f"RAM缓冲区至少要放下一页: {ram_records} < {PER_PAGE}")
+        self.path = path
+        self.clock = clock
+        self.pages = pages
+        self.flush_ms = flush_ms
+        self.capacity = ram_records
+        self.buf = bytearray(ram_records * RECORD_SIZE)
+        self.page = bytearray(PAGE_SIZE)   # 写flash的页缓冲
+        self.head = 0        # 下一条记录在RAM中的位置
+        self.count = 0       # RAM中的记录数
+        self.unflushed = 0   # 还没有写进整页的记录数（最新的这么多条）
+        self.partial = 0     # 其中已作为不满的一页写过flash的记录数
+        self.seq = 0
+        self.slot = 0        # 下一个要写的flash页
+        self.last_flush = None
+
+        # 统计
+        self.logged = 0
+        self.pages_written = 0
+        self.partial_writes = 0
+        self.overruns = 0    # flash写不进去、RAM满后被覆盖的记录
+        self.write_errors = 0
+        if path is not None:
+            self._open()
+
+    def _open(self):
+        """找到最新的一页接着写；文件不存在或大小不符时预分配"""
+        try:
+            order = self._page_order()
+            if order:
+                last, slot = order[-1]
+                self.seq = last + 1
+                self.slot = (slot + 1) % self.pages
+            return
+        except (OSError, ValueError):
+            pass
+        try:
+            zeros = bytes(PAGE_SIZE)
+            with open(self.path, "wb") as f:
+                for _ in range(self.pages):
+                    f.write(zeros)
+        except OSError as e:
+            print(f"事件日志无法创建 {self.path}: {e}")
+            self.path = None
+
+    def _page_order(self):
+        """校验通过的页按最后一条记录的序号排序: [(序号, 页号)]；文件大小不符时抛出 ValueError"""
+        page = self.page
+        order = []
+        with open(self.path, "rb") as f:
+            f.seek(0, 2)
+            if f.tell() != self.pages * PAGE_SIZE:
+                raise ValueError("日志文件大小不符")
+            for slot in range(self.pages):
+                f.seek(slot * PAGE_SIZE)
+                f.readinto(page)
+                if valid_page(page):
+                    order.append((struct.unpack_from("<I", page, PAGE_HEADER + (page[3] - 1) * RECORD_SIZE)[0], slot))
+        order.sort()
+        return order
+
+    def record(self, kind, now, user=NO_USER, score=0.0, consistency=0.0, frames=0, latencies=None, heap=None):
+        """追加一条记录（只写RAM）；latencies 为与 STAGES 对应的微秒数"""
+        lat = [0] * len(STAGES)
+        if latencies is not None:
+            for k, us in enumerate(latencies):
+                lat[k] = min(0xFFFF, max(0, us) // LATENCY_UNIT_US)
+        struct.pack_into(RECORD_FORMAT, self.buf, self.head * RECORD_SIZE,
+                         self.seq, now & 0xFFFFFFFF, kind, min(255, frames), user, 0,
+                         _scaled(score), _scaled(consistency),
+                         lat[0], lat[1], lat[2], lat[3], lat[4], lat[5],
+                         NO_HEAP if heap is None else heap)
+        self.seq += 1
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.capacity, self.count + 1)
+        self.logged += 1
+        if self.path is None:
+            return
+        self.unflushed += 1
+        if self.unflushed > self.capacity:
+            self.unflushed = self.capacity
+            self.partial = 0   # 写过flash的那部分已被覆盖，下次从现存最旧的一条重写这一页
+            self.overruns += 1
+
+    def due(self, now):
+        """攒够一页，或有新记录且距上次写入已超过 flush_ms"""
+        if self.path is None or self.unflushed == self.partial:
+            return False
+        if self.unflushed >= PER_PAGE:
+            return True
+        if self.last_flush is None:
+            self.last_flush = now   # 从第一条记录起计时
+            return False
+        return self.clock.ticks_diff(now, self.last_flush) >= self.flush_ms
+
+    def flush(self, now):
+        """把整页写进flash，剩下不满一页的记录写在下一页的位置上，返回写入的页数"""
+        if self.path is None or self.unflushed == self.partial:
+            return 0
+        written = 0
+        try:
+            with open(self.path, "r+b") as f:
+                while self.unflushed >= PER_PAGE:
+                    self._write_page(f, PER_PAGE)
+                    self.slot = (self.slot + 1) % self.pages
+                    self.unflushed -= PER_PAGE
+                    self.pages_written += 1
+                    written += 1
+                self.partial = 0
+                if self.unflushed:
+                    self._write_page(f, self.unflushed)
+                    self.partial = self.unflushed
+                    self.partial_writes += 1
+                    written += 1
+        except OSError as e:
+            self.write_errors += 1
+            print(f"事件日志写入失败: {e}")
+        self.last_flush = now
+        return written
+
+    def _write_page(self, f, n):
+        """最旧的 n 条未写记录组成一页写到 self.slot"""
+        page = self.page
+        first = (self.head - self.unflushed) % self.capacity
+        for k in range(PER_PAGE):
+            pos = PAGE_HEADER + k * RECORD_SIZE
+            if k < n:
+                src = ((first + k) % self.capacity) * RECORD_SIZE
+                page[pos:pos + RECORD_SIZE] = self.buf[src:src + RECORD_SIZE]
+            else:
+                page[pos:pos + RECORD_SIZE] = bytes(RECORD_SIZE)
+        body = memoryview(page)[PAGE_HEADER:PAGE_HEADER + n * RECORD_SIZE]
+        struct.pack_into(PAGE_FORMAT, page, 0, MAGIC, VERSION, n, checksum(body))
+        f.seek(self.slot * PAGE_SIZE)
+        f.write(page)
+
+    def records(self):
+        """按序号从旧到新给出全部记录（每条 RECORD_SIZE 字节）：先flash，再RAM中更新的记录"""
+        last = -1
+        if self.path is not None:
+            page = bytearray(PAGE_SIZE)
+            try:
+                for _, slot in self._page_order():
+                    # 每页单独打开，导出途中照常写入
+                    with open(self.path, "rb") as f:
+                        f.seek(slot * PAGE_SIZE)
+                        f.readinto(page)
+                    if not valid_page(page):
+                        continue
+                    for k in range(page[3]):
+                        pos = PAGE_HEADER + k * RECORD_SIZE
+                        seq = struct.unpack_from("<I", page, pos)[0]
+                        if seq > last:
+                            last = seq
+                            yield bytes(page[pos:pos + RECORD_SIZE])
+            except (OSError, ValueError) as e:
+                print(f"事件日志读取失败: {e}")
+        first = (self.head - self.count) % self.capacity
+        for k in range(self.count):
+            pos = ((first + k) % self.capacity) * RECORD_SIZE
+            seq = struct.unpack_from("<I", self.buf, pos)[0]
+            if seq > last:
+                last = seq
+                yield bytes(self.buf[pos:pos + RECORD_SIZE])
+
+    def stats(self):
+        return {
+            "logged": self.logged,
+            "pages": self.pages_written,
+            "partial": self.partial_writes,
+            "pending": self.unflushed - self.partial,
+            "overruns": self.overruns,
+            "errors": self.write_errors,
+        }
+
+
+def _scaled(value):
+    return min(0xFFFF, max(0, int(value * SCORE_SCALE + 0.5)))
+
+
+def valid_page(page):
+    if len(page) < PAGE_HEADER or bytes(page[:2]) != MAGIC or page[2] != VERSION:
+        return False
+    n = page[3]
+    if not n or n > PER_PAGE:
+        return False
+    crc = struct.unpack_from("<I", page, 4)[0]
+    return checksum(memoryview(page)[PAGE_HEADER:PAGE_HEADER + n * RECORD_SIZE]) == crc
+
+
+class Exporter:
+    """把日志记录分批排进链路的低优先级缓冲区"""
+
+    def __init__(self, log, link, per_frame=RECORDS_PER_FRAME):
+        self.link = link
+        self.per_frame = per_frame
+        self._records = log.records()
+        self.sent = 0
+        self.done = False
+
+    def pump(self):
+        """低优先级缓冲区放得下时排队下一批，全部发完（含结束帧）返回 True"""
+        if self.done:
+            return True
+        frame_size = self.per_frame * RECORD_SIZE
+        while self.link.bulk_room() >= frame_size + 7:
+            batch = bytearray()
+            for record in self._records:
+                batch.extend(record)
+                if len(batch) >= frame_size:
+                    break
+            self.link.send(MSG_EVENTS, batch)
+            if not batch:
+                self.done = True
+                return True
+            self.sent += len(batch) // RECORD_SIZE
+        return False
+
+
+def decode_record(record):
+    """一条记录 -> 与 CSV_COLUMNS 对应的取值"""
+    fields = struct.unpack(RECORD_FORMAT, record)
+    seq, time_ms, kind, frames, user = fields[:5]
+    score, consistency = fields[6:8]
+    latencies = fields[8:8 + len(STAGES)]
+    heap = fields[-1]
+    return ((seq, time_ms, EVENT_NAMES.get(kind, kind), frames, None if user == NO_USER else user,
+             score / SCORE_SCALE, consistency / SCORE_SCALE)
+            + tuple(v * LATENCY_UNIT_US / 1000 for v in latencies)
+            + (None if heap == NO_HEAP else heap,))
+
+
+def records_from_image(data):
+    """flash日志文件 -> 按序号排好的记录"""
+    records = {}
+    for pos in range(0, len(data) - PAGE_SIZE + 1, PAGE_SIZE):
+        page = memoryview(data)[pos:pos + PAGE_SIZE]
+        if not valid_page(page):
+            continue
+        for k in range(page[3]):
+            start = PAGE_HEADER + k * RECORD_SIZE
+            record = bytes(page[start:start + RECORD_SIZE])
+            records[struct.unpack_from("<I", record)[0]] = record
+    return [records[seq] for seq in sorted(records)]
+
+
+def records_from_capture(data):
+    """串口抓包（链路帧）-> 其中 MSG_EVENTS 帧携带的记录，序号重复的只保留一条"""
+    from uart_link import FrameParser
+    payloads = []
+
+    def on_frame(msg_type, seq, payload):
+        if msg_type == MSG_EVENTS:
+            payloads.append(payload)
+
+    FrameParser(on_frame).feed(data)
+    records = {}
+    for payload in payloads:
+        for pos in range(0, len(payload) - RECORD_SIZE + 1, RECORD_SIZE):
+            record = payload[pos:pos + RECORD_SIZE]
+            records[struct.unpack_from("<I", record)[0]] = record
+    return [records[seq] for seq in sorted(records)]
+
+
+def write_csv(records, out, names=None):
+    """写CSV，names 给出时用户下标换成用户名"""
+    out.write(",".join(CSV_COLUMNS) + "\n")
+    for record in records:
+        row = list(decode_record(record))
+        user = row[4]
+        if user is not None and names is not None and user < len(names):
+            row[4] = names[user]
+        cells = []
+        for value in row:
+            if value is None:
+                cells.append("")
+            elif isinstance(value, float):
+                cells.append(f"{value:.4f}".rstrip("0").rstrip("."))
+            else:
+                cells.append(str(value))
+        out.write(",".join(cells) + "\n")
+
+
+def export_serial(port, baud=9600, timeout_s=120):
+    """通过串口发送 events 命令，收集导出的记录直到结束帧（主机端）"""
+    import os
+    import termios
+    import time
+    import tty
+    from uart_link import MSG_COMMAND, FrameParser, encode_frame
+
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        speed = getattr(termios, f"B{baud}")
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        os.write(fd, encode_frame(MSG_COMMAND, 0, b"events"))
+        captured = bytearray()
+        finished = []
+
+        def on_frame(msg_type, seq, payload):
+            if msg_type == MSG_EVENTS and not payload:
+                finished.append(True)
+
+        parser = FrameParser(on_frame)
+        deadline = time.time() + timeout_s
+        while not finished and time.time() < deadline:
+            data = os.read(fd, 1024)
+            captured.extend(data)
+            parser.feed(data)
+        if not finished:
+            print(f"导出未在 {timeout_s} 秒内结束，只解码已收到的部分")
+        return records_from_capture(captured)
+    finally:
+        os.close(fd)
+
+
+def main(argv):
+    import sys
+    options = {}
+    for flag in ("-o", "--templates", "--port", "--baud"):
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            argv = argv[:i] + argv[i + 2:]
+
+    if "--port" in options:
+        records = export_serial(options["--port"], int(options.get("--baud", 9600)))
+    elif argv:
+        with open(argv[0], "rb") as f:
+            data = f.read()
+        if bytes(data[:2]) == MAGIC or not any(data[:PAGE_SIZE]):
+            records = records_from_image(data)
+        else:
+            records = records_from_capture(data)
+    else:
+        print(__doc__)
+        return 2
+
+    names = None
+    if "--templates" in options:
+        from template_store import load_templates
+        gallery = load_templates(options["--templates"])
+        if gallery is not None:
+            names = gallery.names
+
+    if "-o" in options:
+        with open(options["-o"], "w", encoding="utf-8") as out:
+            write_csv(records, out, names)
+        print(f"{len(records)} 条记录 -> {options['-o']}")
+    else:
+        write_csv(records, sys.stdout, names)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
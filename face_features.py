@@ -0,0 +1,443 @@
+"""人脸特征提取
+
+直接在整幅灰度缓冲区上计算LBP，避免逐像素调用 get_pixel。
+设备上按行访问 bytearray，主机上（有NumPy时）使用移位数组运算。
+LBP规格输出与原实现逐位一致的64维特征；均匀LBP、旋转不变LBP的直方图维数
+（59/36 bin/区域）超出模板格式和定点匹配支持的80维，不提供。
+网格均值特征由每个ROI只构建一次的积分图提供。
+"""
+import math
+
+try:
+    import sensor
+except ImportError:
+    sensor = None  # 主机环境
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # 设备环境
+
+
+# 人脸区域划分：(x起点, y起点, x终点, y终点, 名称)，均为比例
+LBP_REGIONS = (
+    (0.1, 0.1, 0.5, 0.5, "左上"),     # 左上（包含左眼）
+    (0.5, 0.1, 0.9, 0.5, "右上"),     # 右上（包含右眼）
+    (0.2, 0.3, 0.8, 0.7, "中央"),     # 中央（鼻子区域）
+    (0.2, 0.6, 0.8, 0.95, "下部"),    # 下部（嘴部区域）
+)
+
+# 均匀模式 + 一些重要的非均匀模式，取前16个
+IMPORTANT_PATTERNS = (
+    0, 1, 3, 7, 15, 31, 63, 127, 255,
+    2, 4, 6, 8, 12, 14, 16,
+)
+
+
+def lbp_offsets(radius, neighbors):
+    """LBP邻域偏移量 (dx, dy)，与原实现相同地向零取整（旧模板可用）"""
+    offsets = []
+    for i in range(neighbors):
+        angle = 2 * math.pi * i / neighbors
+        offsets.append((int(radius * math.cos(angle)), int(radius * math.sin(angle))))
+    return offsets
+
+
+class LBPSpec:
+    """编译好的LBP描述子规格
+
+    每个 (radius, neighbors) 只构建一次：保存整数偏移、区域比例，
+    以及把LBP码直接映射到输出直方图bin（IMPORTANT_PATTERNS 的下标）的查找表。
+    查找表值 discard (= n_bins) 表示该模式不参与输出。
+    """
+
+    def __init__(self, radius, neighbors):
+        if neighbors > 8:
+            raise ValueError("neighbors 最多为 8")
+
+        self.radius = radius
+        self.neighbors = neighbors
+        self.regions = LBP_REGIONS
+        self.offsets = lbp_offsets(radius, neighbors)
+
+        # (0, 0) 偏移总是与中心相等，对应位恒为1
+        self.fixed = 0
+        self.moving = []
+        for i, (dx, dy) in enumerate(self.offsets):
+            if dx == 0 and dy == 0:
+                self.fixed |= 1 << i
+            else:
+                self.moving.append((1 << i, dx, dy))
+
+        n_codes = 1 << neighbors
+        self.n_bins = len(IMPORTANT_PATTERNS)
+        lut = bytearray([self.n_bins]) * n_codes
+        for b, p in enumerate(IMPORTANT_PATTERNS):
+            if p < n_codes:
+                lut[p] = b
+
+        self.lut = lut
+        self.discard = self.n_bins
+        self.dim = self.n_bins * len(self.regions)
+
+
+_SPECS = {}
+
+
+def lbp_spec(radius=1, neighbors=8):
+    """取得（并缓存）指定参数的LBP规格"""
+    key = (radius, neighbors)
+    spec = _SPECS.get(key)
+    if spec is None:
+        spec = LBPSpec(radius, neighbors)
+        _SPECS[key] = spec
+    return spec
+
+
+# 默认规格在导入时构建
+DEFAULT_LBP_SPEC = lbp_spec()
+
+# 特征总维度：LBP(64) + 部分网格特征(16)
+FEATURE_DIM = 80
+GRID_SIZE = 6
+# 积分图采样间隔，与原网格统计的隔点采样密度相同
+INTEGRAL_STRIDE = 2
+# 人脸暂存图边长：每个候选人脸都缩放到这个尺寸再提取特征
+FACE_SIZE = 64
+# 检测框小于该边长的人脸不做识别
+MIN_FACE_SIZE = 24
+
+
+def gray_buffer(face_roi):
+    """取得灰度像素缓冲区，返回 (buf, width, height)
+
+    buf 在主机上是形状为 (height, width) 的 uint8 数组，
+    在设备上是按行连续存放的 bytearray。
+    """
+    if isinstance(face_roi, FaceGray):
+        return face_roi.buf, face_roi.width, face_roi.height
+
+    if np is not None and isinstance(face_roi, np.ndarray):
+        height, width = face_roi.shape
+        return face_roi, width, height
+
+    # 确保是灰度图像
+    if sensor is not None and face_roi.format() == sensor.RGB565:
+        face_roi = face_roi.to_grayscale()
+
+    width = face_roi.width()
+    height = face_roi.height()
+    buf = face_roi.bytearray()
+    if np is not None:
+        buf = np.frombuffer(buf, dtype=np.uint8, count=width * height).reshape(height, width)
+    return buf, width, height
+
+
+class IntegralImage:
+    """积分图（summed-area table）
+
+    在间隔为 stride 的采样格点上构建，之后任意矩形的均值都是O(1)查询。
+    """
+
+    def __init__(self, buf, width, height, stride=INTEGRAL_STRIDE):
+        self.stride = stride
+        cols = len(range(0, width, stride))
+        rows = len(range(0, height, stride))
+        self.cols = cols
+        self.rows = rows
+
+        if np is not None and not isinstance(buf, (bytes, bytearray, memoryview)):
+            table = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+            table[1:, 1:] = buf[::stride, ::stride].astype(np.int64).cumsum(0).cumsum(1)
+            self.table = table.ravel().tolist()
+            return
+
+        line = cols + 1
+        table = [0] * ((rows + 1) * line)
+        k = line + 1
+        for j in range(rows):
+            src = j * stride * width
+            run = 0
+            for p in range(src, src + cols * stride, stride):
+                run += buf[p]
+                table[k] = table[k - line] + run
+                k += 1
+            k += 1
+        self.table = table
+
+    def rect_sum(self, x_start, y_start, x_end, y_end):
+        """像素坐标矩形 [x_start, x_end) x [y_start, y_end) 内格点的 (和, 数量)"""
+        s = self.stride
+        # 落在矩形内的格点下标范围（向上取整）
+        a0 = min(self.cols, (x_start + s - 1) // s)
+        a1 = min(self.cols, (x_end + s - 1) // s)
+        b0 = min(self.rows, (y_start + s - 1) // s)
+        b1 = min(self.rows, (y_end + s - 1) // s)
+        if a1 <= a0 or b1 <= b0:
+            return 0, 0
+        line = self.cols + 1
+        t = self.table
+        total = t[b1 * line + a1] - t[b0 * line + a1] - t[b1 * line + a0] + t[b0 * line + a0]
+        return total, (a1 - a0) * (b1 - b0)
+
+    def rect_mean(self, x_start, y_start, x_end, y_end, default=128):
+        """矩形内平均灰度（整数）"""
+        total, count = self.rect_sum(x_start, y_start, x_end, y_end)
+        if count == 0:
+            return default
+        return total // count
+
+
+class FaceGray:
+    """一张人脸ROI的灰度缓冲区，积分图在首次使用时构建
+
+    LBP、网格均值等阶段共享同一个对象，灰度转换和积分图都只做一次。
+    """
+
+    def __init__(self, face_roi):
+        self.buf, self.width, self.height = gray_buffer(face_roi)
+        self._integral = None
+
+    def integral(self):
+        if self._integral is None:
+            self._integral = IntegralImage(self.buf, self.width, self.height)
+        return self._integral
+
+
+def grid_means(face, grid_size=GRID_SIZE, count=None, out=None, offset=0):
+    """网格平均灰度特征
+
+    按原实现的顺序（先列后行）输出，只计算前 count 个实际保留的格子。
+    给出 out 时写入 out[offset:] 并返回 out。
+
+    积分图的采样点在全图的偶数坐标上；原实现从每个格子的起点隔点采样。
+    格子边长为偶数时两者取的是同一批像素，结果完全一致（FACE_SIZE=64 时格宽10，
+    设备上的识别和录入都是这种情况）；边长为奇数时采样点错开一个像素，
+    边缘锐利的格子会差十几级灰度（bench.py grid：32像素的脸最多差17级）。
+    """
+    integral = face.integral()
+    cell_w = face.width // grid_size
+    cell_h = face.height // grid_size
+    total = grid_size * grid_size
+    if count is None or count > total:
+        count = total
+
+    if out is None:
+        out = [0] * count
+        offset = 0
+    for k in range(count):
+        i, j = divmod(k, grid_size)
+        x_start = i * cell_w
+        y_start = j * cell_h
+        x_end = min(x_start + cell_w, face.width)
+        y_end = min(y_start + cell_h, face.height)
+        out[offset + k] = integral.rect_mean(x_start, y_start, x_end, y_end)
+    return out
+
+
+def _region_bounds(width, height, region, radius):
+    """区域内采样网格：(x0, x1, y0, y1, step)"""
+    x_start_r, y_start_r, x_end_r, y_end_r = region[:4]
+    x_start = int(width * x_start_r)
+    y_start = int(height * y_start_r)
+    x_end = int(width * x_end_r)
+    y_end = int(height * y_end_r)
+    # 适当的采样密度
+    step = max(1, (x_end - x_start) // 12)
+    return x_start + radius, x_end - radius, y_start + radius, y_end - radius, step
+
+
+def _region_hist_numpy(gray, bounds, spec, lut):
+    """NumPy路径：邻域比较用移位切片一次完成，再经查找表计数"""
+    x0, x1, y0, y1, step = bounds
+    nx = len(range(x0, x1, step))
+    ny = len(range(y0, y1, step))
+    if nx == 0 or ny == 0:
+        return None, 0
+
+    center = gray[y0:y0 + (ny - 1) * step + 1:step, x0:x0 + (nx - 1) * step + 1:step]
+    codes = np.full(center.shape, spec.fixed, dtype=np.uint16)
+    for bit, dx, dy in spec.moving:
+        shifted = gray[y0 + dy:y0 + dy + (ny - 1) * step + 1:step,
+                       x0 + dx:x0 + dx + (nx - 1) * step + 1:step]
+        codes |= (shifted >= center).astype(np.uint16) * bit
+    return np.bincount(lut[codes].ravel(), minlength=spec.n_bins + 1), nx * ny
+
+
+def _region_hist_buffer(buf, width, bounds, spec):
+    """bytearray路径：按行索引，偏移量换算为线性下标，查表累加"""
+    x0, x1, y0, y1, step = bounds
+    fixed = spec.fixed
+    lut = spec.lut
+    moving = [(bit, dy * width + dx) for bit, dx, dy in spec.moving]
+
+    lbp_hist = [0] * (spec.n_bins + 1)
+    total_pixels = 0
+    for y in range(y0, y1, step):
+        row = y * width
+        for p in range(row + x0, row + x1, step):
+            center_pixel = buf[p]
+            lbp_value = fixed
+            for bit, off in moving:
+                if buf[p + off] >= center_pixel:
+                    lbp_value |= bit
+            lbp_hist[lut[lbp_value]] += 1
+            total_pixels += 1
+    return lbp_hist, total_pixels
+
+
+def extract_stable_lbp_features(face_roi, radius=1, neighbors=8, out=None):
+    """稳定的LBP特征提取
+
+    给出 out 时写入 out 的前 spec.dim 个元素并返回 out，不再分配新列表。
+    """
+    try:
+        buf, width, height = gray_buffer(face_roi)
+
+        if width < 24 or height < 24:
+            return None
+
+        spec = lbp_spec(radius, neighbors)
+        use_numpy = np is not None and not isinstance(buf, (bytes, bytearray, memoryview))
+        if use_numpy:
+            lut = np.frombuffer(spec.lut, dtype=np.uint8)
+
+        if out is None:
+            out = [0] * spec.dim
+        k = 0
+        for region in spec.regions:
+            bounds = _region_bounds(width, height, region, spec.radius)
+            if use_numpy:
+                lbp_hist, total_pixels = _region_hist_numpy(buf, bounds, spec, lut)
+            else:
+                lbp_hist, total_pixels = _region_hist_buffer(buf, width, bounds, spec)
+
+            for b in range(spec.n_bins):
+                if total_pixels > 0:
+                    out[k] = min(255, (int(lbp_hist[b]) * 100) // total_pixels)
+                else:
+                    out[k] = 0
+                k += 1
+
+        return out
+
+    except Exception as e:
+        print(f"LBP特征提取失败: {e}")
+        return None
+
+
+def preprocess_face(face_roi):
+    """温和的人脸预处理"""
+    if np is not None and isinstance(face_roi, np.ndarray):
+        return face_roi  # 主机上的数组视为已预处理
+
+    try:
+        # 转换为灰度进行处理
+        if sensor is not None and face_roi.format() == sensor.RGB565:
+            face_roi = face_roi.to_grayscale()
+
+        # 直方图均衡化增强对比度
+        face_roi.histeq()
+
+        # 轻微降噪
+        face_roi.gaussian(1)
+
+        return face_roi
+    except Exception as e:
+        print(f"预处理失败: {e}")
+        return face_roi
+
+
+class FaceScratch:
+    """预分配的灰度人脸暂存图
+
+    原来每个候选人脸都要 img.copy(roi) 一次，再 to_grayscale() 一到两次，
+    内存紧张时这几次分配常导致特征提取失败。现在人脸框直接从快照缩放拷贝进
+    同一张 FACE_SIZE×FACE_SIZE 灰度图（RGB565 在拷贝时顺带转灰度），
+    直方图均衡和降噪都在这张图上原地进行，特征从它的像素缓冲区直接读取。
+
+    代价是每张脸的耗时固定为 FACE_SIZE 大小的一张脸：比 FACE_SIZE 大的脸更快、
+    分配峰值不再随尺寸增长，而 24~48 像素的小脸先被放大，比原来按原尺寸
+    处理慢 1.5~4 倍（bench.py roi）。模板按 FACE_SIZE 归一化后的人脸提取，
+    小脸不能退回原尺寸处理，否则特征与模板不可比。
+    """
+
+    def __init__(self, image, size=FACE_SIZE):
+        self.image = image   # camera.scratch_image(size, size) 创建的灰度图
+        self.size = size
+
+    def load(self, img, rect, profiler=None):
+        """把 img 中的人脸框 rect 载入暂存图并预处理，返回 FaceGray"""
+        self.copy(img, rect, profiler)
+        return self.preprocess(profiler)
+
+    def copy(self, img, rect, profiler=None):
+        """只把人脸框缩放拷贝进暂存图（质量门控看的是预处理之前的画面），返回暂存图"""
+        x, y, w, h = rect
+        t = profiler.begin() if profiler else 0
+        self.image.draw_image(img, 0, 0, x_scale=self.size / w, y_scale=self.size / h, roi=rect)
+        if profiler:
+            profiler.end("roi_copy", t)
+        return self.image
+
+    def preprocess(self, profiler=None):
+        """对 copy() 载入的人脸做直方图均衡和降噪，返回 FaceGray"""
+        scratch = self.image
+        t = profiler.begin() if profiler else 0
+        scratch.histeq()
+        scratch.gaussian(1)
+        if profiler:
+            profiler.end("preprocess", t)
+
+        # 积分图按脸构建，缓冲区本身是暂存图的视图
+        return FaceGray(scratch)
+
+
+def extract_simple_features(face_roi, profiler=None, out=None):
+    """简化但稳定的特征提取
+
+    传入 profiler 时分别记录 preprocess / lbp / grid 三个阶段的耗时。
+    传入长度为 FEATURE_DIM 的 out（如预分配的 bytearray）时结果直接写入其中，
+    识别循环可以每帧复用同一个缓冲区。
+    传入 FaceScratch.load() 返回的 FaceGray 时跳过预处理。
+    """
+    try:
+        if isinstance(face_roi, FaceGray):
+            face = face_roi
+        else:
+            # 预处理
+            t = profiler.begin() if profiler else 0
+            face = FaceGray(preprocess_face(face_roi))
+            if profiler:
+                profiler.end("preprocess", t)
+
+        if face.width < MIN_FACE_SIZE or face.height < MIN_FACE_SIZE:
+            return None
+
+        if out is None:
+            out = [0] * FEATURE_DIM
+
+        # 1. LBP特征（主要）
+        t = profiler.begin() if profiler else 0
+        n = 0
+        if extract_stable_lbp_features(face, out=out) is not None:
+            n = DEFAULT_LBP_SPEC.dim
+        if profiler:
+            profiler.end("lbp", t)
+
+        # 2. 简化的网格统计特征，只计算保留下来的格子避免过拟合
+        t = profiler.begin() if profiler else 0
+        count = min(FEATURE_DIM - n, GRID_SIZE * GRID_SIZE)
+        grid_means(face, GRID_SIZE, count, out, n)
+        if profiler:
+            profiler.end("grid", t)
+
+        if n + count < len(out):
+            out = out[:n + count]  # LBP失败时只有网格特征
+
+        print(f"特征维度: {len(out)}")
+        return out
+
+    except Exception as e:
+        print(f"特征提取失败: {e}")
+        return None
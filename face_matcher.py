@@ -0,0 +1,549 @@
+"""人脸特征匹配
+
+calculate_balanced_similarity 是两两比较的参考实现；
+Gallery 在录入时预先计算每个模板的统计量，识别时一次遍历
+即可得到探针与全部模板的欧氏、曼哈顿距离和相关系数。
+用户较多时 identify() 先与每位用户的平均模板粗比，
+只对得分最高的几位用户逐模板精比。
+calculate_fixed_similarity 是只用整数运算的等价版本，得分按 SCORE_ONE 定标。
+Gallery(quantized=k) 把前 k 维（LBP 直方图）按 LEVELS 量化为4位，两维共用一个字节。
+"""
+import math
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # 设备环境
+
+try:
+    import micropython
+    native = micropython.native
+except ImportError:
+    def native(f):  # 主机环境
+        return f
+
+
+# 距离到相似度的转换参数（基于实际测试调整）
+MAX_EUCLIDEAN = 40    # 降低阈值
+MAX_MANHATTAN = 60    # 降低阈值
+
+# 定点相似度：1.0 对应 SCORE_ONE
+SCORE_BITS = 12
+SCORE_ONE = 1 << SCORE_BITS
+# 定点得分与浮点参考实现的最大偏差（SCORE_ONE 单位），由 bench.py fixed 校验
+FIXED_TOLERANCE = 4
+
+# 4位量化的16个取值。LBP 直方图是百分比，绝大多数格子在 0..30 之间，
+# 小值处步长为1，大值处放宽（欧氏/曼哈顿距离对小值的误差更敏感）
+LEVELS = bytes((0, 1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 19, 24, 31, 42, 60))
+
+
+def _nearest_codes():
+    """0..255 -> 最接近的 LEVELS 下标"""
+    codes = bytearray(256)
+    for v in range(256):
+        best = 0
+        for k in range(16):
+            if abs(LEVELS[k] - v) < abs(LEVELS[best] - v):
+                best = k
+        codes[v] = best
+    return bytes(codes)
+
+
+CODES = _nearest_codes()
+
+
+def combine_similarity(euclidean_distance, manhattan_distance, correlation):
+    """三种度量合成最终相似度（更温和的转换）"""
+    euclidean_sim = max(0, 1 - euclidean_distance / MAX_EUCLIDEAN)
+    manhattan_sim = max(0, 1 - manhattan_distance / MAX_MANHATTAN)
+    correlation_sim = (correlation + 1) / 2  # 将-1到1映射到0到1
+
+    # 综合相似度
+    final_similarity = (
+        euclidean_sim * 0.4 +
+        manhattan_sim * 0.3 +
+        correlation_sim * 0.3
+    )
+
+    # 温和的非线性变换
+    final_similarity = math.sqrt(final_similarity)  # 开方而不是立方
+
+    return max(0.0, min(1.0, final_similarity))
+
+
+def calculate_balanced_similarity(features1, features2):
+    """平衡的相似度计算"""
+    try:
+        if not features1 or not features2 or len(features1) != len(features2):
+            return 0.0
+
+        n_features = len(features1)
+
+        # 1. 计算归一化的欧氏距离
+        squared_diff_sum = 0
+        for i in range(n_features):
+            diff = features1[i] - features2[i]
+            squared_diff_sum += diff * diff
+
+        euclidean_distance = math.sqrt(squared_diff_sum) / math.sqrt(n_features)
+
+        # 2. 计算曼哈顿距离
+        manhattan_distance = sum(abs(features1[i] - features2[i]) for i in range(n_features)) / n_features
+
+        # 3. 计算相关系数
+        mean1 = sum(features1) / n_features
+        mean2 = sum(features2) / n_features
+
+        numerator = sum((features1[i] - mean1) * (features2[i] - mean2) for i in range(n_features))
+
+        sum_sq1 = sum((features1[i] - mean1) ** 2 for i in range(n_features))
+        sum_sq2 = sum((features2[i] - mean2) ** 2 for i in range(n_features))
+
+        correlation = 0
+        if sum_sq1 > 0 and sum_sq2 > 0:
+            correlation = numerator / math.sqrt(sum_sq1 * sum_sq2)
+
+        # 4. 距离到相似度的转换
+        return combine_similarity(euclidean_distance, manhattan_distance, correlation)
+
+    except Exception as e:
+        print(f"相似度计算失败: {e}")
+        return 0.0
+
+
+def isqrt(n):
+    """floor(sqrt(n))，逐位求根，不用浮点"""
+    if n <= 0:
+        return 0
+    bit = 1
+    while (bit << 2) <= n:
+        bit <<= 2
+    root = 0
+    while bit:
+        if n >= root + bit:
+            n -= root + bit
+            root = (root >> 1) + bit
+        else:
+            root >>= 1
+        bit >>= 2
+    return root
+
+
+def _pair_sums(features1, features2, n):
+    """一次遍历累加 (差平方和, 差绝对值和, 交叉积, 和1, 平方和1, 和2, 平方和2)"""
+    squared_diff_sum = 0
+    abs_diff_sum = 0
+    cross = 0
+    sum1 = 0
+    sq1 = 0
+    sum2 = 0
+    sq2 = 0
+    for i in range(n):
+        a = features1[i]
+        b = features2[i]
+        d = a - b
+        squared_diff_sum += d * d
+        abs_diff_sum += d if d >= 0 else -d
+        cross += a * b
+        sum1 += a
+        sq1 += a * a
+        sum2 += b
+        sq2 += b * b
+    return squared_diff_sum, abs_diff_sum, cross, sum1, sq1, sum2, sq2
+
+
+def combine_fixed(n, squared_diff_sum, abs_diff_sum, numerator, var1, var2):
+    """整数版 combine_similarity，返回 0..SCORE_ONE
+
+    numerator = n*交叉积 - 和1*和2，var = n*平方和 - 和²（都是精确整数）。
+    特征取值 0..255、n <= 80 时输入都在 2^30 以内；运算顺序保证中间结果也不超过
+    2^30，设备上不会用到长整数：
+        欧氏项 ssd*one²/limit 拆成商和余数两次乘除（结果仍是精确的下取整）；
+        相关系数的分母是两个方差各自开方之积，分子先左移3位再分两次除。
+    """
+    one = SCORE_ONE
+
+    # 欧氏: 1 - sqrt(ssd/n)/MAX_E = 1 - sqrt(ssd/(n*MAX_E²))
+    limit = n * MAX_EUCLIDEAN * MAX_EUCLIDEAN
+    euclidean_sim = 0
+    if squared_diff_sum < limit:
+        scaled = squared_diff_sum * one   # < limit * one
+        ratio = (scaled // limit) * one + (scaled % limit) * one // limit
+        euclidean_sim = one - isqrt(ratio)
+
+    # 曼哈顿
+    manhattan_sim = one - abs_diff_sum * one // (n * MAX_MANHATTAN)
+    if manhattan_sim < 0:
+        manhattan_sim = 0
+
+    # 相关系数映射到 0..one
+    correlation = 0
+    if var1 > 0 and var2 > 0:
+        root1 = isqrt(var1)
+        root2 = isqrt(var2)
+        if root1 and root2:
+            # |numerator| <= sqrt(var1*var2)，商不超过 8*root2
+            correlation = ((numerator << 3) // root1) * one // (root2 << 3)
+            if correlation > one:
+                correlation = one
+            elif correlation < -one:
+                correlation = -one
+    correlation_sim = (correlation + one) >> 1
+
+    total = (euclidean_sim * 4 + manhattan_sim * 3 + correlation_sim * 3) // 10
+    if total <= 0:
+        return 0
+    score = isqrt(total * one)
+    return score if score < one else one
+
+
+def calculate_fixed_similarity(features1, features2):
+    """calculate_balanced_similarity 的整数定点版本
+
+    返回 0..SCORE_ONE 的整数，除以 SCORE_ONE 后与浮点版本相差不超过
+    FIXED_TOLERANCE / SCORE_ONE；浮点得分相差超过两倍容差的两对，定点得分顺序相同。
+    """
+    if not features1 or not features2 or len(features1) != len(features2):
+        return 0
+    n = len(features1)
+    squared_diff_sum, abs_diff_sum, cross, sum1, sq1, sum2, sq2 = _pair_sums(features1, features2, n)
+    return combine_fixed(n, squared_diff_sum, abs_diff_sum,
+                         cross * n - sum1 * sum2, sq1 * n - sum1 * sum1, sq2 * n - sum2 * sum2)
+
+
+@native
+def _row_sums(probe, data, base, n):
+    """探针与 data[base:base + n] 的 (差平方和, 差绝对值和, 交叉积)，Gallery 逐模板比较的内层循环"""
+    squared_diff_sum = 0
+    abs_diff_sum = 0
+    cross = 0
+    for i in range(n):
+        f = probe[i]
+        v = data[base + i]
+        d = f - v
+        squared_diff_sum += d * d
+        abs_diff_sum += d if d >= 0 else -d
+        cross += f * v
+    return squared_diff_sum, abs_diff_sum, cross
+
+
+def _vector_stats(features):
+    """(和, n*平方和 - 和²)，后者是 n² 倍方差的精确整数"""
+    n = len(features)
+    total = sum(features)
+    sq = 0
+    for v in features:
+        sq += v * v
+    return total, sq * n - total * total
+
+
+class Gallery:
+    """已录入模板库
+
+    所有模板按行连续存放在一个 array('B') 中（特征本身就是 0..255），
+    并缓存每个模板的和与 n*平方和 - 和²；用户下标、和、方差也都是紧凑数组，
+    每个模板只占 行字节数 + 7 字节，没有逐个装箱的整数和列表。
+    quantized > 0 时前 quantized 维按 LEVELS 量化为4位、两维一个字节，
+    统计量按量化后的取值计算，匹配时逐行解包到一个复用的行缓冲区。
+    match() 对每个模板只遍历一次，主机上（有NumPy时）对整个模板矩阵一次性计算；
+    设备上 scores() 走整数定点路径。
+    """
+
+    __slots__ = ("dim", "quantized", "row_bytes", "names", "labels", "data", "sums", "variances",
+                 "_row", "_matrix", "_centroids", "_members")
+
+    def __init__(self, dim=None, quantized=0):
+        if quantized % 2:
+            raise ValueError(f"量化维数须为偶数: {quantized}")
+        self.dim = dim
+        self.quantized = quantized
+        self.row_bytes = None
+        self.names = []            # 用户名，按录入顺序
+        self.labels = array('B')   # 每个模板所属用户下标
+        self.data = array('B')
+        self.sums = array('H')
+        self.variances = array('I')  # n*平方和 - 和²
+        self._row = None           # 量化模板的解包缓冲区
+        self._matrix = None
+        self._centroids = None  # 每位用户的平均模板（Gallery），录入后按需重建
+        self._members = None    # 每位用户的模板下标
+        if dim is not None:
+            self._set_dim(dim)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _set_dim(self, dim):
+        if self.quantized > dim:
+            raise ValueError(f"量化维数超过特征维度: {self.quantized} > {dim}")
+        self.dim = dim
+        self.row_bytes = self.quantized // 2 + dim - self.quantized
+        self._row = array('B', bytes(dim))
+
+    def _pack(self, features, out, pos):
+        """把特征按存储格式写入 out[pos:pos + row_bytes]，返回写入的实际取值的 (和, var)"""
+        n = self.dim
+        q = self.quantized
+        total = 0
+        sq = 0
+        for i in range(0, q, 2):
+            lo = CODES[min(255, max(0, features[i]))]
+            hi = CODES[min(255, max(0, features[i + 1]))]
+            out[pos] = lo | (hi << 4)
+            pos += 1
+            a = LEVELS[lo]
+            b = LEVELS[hi]
+            total += a + b
+            sq += a * a + b * b
+        for i in range(q, n):
+            v = min(255, max(0, features[i]))
+            out[pos] = v
+            pos += 1
+            total += v
+            sq += v * v
+        return total, sq * n - total * total
+
+    def add(self, name, features):
+        """录入一个模板，返回其下标"""
+        if self.dim is None:
+            self._set_dim(len(features))
+        elif len(features) != self.dim:
+            raise ValueError(f"特征维度不一致: {len(features)} != {self.dim}")
+        if name in self.names:
+            label = self.names.index(name)
+        else:
+            if len(self.names) >= 256:
+                raise ValueError("用户数超过 256")
+            label = len(self.names)
+            self.names.append(name)
+
+        pos = len(self.data)
+        self.data.extend(bytes(self.row_bytes))
+        total, variance = self._pack(features, self.data, pos)
+        self.labels.append(label)
+        self.sums.append(total)
+        self.variances.append(variance)
+        self._matrix = None
+        self._centroids = None
+        self._members = None
+        return len(self.labels) - 1
+
+    def replace(self, index, features):
+        """用新特征替换模板 index（所属用户不变），下标和每位用户的模板数都不变"""
+        if len(features) != self.dim:
+            raise ValueError(f"特征维度不一致: {len(features)} != {self.dim}")
+        self.sums[index], self.variances[index] = self._pack(features, self.data, index * self.row_bytes)
+        self._matrix = None
+        self._centroids = None
+
+    def _row_values(self, index, out):
+        """把模板 index 的实际取值解包到 out（长度 dim），返回 out"""
+        data = self.data
+        pos = index * self.row_bytes
+        k = 0
+        for i in range(pos, pos + self.quantized // 2):
+            code = data[i]
+            out[k] = LEVELS[code & 15]
+            out[k + 1] = LEVELS[code >> 4]
+            k += 2
+        pos += self.quantized // 2
+        for i in range(pos, pos + self.dim - self.quantized):
+            out[k] = data[i]
+            k += 1
+        return out
+
+    def template(self, index):
+        if not self.quantized:
+            base = index * self.dim
+            return self.data[base:base + self.dim]
+        return self._row_values(index, array('B', bytes(self.dim)))
+
+    def user_faces(self):
+        """还原为 [{"name", "faces"}] 结构（原来录入阶段的格式，仅用于对比）"""
+        users = [{"name": name, "faces": []} for name in self.names]
+        for index, label in enumerate(self.labels):
+            users[label]["faces"].append(list(self.template(index)))
+        return users
+
+    def match(self, probe, indices=None):
+        """探针与模板的 (欧氏距离, 曼哈顿距离, 相关系数) 列表
+
+        indices 为 None 时比较全部模板，否则只比较给出下标的模板（按其顺序）。
+        """
+        if not self.labels or len(probe) != self.dim:
+            return []
+        if indices is None:
+            indices = range(len(self.labels))
+        if np is not None:
+            return self._match_numpy(probe, indices)
+
+        n = self.dim
+        sqrt_n = math.sqrt(n)
+        results = []
+        for squared_diff_sum, abs_diff_sum, numerator, p_var, t_var in self._pair_stats(probe, indices):
+            correlation = 0
+            if p_var > 0 and t_var > 0:
+                correlation = numerator / math.sqrt(p_var * t_var)
+            results.append((math.sqrt(squared_diff_sum) / sqrt_n, abs_diff_sum / n, correlation))
+        return results
+
+    def fixed_scores(self, probe, indices=None):
+        """探针与模板的定点相似度（0..SCORE_ONE 整数）"""
+        if not self.labels or len(probe) != self.dim:
+            return []
+        if indices is None:
+            indices = range(len(self.labels))
+        n = self.dim
+        data = self.data
+        quantized = self.quantized
+        sums = self.sums
+        variances = self.variances
+        p_sum, p_var = _vector_stats(probe)
+        scores = []
+        for t in indices:
+            if quantized:
+                data = self._row_values(t, self._row)
+                base = 0
+            else:
+                base = t * n
+            squared_diff_sum, abs_diff_sum, cross = _row_sums(probe, data, base, n)
+            scores.append(combine_fixed(n, squared_diff_sum, abs_diff_sum, cross * n - p_sum * sums[t],
+                                        p_var, variances[t]))
+        return scores
+
+    def _pair_stats(self, probe, indices):
+        """逐模板的 (差平方和, 差绝对值和, n*交叉积 - 和积, 探针var, 模板var) 列表，全为整数"""
+        n = self.dim
+        data = self.data
+        quantized = self.quantized
+        p_sum, p_var = _vector_stats(probe)
+        stats = []
+        for t in indices:
+            if quantized:
+                data = self._row_values(t, self._row)
+                base = 0
+            else:
+                base = t * n
+            squared_diff_sum, abs_diff_sum, cross = _row_sums(probe, data, base, n)
+            stats.append((squared_diff_sum, abs_diff_sum, cross * n - p_sum * self.sums[t],
+                          p_var, self.variances[t]))
+        return stats
+
+    def _match_numpy(self, probe, indices):
+        if self._matrix is None:
+            self._matrix = self._unpack_numpy()
+        rows = np.asarray(indices, dtype=np.intp)
+        m = self._matrix[rows]
+        n = self.dim
+        p = np.asarray(probe, dtype=np.int64)
+        p_sum, p_var = _vector_stats(probe)
+
+        diff = m - p
+        euclidean = np.sqrt((diff * diff).sum(axis=1)) / math.sqrt(n)
+        manhattan = np.abs(diff).sum(axis=1) / n
+
+        t_var = np.array(self.variances, dtype=np.float64)[rows]
+        numerator = m @ p * n - p_sum * np.array(self.sums, dtype=np.int64)[rows]
+        denom = np.sqrt(np.maximum(float(p_var) * t_var, 0.0))
+        correlation = np.zeros(len(rows))
+        valid = (t_var > 0) & (p_var > 0)
+        correlation[valid] = numerator[valid] / denom[valid]
+
+        return list(zip(euclidean.tolist(), manhattan.tolist(), correlation.tolist()))
+
+    def _unpack_numpy(self):
+        """全部模板的实际取值组成的 int64 矩阵"""
+        rows = np.frombuffer(self.data, dtype=np.uint8).reshape(len(self.labels), self.row_bytes)
+        half = self.quantized // 2
+        if not half:
+            return rows.astype(np.int64)
+        levels = np.frombuffer(LEVELS, dtype=np.uint8)
+        matrix = np.empty((len(self.labels), self.dim), dtype=np.int64)
+        codes = rows[:, :half]
+        matrix[:, 0:self.quantized:2] = levels[codes & 15]
+        matrix[:, 1:self.quantized:2] = levels[codes >> 4]
+        matrix[:, self.quantized:] = rows[:, half:]
+        return matrix
+
+    def scores(self, probe, indices=None):
+        """探针与每个模板的综合相似度
+
+        设备上（无NumPy）用整数定点计算，与浮点结果相差不超过 FIXED_TOLERANCE / SCORE_ONE。
+        """
+        if np is None:
+            return [score / SCORE_ONE for score in self.fixed_scores(probe, indices)]
+        return [combine_similarity(e, m, c) for e, m, c in self.match(probe, indices)]
+
+    def match_users(self, probe):
+        """按用户汇总：[{name, avg_score, max_score, scores}]"""
+        return self._summarize(range(len(self.names)), probe)
+
+    def members(self):
+        """每位用户的模板下标列表"""
+        if self._members is None:
+            members = [[] for _ in self.names]
+            for index, label in enumerate(self.labels):
+                members[label].append(index)
+            self._members = members
+        return self._members
+
+    def centroids(self):
+        """每位用户一个平均模板组成的 Gallery，标签与本库的用户下标一致"""
+        if self._centroids is None:
+            n = self.dim
+            row = self._row
+            centroids = Gallery(n)
+            for name, indices in zip(self.names, self.members()):
+                count = len(indices)
+                mean = [0] * n
+                for t in indices:
+                    if self.quantized:
+                        data = self._row_values(t, row)
+                        base = 0
+                    else:
+                        data = self.data
+                        base = t * n
+                    for i in range(n):
+                        mean[i] += data[base + i]
+                centroids.add(name, [(v + count // 2) // count for v in mean])
+            self._centroids = centroids
+        return self._centroids
+
+    def identify(self, probe, top_k=3):
+        """由粗到精的识别
+
+        先用每位用户的平均模板粗排，再只对前 top_k 位用户逐模板比较。
+        返回与 match_users() 相同结构的结果，只包含入选的用户。
+        用户数不超过 top_k 时等同于 match_users()。
+        """
+        if len(self.names) <= top_k:
+            return self.match_users(probe)
+        coarse = self.centroids().scores(probe)
+        ranked = sorted(range(len(coarse)), key=lambda label: coarse[label], reverse=True)
+        return self._summarize(ranked[:top_k], probe)
+
+    def _summarize(self, user_labels, probe):
+        members = self.members()
+        indices = []
+        for label in user_labels:
+            indices.extend(members[label])
+        if not indices:
+            return []
+        scores = self.scores(probe, indices)
+
+        results = []
+        start = 0
+        for label in user_labels:
+            count = len(members[label])
+            user_scores = scores[start:start + count]
+            start += count
+            if user_scores:
+                results.append({
+                    "name": self.names[label],
+                    "avg_score": sum(user_scores) / len(user_scores),
+                    "max_score": max(user_scores),
+                    "scores": user_scores
+                })
+        return results
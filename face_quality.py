@@ -0,0 +1,149 @@
+"""人脸质量门控
+
+检测框够大就直接提取特征，模糊、过暗过亮或侧脸的帧既浪费一次LBP，
+又会把多帧判决往错误方向推。人脸缩放进暂存图之后、直方图均衡之前
+先做几项廉价检查，不合格的帧不提取特征、不计入判决：
+    尺寸:   原始检测框的边长
+    曝光:   get_statistics() 的平均亮度、四分位数和标准差（设备上由固件计算），
+            下四分位接近全黑说明暗部大片被压死，上四分位接近全白说明高光溢出
+    清晰度: 隔点采样的梯度均方根与平均亮度之比，模糊压低高频，而整体明暗不影响该比值
+    正脸:   眼部条带左右两半最暗列（眼睛）的位置是否镜像对称
+清晰度和正脸检查只看隔 stride 点的采样，代价远小于一次LBP。
+"""
+
+import math
+
+# 不合格原因（同时作为LCD提示）
+TOO_SMALL = "人脸过小"
+TOO_DARK = "光线太暗"
+TOO_BRIGHT = "光线过亮"
+LOW_CONTRAST = "对比度不足"
+BLURRED = "画面模糊"
+OFF_ANGLE = "请正对镜头"
+
+EYE_BAND = (0.2, 0.5)   # 眼部条带的上下边界（占人脸高度的比例）
+EYE_SEARCH = (0.1, 0.45)  # 左半边找眼睛的水平范围，右半边取镜像
+
+
+class QualityGate:
+    """暂存图上的人脸质量检查"""
+
+    def __init__(self, min_size=32, dark=50, bright=205, shadow=20, highlight=235, min_contrast=16,
+                 min_sharpness=0.18, max_asymmetry=0.1, stride=2):
+        self.min_size = min_size            # 检测框最小边长
+        self.dark = dark                    # 平均亮度下限
+        self.bright = bright                # 平均亮度上限
+        self.shadow = shadow                # 下四分位下限
+        self.highlight = highlight          # 上四分位上限
+        self.min_contrast = min_contrast    # 亮度标准差下限
+        self.min_sharpness = min_sharpness  # 梯度均方根/平均亮度 下限
+        self.max_asymmetry = max_asymmetry  # 两眼位置偏离镜像的比例上限
+        self.stride = stride
+        self.last = None      # 最近一次的 (平均亮度, 标准差, 清晰度, 不对称度)，供调参
+        self.checked = 0
+        self.rejected = {}    # 原因 -> 次数
+
+    def check(self, face, w, h):
+        """face: 已缩放进暂存图、尚未预处理的灰度人脸；w, h: 原始检测框大小
+
+        合格返回 None，否则返回不合格原因。
+        """
+        self.checked += 1
+        reason = self._assess(face, w, h)
+        if reason is not None:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return reason
+
+    def _assess(self, face, w, h):
+        if w < self.min_size or h < self.min_size:
+            self.last = None
+            return TOO_SMALL
+
+        stats = face.get_statistics()
+        mean = stats.mean()
+        stdev = stats.stdev()
+        self.last = (mean, stdev, 0.0, 0.0)
+        if mean < self.dark or stats.lq() < self.shadow:
+            return TOO_DARK
+        if mean > self.bright or stats.uq() > self.highlight:
+            return TOO_BRIGHT
+        if stdev < self.min_contrast:
+            return LOW_CONTRAST
+
+        buf = face.bytearray()
+        width = face.width()
+        height = face.height()
+        sharpness = self._sharpness(buf, width, height, mean)
+        asymmetry = self._asymmetry(buf, width, height)
+        self.last = (mean, stdev, sharpness, asymmetry)
+        if sharpness < self.min_sharpness:
+            return BLURRED
+        if asymmetry > self.max_asymmetry:
+            return OFF_ANGLE
+        return None
+
+    def _sharpness(self, buf, width, height, mean):
+        """隔 stride 点采样的 sqrt((横向差² + 纵向差²) 均值) / 平均亮度"""
+        s = self.stride
+        down = s * width
+        energy = 0
+        count = 0
+        for y in range(0, height - s, s):
+            row = y * width
+            for p in range(row, row + width - s, s):
+                v = buf[p]
+                dx = buf[p + s] - v
+                dy = buf[p + down] - v
+                energy += dx * dx + dy * dy
+                count += 1
+        if not count:
+            return 0.0
+        return math.sqrt(energy / count) / mean
+
+    def _asymmetry(self, buf, width, height):
+        """眼部条带列均值最暗处：左眼位置与右眼镜像位置之差 / 宽度
+
+        列均值先减去最小二乘拟合的线性趋势，侧光造成的左右明暗差不会把最暗处推向一边。
+        """
+        s = self.stride
+        y0 = int(height * EYE_BAND[0])
+        y1 = int(height * EYE_BAND[1])
+        x0 = int(width * EYE_SEARCH[0])
+        x1 = int(width * EYE_SEARCH[1])
+        first = x0
+        last = width - 1 - x0
+        profile = []
+        for x in range(first, last + 1):
+            total = 0
+            for p in range(y0 * width + x, y1 * width + x, s * width):
+                total += buf[p]
+            profile.append(total)
+
+        n = len(profile)
+        center = (n - 1) / 2   # 截距不影响最暗处的位置，只需拟合斜率
+        spread = 0.0
+        slope = 0.0
+        for k in range(n):
+            spread += (k - center) * (k - center)
+            slope += (k - center) * profile[k]
+        slope /= spread
+
+        left = self._darkest(profile, slope, center, 0, x1 - first)
+        right = self._darkest(profile, slope, center, n - 1 - (x1 - first), n)
+        return abs(left - (n - 1 - right)) / width
+
+    @staticmethod
+    def _darkest(profile, slope, center, start, end):
+        best = start
+        best_value = None
+        for k in range(start, end):
+            value = profile[k] - slope * (k - center)
+            if best_value is None or value < best_value:
+                best = k
+                best_value = value
+        return best
+
+    def stats(self):
+        stats = {"checked": self.checked}
+        stats.update(self.rejected)
+        return stats
@@ -0,0 +1,80 @@
+"""人脸跟踪
+
+找到人脸后，下一帧只在上次人脸框外扩的ROI内做Haar检测；
+跟丢或每隔 full_scan_every 帧才回到整帧扫描。
+给出 scheduler（DetectionScheduler）时，整帧扫描的范围、缩小倍数和检测阈值都由它决定。
+"""
+
+
+class FaceTracker:
+    """在 camera.find_faces 之上加一层ROI跟踪"""
+
+    def __init__(self, camera, margin=0.5, full_scan_every=15, threshold=0.5, scale_factor=1.25, scheduler=None):
+        self.camera = camera
+        self.scheduler = scheduler
+        self.margin = margin                    # ROI 每边外扩的比例（相对人脸宽高）
+        self.full_scan_every = full_scan_every  # 即使一直跟踪成功，也定期整帧扫描
+        self.threshold = threshold
+        self.scale_factor = scale_factor
+        self.last_face = None
+        self.frames_since_full = 0
+
+        # 统计
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.roi_hits = 0
+
+    def reset(self):
+        self.last_face = None
+        self.frames_since_full = 0
+
+    def track_roi(self, frame_w, frame_h):
+        """上次人脸框外扩后的ROI，裁剪到画面内"""
+        x, y, w, h = self.last_face
+        mx = int(w * self.margin)
+        my = int(h * self.margin)
+        x0 = max(0, x - mx)
+        y0 = max(0, y - my)
+        x1 = min(frame_w, x + w + mx)
+        y1 = min(frame_h, y + h + my)
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def find_faces(self, img):
+        """返回本帧检测到的人脸框列表"""
+        faces = None
+        if self.last_face is not None and self.frames_since_full < self.full_scan_every:
+            roi = self.track_roi(img.width(), img.height())
+            self.roi_scans += 1
+            if self.scheduler is None:
+                faces = self.camera.find_faces(img, threshold=self.threshold,
+                                               scale_factor=self.scale_factor, roi=roi)
+            else:
+                faces = self.scheduler.detect(img, roi, self.scheduler.track_pool(self.last_face[2]),
+                                              self.scale_factor)
+            if faces:
+                self.roi_hits += 1
+                self.frames_since_full += 1
+
+        if not faces:
+            # 跟丢或到了定期整帧扫描的时候
+            self.full_scans += 1
+            self.frames_since_full = 0
+            if self.scheduler is None:
+                faces = self.camera.find_faces(img, threshold=self.threshold,
+                                               scale_factor=self.scale_factor)
+            else:
+                roi, pool, max_size = self.scheduler.full_scan(img.width(), img.height())
+                faces = self.scheduler.detect(img, roi, pool, self.scale_factor, max_size)
+
+        if faces:
+            self.last_face = max(faces, key=lambda f: f[2] * f[3])
+        else:
+            self.last_face = None
+        return faces
+
+    def stats(self):
+        return {
+            "full_scans": self.full_scans,
+            "roi_scans": self.roi_scans,
+            "roi_hits": self.roi_hits,
+        }
@@ -0,0 +1,214 @@
+"""硬件抽象层
+
+摄像头、LCD、LED、UART 和时钟都通过 Board 上的小接口访问。
+device_board() 返回 OpenMV 板上的实现；主机端的模拟实现在 sim.py 中。
+"""
+
+# 摄像头工作模式：识别时 QVGA 彩色，空闲时小分辨率灰度只做运动检测
+MODE_ACTIVE = "active"
+MODE_IDLE = "idle"
+
+# 识别模式下的采集格式：RGB565 整帧彩色，或灰度采集、只在显示的帧上转彩色
+CAPTURE_RGB = "rgb565"
+CAPTURE_GRAY = "grayscale"
+
+
+class DeviceCamera:
+    """OpenMV 摄像头 + Haar 人脸检测"""
+
+    def __init__(self, capture=CAPTURE_RGB, framebuffers=1):
+        import sensor
+        import image
+        self._sensor = sensor
+        self._image = image
+        self.capture = capture
+        self._canvas = None  # 灰度采集时的彩色显示画布，首次显示时分配
+
+        sensor.reset()
+        sensor.set_pixformat(self._active_pixformat())
+        sensor.set_framesize(sensor.QVGA)
+        sensor.set_contrast(2)
+        sensor.set_brightness(0)
+        sensor.set_gainceiling(8)
+        sensor.skip_frames(time=1000)
+        sensor.set_auto_gain(True)
+        sensor.set_auto_whitebal(True)
+        sensor.set_hmirror(True)
+        #sensor.set_vflip(True)
+        if framebuffers > 1:
+            # 多缓冲：处理当前帧时下一帧已在曝光，snapshot() 取最新完成的一帧
+            sensor.set_framebuffers(framebuffers)
+
+        # 加载人脸级联模型
+        self.stages = 20
+        self.face_cascade = image.HaarCascade("frontalface", stages=self.stages)
+        self.mode = MODE_ACTIVE
+        self._pooled = None  # 缩小检测用的灰度图，首次使用时分配
+
+    def _active_pixformat(self):
+        # 灰度采集：检测和特征只需要灰度，帧缓冲与带宽减半
+        if self.capture == CAPTURE_GRAY:
+            return self._sensor.GRAYSCALE
+        return self._sensor.RGB565  # RGB565以支持LCD彩色显示
+
+    def set_mode(self, mode):
+        """切换识别/空闲配置"""
+        if mode == self.mode:
+            return
+        sensor = self._sensor
+        if mode == MODE_IDLE:
+            sensor.set_pixformat(sensor.GRAYSCALE)
+            sensor.set_framesize(sensor.QQQVGA)
+        else:
+            sensor.set_pixformat(self._active_pixformat())
+            sensor.set_framesize(sensor.QVGA)
+        # 丢弃切换后曝光未稳定的帧
+        sensor.skip_frames(n=2)
+        self.mode = mode
+
+    def snapshot(self):
+        return self._sensor.snapshot()
+
+    def width(self):
+        return self._sensor.width()
+
+    def height(self):
+        return self._sensor.height()
+
+    def blank_image(self):
+        """与画面同尺寸的黑色图像"""
+        img = self._image.Image(self._sensor.width(), self._sensor.height(), self._active_pixformat())
+        img.clear()
+        return img
+
+    def display_frame(self, img):
+        """返回用于LCD显示和叠加绘制的图像
+
+        RGB565 采集时就是原帧；灰度采集时把帧转换到预分配的彩色画布上，
+        这样只有真正显示的帧才付出彩色转换的代价，叠加的文字和框仍是彩色。
+        """
+        if self.capture != CAPTURE_GRAY:
+            return img
+        if self._canvas is None:
+            # 画布放在帧缓冲区的额外空间里，不占MicroPython堆
+            self._canvas = self._sensor.alloc_extra_fb(img.width(), img.height(), self._sensor.RGB565)
+        self._canvas.draw_image(img, 0, 0)
+        return self._canvas
+
+    def scratch_image(self, width, height):
+        """预分配的灰度暂存图（人脸ROI缩放拷贝的目标）"""
+        return self._image.Image(width, height, self._sensor.GRAYSCALE)
+
+    def set_stages(self, stages):
+        """重新加载指定级数的人脸级联（级数越少越快，误检越多）"""
+        if stages != self.stages:
+            self.face_cascade = self._image.HaarCascade("frontalface", stages=stages)
+            self.stages = stages
+
+    def find_faces(self, img, threshold=0.5, scale_factor=1.25, roi=None, pool=1):
+        """Haar人脸检测，返回原图坐标的人脸框
+
+        pool > 1 时（可以是小数）先把 roi 缩小 pool 倍拷贝进预分配的灰度图再检测：
+        扫描的像素减少 pool² 倍，并跳过缩小后不足一个检测窗口的小尺度。
+        """
+        if pool > 1:
+            rx, ry, rw, rh = roi if roi is not None else (0, 0, img.width(), img.height())
+            canvas = self._pool_image(pool)
+            canvas.draw_image(img, 0, 0, x_scale=1 / pool, y_scale=1 / pool, roi=(rx, ry, rw, rh))
+            faces = canvas.find_features(self.face_cascade, threshold=threshold, scale_factor=scale_factor,
+                                         roi=(0, 0, int(rw / pool), int(rh / pool)))
+            return [(rx + int(x * pool), ry + int(y * pool), int(w * pool), int(h * pool)) for x, y, w, h in faces]
+        if roi is None:
+            return img.find_features(self.face_cascade, threshold=threshold, scale_factor=scale_factor)
+        return img.find_features(self.face_cascade, threshold=threshold, scale_factor=scale_factor, roi=roi)
+
+    def _pool_image(self, pool):
+        """缩小用的灰度图；已有的图够大就沿用（pool 随学到的尺寸变化，避免反复分配）"""
+        if self._pooled is None or self._pooled[0] > pool:
+            self._pooled = None  # 先释放旧图
+            width = int(self._sensor.width() / pool)
+            height = int(self._sensor.height() / pool)
+            self._pooled = (pool, self._image.Image(width, height, self._sensor.GRAYSCALE))
+        return self._pooled[1]
+
+
+class DeviceDisplay:
+    """板载LCD"""
+
+    def __init__(self):
+        import lcd
+        self._lcd = lcd
+        lcd.init()
+
+    def show(self, img):
+        self._lcd.display(img)
+
+
+class DeviceClock:
+    """time 模块的毫秒/微秒计时"""
+
+    def __init__(self):
+        import time
+        self._time = time
+
+    def ticks_ms(self):
+        return self._time.ticks_ms()
+
+    def ticks_us(self):
+        return self._time.ticks_us()
+
+    def ticks_diff(self, a, b):
+        return self._time.ticks_diff(a, b)
+
+    def sleep_ms(self, ms):
+        self._time.sleep_ms(ms)
+
+    def sleep_async(self, ms):
+        """协作式休眠，在 uasyncio 任务中 await"""
+        import uasyncio
+        return uasyncio.sleep_ms(ms)
+
+    def clock(self):
+        return self._time.clock()
+
+
+class Board:
+    """一块门锁板的全部外设"""
+
+    def __init__(self, camera, display, red_led, green_led, blue_led, uart, clock):
+        self.camera = camera
+        self.display = display
+        self.red_led = red_led
+        self.green_led = green_led
+        self.blue_led = blue_led
+        self.uart = uart
+        self.clock = clock
+
+    def running(self):
+        """主循环是否继续；设备上永远为 True"""
+        return True
+
+
+def device_board(capture=CAPTURE_RGB, framebuffers=1):
+    """按原 lock.py 的配置初始化板上外设"""
+    import gc
+    from pyb import LED
+    from pyb import UART
+
+    red_led = LED(1)
+    green_led = LED(2)
+    blue_led = LED(3)
+
+    # 初始化UART通信
+    uart = UART(2, 9600, timeout_char=200)
+
+    # 强制清理内存
+    gc.collect()
+
+    # 初始化摄像头
+    camera = DeviceCamera(capture, framebuffers)
+
+    # 初始化LCD
+    display = DeviceDisplay()
+
+    return Board(camera, display, red_led, green_led, blue_led, uart, DeviceClock())
@@ -1,287 +1,119 @@
-import sensor
-import image
-import time
-import gc
-import math
-import lcd  # 添加LCD模块
-from pyb import LED
-from pyb import UART
-
-red_led = LED(1)
-green_led = LED(2)
-blue_led = LED(3)
-
-# 初始化UART通信
-uart = UART(2, 9600, timeout_char=200)
-
-# 强制清理内存
-gc.collect()
-
-# 初始化摄像头
-sensor.reset()
-sensor.set_pixformat(sensor.RGB565)  # 改为RGB565以支持LCD彩色显示
-sensor.set_framesize(sensor.QVGA)
-sensor.set_contrast(2)
-sensor.set_brightness(0)
-sensor.set_gainceiling(8)
-sensor.skip_frames(time=1000)
-sensor.set_auto_gain(True)
-sensor.set_auto_whitebal(True)
-sensor.set_hmirror(True)
-#sensor.set_vflip(True)
-
-# 初始化LCD
-lcd.init()
-
-# 加载人脸级联模型
-face_cascade = image.HaarCascade("frontalface", stages=20)
-
-# 存储用户人脸信息
-user_faces = []
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # 主机环境
+from face_features import (DEFAULT_LBP_SPEC, FACE_SIZE, FEATURE_DIM, MIN_FACE_SIZE, FaceScratch,
+                           extract_simple_features)
+from face_matcher import Gallery
+from face_quality import TOO_SMALL, QualityGate
+from calibration import Calibration, calibration_path, impostor_path
+from adaptation import TemplateUpdater
+from decision import ACCEPT, LOW_CONFIDENCE, PENDING, UNSTABLE, SequentialDecision
+from face_tracker import FaceTracker
+from detect_schedule import DetectionScheduler
+from enrollment import EnrollmentPool, pairwise_spread
+from event_log import (EV_BOOT, EV_ENROLL, EV_ERROR, EV_NO_FEATURES, NO_USER, STAGES, VERDICT_EVENTS,
+                       EventLog, Exporter, events_path)
+from hal import CAPTURE_GRAY, MODE_ACTIVE, MODE_IDLE
+from motion_gate import MotionGate
+from memory_manager import MemoryManager
+from profiler import Profiler
+from template_store import default_path, load_templates, save_templates
+from uart_link import FRAME_OVERHEAD, MAX_PAYLOAD, MSG_DENY, MSG_STATS, MSG_UNCERTAIN, MSG_UNLOCK, UartLink
+
+# 板上外设（摄像头、LCD、LED、UART、时钟），由 run() 设置
+board = None
+# 分阶段耗时统计，由 run() 设置
+profiler = None
+# 垃圾回收策略，由 run() 设置
+memory = None
+# 预分配的人脸灰度暂存图，由 run() 设置
+face_scratch = None
+# 人脸质量门控，quality_gate_enabled 为 False 时为 None
+quality_gate = None
+# 人脸检测调度，detect_schedule_enabled 为 False 时为 None
+detector = None
+# 当前LED状态及设置时间，由LED任务负责超时熄灭
+led_status = 'off'
+led_status_time = 0
+# 待LCD任务显示的画面；调度器运行时 display_ready 为 asyncio.Event
+pending_frame = None
+display_ready = None
+# UART链路（uart_framed 时由 run() 设置）和模板文件路径（由 load_or_enroll() 设置）
+link = None
+store_path = None
+# stats 命令还没排进发送缓冲区的报告行
+stats_pending = []
+# 识别判决器（识别任务创建，UART命令可调整其阈值）
+decision = None
+# 按用户标定的阈值（由 compute_baseline() 设置）
+calibration = None
+# 在线模板更新（识别任务创建）
+updater = None
+# UART命令请求录入新用户，由识别任务在两帧之间执行
+enroll_requested = False
+# 事件日志（由 load_or_enroll() 打开）和进行中的UART导出
+events = None
+exporter = None
 
 # 配置参数
 num_users_to_enroll = 1
 faces_per_user = 6  # 适中的样本数量
-print("准备录入", num_users_to_enroll, "位用户的人脸，每人拍摄", faces_per_user, "张照片")
+enroll_streaming = True  # 连续采集一段时间，挑出差异最大的 faces_per_user 个样本；False 时恢复逐张拍照（每张前等 2 秒）
+enroll_window_ms = 3000  # 流式录入的采集窗口
+enroll_lost_ms = 500  # 候选已够数时人脸消失多久就提前结束
+enroll_timeout_ms = 20000  # 一直凑不够合格样本时最多采集多久
+enroll_candidates = 24  # 候选池容量（每个候选 FEATURE_DIM 字节）
+enroll_min_similarity = 0.85  # 与中心样本得分低于该值的候选视为离群（误检、路过的人），不入选
+template_bits = 8  # 4: LBP直方图按4位量化存储，每个模板 48 字节而不是 80 字节（bench.py templates 看精度代价）
+recognition_threshold = 0.9  # 默认识别阈值，还没有标定的用户使用（用 evaluate.py 在录制的数据集上评估）
+reject_threshold = 0.89  # 默认拒绝阈值
+identify_top_k = 3  # 用户多于该数时先按平均模板粗排，只对前几位逐模板精比
+fusion_max_frames = 6  # 一次识别最多累积的帧数，1 为原来的单帧判决
+fusion_window = 4  # 证据滑动窗口的帧数
+frame_sleep_ms = 0  # 每帧结束后的休眠，原来固定 50ms；0 表示只让出CPU给其他任务
+camera_framebuffers = 3  # 传感器帧缓冲数，>1 时下一帧在处理当前帧时曝光
+uart_poll_ms = 10  # UART任务的轮询间隔；每次最多写 uart_max_write 字节，短而频繁
+uart_max_write = 4  # 每次轮询最多写出的字节数；UART.write 阻塞到发完，9600 波特率下每字节约 1 ms
+led_poll_ms = 100  # LED超时任务的检查间隔
+uart_framed = True  # 帧+校验+确认重发的链路协议；False 时保持原来的明文 "Hello World"
+idle_timeout_ms = 15000  # 无人脸/无运动多久后进入低功耗空闲模式
+idle_frame_ms = 100  # 空闲模式的帧间隔
+profile_enabled = True  # 记录各阶段耗时（关闭时几乎无开销）
+profile_report_every = 10  # 每识别多少次在REPL输出一次耗时报告，0为不输出
+gc_low_watermark = 48 * 1024  # 空闲堆低于该值才显式回收
+gc_every_frame = False  # True 时恢复原来的每帧、每次绘制都完整回收
+adapt_enabled = True  # 有把握的识别结果补进/替换该用户的模板，跟上光照和外貌变化
+adapt_slots = 2  # 每位用户在录入模板数之外最多再追加几个模板（每人上限 faces_per_user + adapt_slots）
+adapt_pinned = 2  # 每位用户的前几个录入模板永不替换，防止模板整体漂移到别人身上
+adapt_margin = 0.02  # 得分至少高出该用户识别阈值多少才用来更新
+adapt_min_interval_ms = 60000  # 同一用户两次更新的最小间隔
+adapt_save_interval_ms = 600000  # 写flash的最小间隔（保护flash寿命）
+quality_gate_enabled = True  # 模糊、曝光不当、侧脸的帧不提取特征、不计入判决（录入同样适用）
+detect_schedule_enabled = True  # 按见过的人脸尺寸和高度限制Haar扫描范围，按耗时调整阈值和级数
+detect_budget_ms = 40  # 检测耗时的目标上限
+event_log_enabled = True  # 判决和失败写入定长二进制事件日志（模板文件旁的 events.log），UART命令 events 导出
+event_log_pages = 64  # flash上日志的页数（每页 512 字节、15 条记录），写满后循环覆盖最旧的一页
+event_flush_ms = 60000  # 不满一页的记录最迟多久写一次flash（保护flash寿命）
+capture_mode = CAPTURE_GRAY  # CAPTURE_GRAY: 灰度采集，只在显示的帧上转彩色；CAPTURE_RGB: 整帧彩色采集
+
+# 常用颜色和固定文字行，避免每帧重新创建
+WHITE = (255, 255, 255)
+TITLE_LINE = ("人脸识别系统", WHITE)
+RECOGNIZING_LINE = ("正在识别...", (255, 255, 0))
+WAIT_LINE = ("请稍候...", WHITE)
+NO_FACE_LINE = ("等待检测人脸", WHITE)
 
-def preprocess_face(face_roi):
-    """温和的人脸预处理"""
-    try:
-        # 转换为灰度进行处理
-        if face_roi.format() == sensor.RGB565:
-            face_roi = face_roi.to_grayscale()
-
-        # 直方图均衡化增强对比度
-        face_roi.histeq()
-
-        # 轻微降噪
-        face_roi.gaussian(1)
-
-        return face_roi
-    except Exception as e:
-        print(f"预处理失败: {e}")
-        return face_roi
-
-def extract_stable_lbp_features(face_roi, radius=1, neighbors=8):
-    """稳定的LBP特征提取"""
-    try:
-        # 确保是灰度图像
-        if face_roi.format() == sensor.RGB565:
-            face_roi = face_roi.to_grayscale()
-
-        width = face_roi.width()
-        height = face_roi.height()
-
-        if width < 24 or height < 24:
-            return None
-
-        # LBP模式偏移量
-        offsets = []
-        for i in range(neighbors):
-            angle = 2 * math.pi * i / neighbors
-            dx = int(radius * math.cos(angle))
-            dy = int(radius * math.sin(angle))
-            offsets.append((dx, dy))
-
-        # 更大的人脸区域划分，增加稳定性
-        regions = [
-            (0.1, 0.1, 0.5, 0.5, "左上"),     # 左上（包含左眼）
-            (0.5, 0.1, 0.9, 0.5, "右上"),     # 右上（包含右眼）
-            (0.2, 0.3, 0.8, 0.7, "中央"),     # 中央（鼻子区域）
-            (0.2, 0.6, 0.8, 0.95, "下部"),    # 下部（嘴部区域）
-        ]
-
-        all_features = []
-
-        for x_start_r, y_start_r, x_end_r, y_end_r, region_name in regions:
-            x_start = int(width * x_start_r)
-            y_start = int(height * y_start_r)
-            x_end = int(width * x_end_r)
-            y_end = int(height * y_end_r)
-
-            # LBP直方图
-            lbp_hist = [0] * 256
-            total_pixels = 0
-
-            # 适当的采样密度
-            step = max(1, (x_end - x_start) // 12)
-
-            for y in range(y_start + radius, y_end - radius, step):
-                for x in range(x_start + radius, x_end - radius, step):
-                    try:
-                        center_pixel = face_roi.get_pixel(x, y)
-                        if isinstance(center_pixel, tuple):
-                            center_pixel = sum(center_pixel) // len(center_pixel)
-
-                        lbp_value = 0
-                        valid_neighbors = 0
-
-                        for i, (dx, dy) in enumerate(offsets):
-                            nx, ny = x + dx, y + dy
-                            if 0 <= nx < width and 0 <= ny < height:
-                                neighbor_pixel = face_roi.get_pixel(nx, ny)
-                                if isinstance(neighbor_pixel, tuple):
-                                    neighbor_pixel = sum(neighbor_pixel) // len(neighbor_pixel)
-
-                                if neighbor_pixel >= center_pixel:
-                                    lbp_value |= (1 << i)
-                                valid_neighbors += 1
-
-                        if valid_neighbors == neighbors:
-                            lbp_hist[lbp_value] += 1
-                            total_pixels += 1
-
-                    except:
-                        pass
-
-            # 选择更有区分性的LBP模式
-            if total_pixels > 0:
-                # 均匀模式 + 一些重要的非均匀模式
-                important_patterns = [
-                    0, 1, 3, 7, 15, 31, 63, 127, 255,  # 均匀模式
-                    2, 4, 6, 8, 12, 14, 16, 24, 28, 30,  # 重要非均匀模式
-                    32, 48, 56, 60, 62, 64, 96, 112, 120, 124
-                ]
-
-                region_features = []
-                for pattern in important_patterns[:16]:  # 取前16个模式
-                    normalized_value = (lbp_hist[pattern] * 100) // total_pixels  # 降低归一化系数
-                    region_features.append(min(255, normalized_value))
-
-                all_features.extend(region_features)
-            else:
-                all_features.extend([0] * 16)
-
-        return all_features
-
-    except Exception as e:
-        print(f"LBP特征提取失败: {e}")
-        return None
-
-def extract_simple_features(face_roi):
-    """简化但稳定的特征提取"""
-    try:
-        # 预处理
-        face_roi = preprocess_face(face_roi)
-
-        width = face_roi.width()
-        height = face_roi.height()
-
-        if width < 24 or height < 24:
-            return None
-
-        all_features = []
-
-        # 1. LBP特征（主要）
-        lbp_features = extract_stable_lbp_features(face_roi)
-        if lbp_features:
-            all_features.extend(lbp_features)
-
-        # 2. 简化的网格统计特征
-        grid_size = 6  # 降低网格大小
-        cell_w = width // grid_size
-        cell_h = height // grid_size
-
-        for i in range(grid_size):
-            for j in range(grid_size):
-                x_start = i * cell_w
-                y_start = j * cell_h
-                x_end = min(x_start + cell_w, width)
-                y_end = min(y_start + cell_h, height)
-
-                # 计算该网格的平均灰度
-                pixel_sum = 0
-                pixel_count = 0
-
-                for y in range(y_start, y_end, 2):
-                    for x in range(x_start, x_end, 2):
-                        try:
-                            pixel = face_roi.get_pixel(x, y)
-                            if isinstance(pixel, tuple):
-                                pixel = sum(pixel) // len(pixel)
-                            pixel_sum += pixel
-                            pixel_count += 1
-                        except:
-                            pass
-
-                if pixel_count > 0:
-                    avg_gray = pixel_sum // pixel_count
-                    all_features.append(avg_gray)
-                else:
-                    all_features.append(128)  # 默认中等灰度
-
-        # 只取部分网格特征避免过拟合
-        all_features = all_features[:80]  # LBP(64) + 部分网格特征(16)
-
-        print(f"特征维度: {len(all_features)}")
-        return all_features
-
-    except Exception as e:
-        print(f"特征提取失败: {e}")
-        return None
-
-def calculate_balanced_similarity(features1, features2):
-    """平衡的相似度计算"""
-    try:
-        if not features1 or not features2 or len(features1) != len(features2):
-            return 0.0
-
-        n_features = len(features1)
-
-        # 1. 计算归一化的欧氏距离
-        squared_diff_sum = 0
-        for i in range(n_features):
-            diff = features1[i] - features2[i]
-            squared_diff_sum += diff * diff
-
-        euclidean_distance = math.sqrt(squared_diff_sum) / math.sqrt(n_features)
-
-        # 2. 计算曼哈顿距离
-        manhattan_distance = sum(abs(features1[i] - features2[i]) for i in range(n_features)) / n_features
-
-        # 3. 计算相关系数
-        mean1 = sum(features1) / n_features
-        mean2 = sum(features2) / n_features
-
-        numerator = sum((features1[i] - mean1) * (features2[i] - mean2) for i in range(n_features))
-
-        sum_sq1 = sum((features1[i] - mean1) ** 2 for i in range(n_features))
-        sum_sq2 = sum((features2[i] - mean2) ** 2 for i in range(n_features))
-
-        correlation = 0
-        if sum_sq1 > 0 and sum_sq2 > 0:
-            correlation = numerator / math.sqrt(sum_sq1 * sum_sq2)
-
-        # 4. 距离到相似度的转换（更温和）
-        # 基于实际测试调整这些参数
-        max_euclidean = 40    # 降低阈值
-        max_manhattan = 60    # 降低阈值
-
-        euclidean_sim = max(0, 1 - euclidean_distance / max_euclidean)
-        manhattan_sim = max(0, 1 - manhattan_distance / max_manhattan)
-        correlation_sim = (correlation + 1) / 2  # 将-1到1映射到0到1
-
-        # 综合相似度
-        final_similarity = (
-            euclidean_sim * 0.4 +
-            manhattan_sim * 0.3 +
-            correlation_sim * 0.3
-        )
-
-        # 温和的非线性变换
-        final_similarity = math.sqrt(final_similarity)  # 开方而不是立方
-
-        return max(0.0, min(1.0, final_similarity))
-
-    except Exception as e:
-        print(f"相似度计算失败: {e}")
-        return 0.0
 
 # 内存优化：LCD显示函数
 def safe_lcd_display(img, text_lines, face_rect=None, rect_color=(255, 255, 255)):
     """安全的LCD显示函数，避免内存泄漏"""
     try:
-        # 直接在原图上绘制，避免复制
+        # RGB565采集时直接在原图上绘制；灰度采集时只有显示的帧才转成彩色画面
+        t = profiler.begin()
+        img = board.camera.display_frame(img)
+        profiler.end("render", t)
+
         y_offset = 5
         for text, color in text_lines:
             img.draw_string(5, y_offset, text, color=color, scale=2)
@@ -291,29 +123,44 @@ def safe_lcd_display(img, text_lines, face_rect=None, rect_color=(255, 255, 255)
         if face_rect:
             img.draw_rectangle(face_rect, color=rect_color, thickness=2)
 
-        # 显示到LCD
-        lcd.display(img)
+        # 交给LCD任务显示
+        show_frame(img)
 
-        # 立即清理
-        gc.collect()
+        # 空闲堆不足时才清理
+        t = profiler.begin()
+        memory.collect_if_low()
+        profiler.end("gc", t)
 
     except Exception as e:
         print(f"LCD显示异常: {e}")
-        gc.collect()
+        memory.collect()
+
+
+def show_frame(img):
+    """交给LCD任务显示（只保留最新一帧）；调度器未运行时（录入阶段）直接显示"""
+    global pending_frame
+    if display_ready is None:
+        t = profiler.begin()
+        board.display.show(img)
+        profiler.end("lcd", t)
+    else:
+        pending_frame = img
+        display_ready.set()
+
 
 def lcd_turn_off():
     """LCD熄屏 - 显示黑屏"""
     try:
         # 创建一个全黑的图像
-        black_img = image.Image(sensor.width(), sensor.height(), sensor.RGB565)
-        black_img.clear()  # 清空为黑色
-        lcd.display(black_img)
+        black_img = board.camera.blank_image()  # 清空为黑色
+        show_frame(black_img)
         del black_img
-        gc.collect()
+        memory.collect_if_low()
         print("LCD屏幕已熄灭")
     except Exception as e:
         print(f"LCD熄屏失败: {e}")
-        gc.collect()
+        memory.collect()
+
 
 def lcd_wake_up():
     """LCD唤醒 - 重新初始化"""
@@ -322,55 +169,170 @@ def lcd_wake_up():
         print("LCD屏幕已唤醒")
     except Exception as e:
         print(f"LCD唤醒失败: {e}")
-        gc.collect()
+        memory.collect()
+
 
 def turn_off_all_leds():
     """关闭所有LED"""
-    red_led.off()
-    green_led.off()
-    blue_led.off()  # 添加蓝色LED关闭
+    board.red_led.off()
+    board.green_led.off()
+    board.blue_led.off()  # 添加蓝色LED关闭
+
 
 def set_led_status(status):
     """设置LED状态
     status: 'success' - 绿灯, 'fail' - 红灯, 'uncertain' - 黄灯, 'blue' - 蓝灯, 'off' - 全部关闭
     """
+    global led_status, led_status_time
+    led_status = status
+    led_status_time = board.clock.ticks_ms()
     turn_off_all_leds()
     if status == 'success':
-        green_led.on()
+        board.green_led.on()
     elif status == 'fail':
-        red_led.on()
+        board.red_led.on()
     elif status == 'uncertain':
-        red_led.on()
-        green_led.on()
+        board.red_led.on()
+        board.green_led.on()
     elif status == 'blue':
-        blue_led.on()
+        board.blue_led.on()
     # 'off' 状态已经通过 turn_off_all_leds() 处理
 
-# === 录入阶段 ===
-print("开始录入阶段，共拍摄6张照片：\n1. 保持正脸朝向镜头\n2. 保持静止\n3. 保持光线充足且均匀")
-for user_id in range(num_users_to_enroll):
-    username = "用户" + str(user_id + 1)
-    print(f"\n开始录入 {username}")
 
-    user_face_data = {
-        "name": username,
-        "faces": []
-    }
+def handle_command(text):
+    """处理链路上收到的命令，返回回复行
+
+    stats                 - 以 MSG_STATS 帧发送各阶段耗时报告（随缓冲区空出陆续排队）
+    events                - 以 MSG_EVENTS 帧导出事件日志（空载荷表示结束）
+    enroll                - 在识别任务的下一帧之间录入一位新用户
+    threshold <识别> <拒绝> [用户名] - 调整判决阈值；不带用户名时对所有人生效并停用按用户标定
+    threshold auto        - 恢复按用户标定的阈值
+    """
+    global enroll_requested, exporter, stats_pending
+    parts = text.strip().split()
+    if not parts:
+        return ["ERR 空命令"]
+    command = parts[0]
+
+    if command == "stats":
+        if stats_pending:
+            return ["ERR 统计发送中"]
+        stats_pending = [line.encode()[:MAX_PAYLOAD] for line in profiler.report_lines()]
+        return [f"OK {len(stats_pending)} 行"]
+
+    if command == "events":
+        if events is None:
+            return ["ERR 事件日志未启用"]
+        if exporter is not None:
+            return ["ERR 导出进行中"]
+        exporter = Exporter(events, link)
+        return [f"OK 导出最多 {events.seq} 条记录"]
+
+    if command == "enroll":
+        enroll_requested = True
+        return ["OK 开始录入新用户"]
+
+    if command == "threshold":
+        if decision is None:
+            return ["ERR 识别尚未开始"]
+        if parts[1:] == ["auto"]:
+            decision.user_thresholds = calibration.thresholds if calibration else {}
+            return [f"OK 按用户标定 {len(decision.user_thresholds)} 位"]
+        try:
+            recognition_threshold = float(parts[1])
+            reject_threshold = float(parts[2])
+        except (IndexError, ValueError):
+            return ["ERR 用法: threshold <识别阈值> <拒绝阈值>"]
+        if not 0 < reject_threshold <= recognition_threshold <= 1:
+            return ["ERR 需要 0 < 拒绝阈值 <= 识别阈值 <= 1"]
+        if len(parts) > 3:
+            name = " ".join(parts[3:])
+            # 手动覆盖只作用于本次运行，不写回标定
+            if calibration is not None and decision.user_thresholds is calibration.thresholds:
+                decision.user_thresholds = dict(calibration.thresholds)
+            decision.user_thresholds[name] = (recognition_threshold, reject_threshold)
+        else:
+            name = "所有用户"
+            decision.recognition_threshold = recognition_threshold
+            decision.reject_threshold = reject_threshold
+            decision.user_thresholds = {}
+        print(f"UART命令调整阈值({name}): 识别 {recognition_threshold:.3f}, 拒绝 {reject_threshold:.3f}")
+        return [f"OK {recognition_threshold:.3f} {reject_threshold:.3f}"]
+
+    return [f"ERR 未知命令: {command}"]
+
+
+def log_event(kind, gallery=None, name=None, score=0.0, consistency=0.0, frames=0):
+    """写一条事件日志，附带各阶段最近一次的耗时和空闲堆"""
+    if events is None:
+        return
+    user = NO_USER
+    if gallery is not None and name in gallery.names:
+        user = gallery.names.index(name)
+    events.record(kind, board.clock.ticks_ms(), user, score, consistency, frames,
+                  [profiler.last(stage) for stage in STAGES], memory.free())
+
+
+def open_event_log(template_path):
+    """打开模板文件旁的事件日志并记一条上电事件"""
+    global events
+    events = None
+    if not event_log_enabled:
+        return
+    events = EventLog(events_path(template_path), event_log_pages, flush_ms=event_flush_ms,
+                      clock=board.clock)
+    print(f"事件日志: {events.path or '仅内存'}, 下一条序号 {events.seq}")
+    log_event(EV_BOOT)
+
+
+def send_event(msg_type, name):
+    """通过链路发送判决事件"""
+    if link is not None:
+        link.send(msg_type, name or "")
 
+
+def poll_uart_commands():
+    """处理明文UART命令（uart_framed = False 时）：stats - 发送各阶段耗时报告"""
+    data = board.uart.read()
+    if data and data.strip() == b"stats":
+        profiler.report(lambda line: board.uart.write(line + "\n"))
+
+
+def face_problem(img, rect):
+    """人脸框 rect 不适合识别的原因，合格时返回 None
+
+    合格时人脸已缩放拷贝进 face_scratch（尚未预处理），接着调用 face_scratch.preprocess()。
+    """
+    x, y, w, h = rect
+    if w < MIN_FACE_SIZE or h < MIN_FACE_SIZE:
+        return TOO_SMALL
+    face_scratch.copy(img, rect, profiler)
+    problem = None
+    if quality_gate is not None:
+        t = profiler.begin()
+        problem = quality_gate.check(face_scratch.image, w, h)
+        profiler.end("quality", t)
+    if problem is None and detector is not None:
+        detector.observe(rect)  # 可识别的人脸才计入检测范围
+    return problem
+
+
+def enroll_photos(gallery, username, tracker):
+    """原来的逐张拍照：每张前等 2 秒，取第一张合格人脸，返回保存的照片数"""
     face_count = 0
-    while face_count < faces_per_user:
+    while face_count < faces_per_user and board.running():
         print(f"拍摄第 {face_count + 1} 张照片...")
-        time.sleep(2)
+        board.clock.sleep_ms(2000)
 
         attempt_count = 0
         face_captured = False
 
-        while not face_captured and attempt_count < 30:
+        while not face_captured and attempt_count < 30 and board.running():
             try:
-                # 强制内存清理
-                gc.collect()
+                # 空闲堆不足时清理
+                memory.collect_if_low()
 
-                img = sensor.snapshot()
+                img = board.camera.snapshot()
 
                 # 优化：减少文本信息，直接在原图上绘制
                 text_lines = [
@@ -378,21 +340,22 @@ for user_id in range(num_users_to_enroll):
                     (f"照片 {face_count + 1}/{faces_per_user}", (255, 255, 255))
                 ]
 
-                faces = img.find_features(face_cascade, threshold=0.5, scale_factor=1.25)
+                faces = tracker.find_faces(img)
                 attempt_count += 1
 
                 if faces:
                     largest_face = max(faces, key=lambda f: f[2] * f[3])
                     x, y, w, h = largest_face
 
-                    if w >= 24 and h >= 24:
+                    problem = face_problem(img, largest_face)
+                    if problem is None:
                         print(f"检测到人脸: {w}x{h}")
 
-                        face_roi = img.copy(roi=(x, y, w, h))
-                        features = extract_simple_features(face_roi)
+                        # 录入的特征要长期保存，不复用输出缓冲区
+                        features = extract_simple_features(face_scratch.preprocess())
 
                         if features and len(features) > 40:
-                            user_face_data["faces"].append(features)
+                            gallery.add(username, features)
                             print(f"第 {face_count + 1} 张照片保存成功! 特征数: {len(features)}")
 
                             # 成功显示
@@ -406,11 +369,10 @@ for user_id in range(num_users_to_enroll):
                             text_lines.append(("特征提取失败", (255, 0, 0)))
                             safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
 
-                        del face_roi
-                        gc.collect()
+                        memory.collect_if_low()
                     else:
-                        print(f"人脸过小: {w}x{h}")
-                        text_lines.append(("人脸过小", (255, 0, 0)))
+                        print(f"{problem}: {w}x{h}")
+                        text_lines.append((problem, (255, 0, 0)))
                         safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
                 else:
                     if attempt_count % 5 == 0:
@@ -420,197 +382,490 @@ for user_id in range(num_users_to_enroll):
 
                 # 立即删除图像对象
                 del img
-                gc.collect()
+                memory.collect_if_low()
 
             except Exception as e:
                 print(f"录入异常: {e}")
-                gc.collect()
-
-            time.sleep_ms(100)
-
-    user_faces.append(user_face_data)
-    print(f"{username} 录入完成! 共 {len(user_face_data['faces'])} 张照片")
-
-    # 如果是第一个用户录入完成，点亮蓝LED并保持2秒
-    if user_id == 0:  # 第一个用户 (索引为0)
-        print("第一个用户录入完成，点亮蓝色LED")
-        set_led_status('blue')
-        time.sleep(2)  # 保持2秒
-        print("蓝色LED熄灭，准备录入下一个用户")
-        set_led_status('off')
-
-    gc.collect()
-
-print(f"\n录入阶段完成! 共录入 {len(user_faces)} 位用户")
-
-# 全部用户录入完成，点亮蓝LED并保持2秒
-print("全部用户录入完成，点亮蓝色LED")
-set_led_status('blue')
-time.sleep(2)  # 保持2秒
-print("蓝色LED熄灭，开始计算识别基线")
-set_led_status('off')
-
-# 计算用户内部相似度基线
-print("\n计算识别基线...")
-intra_user_similarities = []
-
-for user in user_faces:
-    user_similarities = []
-    faces = user["faces"]
-
-    for i in range(len(faces)):
-        for j in range(i + 1, len(faces)):
-            sim = calculate_balanced_similarity(faces[i], faces[j])
-            user_similarities.append(sim)
-
-    if user_similarities:
-        avg_sim = sum(user_similarities) / len(user_similarities)
-        min_sim = min(user_similarities)
-        max_sim = max(user_similarities)
-
-        print(f"{user['name']} 内部相似度: 平均={avg_sim:.3f}, 范围=[{min_sim:.3f}, {max_sim:.3f}]")
-        intra_user_similarities.extend(user_similarities)
-
-if intra_user_similarities:
-    baseline_similarity = sum(intra_user_similarities) / len(intra_user_similarities)
-    min_baseline = min(intra_user_similarities)
-    std_dev = 0
-    if len(intra_user_similarities) > 1:
-        variance = sum((s - baseline_similarity) ** 2 for s in intra_user_similarities) / len(intra_user_similarities)
-        std_dev = math.sqrt(variance)
-
-    print(f"系统基线: 平均={baseline_similarity:.3f}, 最低={min_baseline:.3f}, 标准差={std_dev:.3f}")
-
-    # 保守的阈值设置
-    recognition_threshold = 0.9  # 比最低内部相似度低一些
-    reject_threshold = 0.89  # 拒绝阈值
-
-    print(f"识别阈值: {recognition_threshold:.3f}")
-    print(f"拒绝阈值: {reject_threshold:.3f}")
-else:
-    recognition_threshold = 0.9
-    reject_threshold = 0.89
-    print(f"使用默认阈值: 识别={recognition_threshold}, 拒绝={reject_threshold}")
-
-time.sleep(2)
-
-# === 识别阶段 ===
-print("\n开始识别阶段：\n1. 保持正脸朝向镜头\n2. 保持静止\n3. 保持光线充足且均匀")
-print("使用平衡的特征提取和相似度计算")
-print(f"识别阈值: {recognition_threshold:.3f}, 拒绝阈值: {reject_threshold:.3f}")
-print("LED控制: 10s后自动熄灭, LCD: 15s后关闭显示")
-print("-" * 50)
-
-recognition_count = 0
-last_recognition_time = 0
-last_face_detected_time = time.ticks_ms()  # 记录最后一次检测到人脸的时间
-led_status_time = 0  # LED状态设置时间
-current_led_status = 'off'  # 当前LED状态
-lcd_active = True  # LCD是否激活
-clock = time.clock()  # 添加FPS计算
-lcd_update_counter = 0  # LCD更新计数器，降低更新频率
-
-while True:
-    try:
-        clock.tick()
-        current_time = time.ticks_ms()
+                memory.collect()
 
-        # 每隔几帧强制清理一次内存
-        if lcd_update_counter % 10 == 0:
-            gc.collect()
+            board.clock.sleep_ms(100)
+    return face_count
 
-        # 检查LED状态 - 10秒后熄灭
-        if current_led_status != 'off' and time.ticks_diff(current_time, led_status_time) > 10000:
-            print("LED 10秒后自动熄灭")
+
+def enroll_stream(gallery, username, tracker):
+    """流式录入：enroll_window_ms 内每帧合格人脸都提取特征，再挑出 faces_per_user 个最分散的
+
+    候选够数后人离开 enroll_lost_ms 即提前结束；一直凑不够候选时最多采集 enroll_timeout_ms。
+    返回加入 gallery 的模板数；挑不出 faces_per_user 个（超时、离群样本太多）时
+    一个也不加入，返回 0，由调用方重新采集。
+    """
+    pool = EnrollmentPool(enroll_candidates)
+    buffer = bytearray(FEATURE_DIM)
+    clock = board.clock
+    start = last_seen = clock.ticks_ms()
+    while board.running():
+        now = clock.ticks_ms()
+        elapsed = clock.ticks_diff(now, start)
+        enough = len(pool) >= faces_per_user
+        if enough and (elapsed >= enroll_window_ms or clock.ticks_diff(now, last_seen) > enroll_lost_ms):
+            break
+        if elapsed >= enroll_timeout_ms:
+            print(f"录入超时: 只采集到 {len(pool)} 个合格样本")
+            break
+        try:
+            memory.collect_if_low()
+            img = board.camera.snapshot()
+            text_lines = [
+                (f"录入: {username}", (255, 255, 255)),
+                (f"样本 {len(pool)} {elapsed // 1000}/{enroll_window_ms // 1000}秒", (255, 255, 255))
+            ]
+
+            faces = tracker.find_faces(img)
+            if faces:
+                largest_face = max(faces, key=lambda f: f[2] * f[3])
+                problem = face_problem(img, largest_face)
+                if problem is None:
+                    # 候选池保存的是副本，可以复用输出缓冲区
+                    features = extract_simple_features(face_scratch.preprocess(), out=buffer)
+                    if features and len(features) > 40:
+                        pool.add(features)
+                        last_seen = now
+                        safe_lcd_display(img, text_lines, largest_face, (0, 255, 0))
+                    else:
+                        text_lines.append(("特征提取失败", (255, 0, 0)))
+                        safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
+                else:
+                    text_lines.append((problem, (255, 0, 0)))
+                    safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
+            else:
+                text_lines.append(("请面向摄像头", (255, 255, 0)))
+                safe_lcd_display(img, text_lines)
+
+            del img
+        except Exception as e:
+            print(f"录入异常: {e}")
+            memory.collect()
+
+    samples = pool.select(faces_per_user, enroll_min_similarity)
+    stats = pool.stats()
+    print(f"采集 {clock.ticks_diff(clock.ticks_ms(), start)}ms: 合格样本 {stats['offered']} 个，"
+          f"候选 {stats['kept']} 个，选出 {len(samples)} 个")
+    if len(samples) < faces_per_user:
+        print(f"样本不足 {faces_per_user} 个，本次录入作废")
+        return 0
+    for features in samples:
+        gallery.add(username, features)
+    if len(samples) > 1:
+        mean, high = pairwise_spread(samples)
+        print(f"所选模板两两相似度: 平均 {mean:.3f}, 最高 {high:.3f}")
+    return len(samples)
+
+
+def enroll_users(gallery, count):
+    """录入阶段：拍摄 count 位用户的人脸，模板直接加入 gallery，返回录入的用户数
+
+    特征只保存在 gallery 的紧凑数组里，不再另外保留一份 [{"name", "faces"}] 列表。
+    """
+    enrolled = 0
+    tracker = FaceTracker(board.camera, scheduler=detector)
+    if enroll_streaming:
+        print(f"开始录入阶段，每位用户连续采集约 {enroll_window_ms // 1000} 秒：\n1. 正脸朝向镜头\n2. 可以缓慢轻微转头\n3. 保持光线充足且均匀")
+    else:
+        print("开始录入阶段，共拍摄6张照片：\n1. 保持正脸朝向镜头\n2. 保持静止\n3. 保持光线充足且均匀")
+    first_id = len(gallery.names)
+    for user_id in range(count):
+        username = "用户" + str(first_id + user_id + 1)
+        print(f"\n开始录入 {username}")
+
+        face_count = 0
+        while not face_count and board.running():
+            if enroll_streaming:
+                face_count = enroll_stream(gallery, username, tracker)
+                if not face_count:
+                    print(f"{username} 录入失败，重新采集")
+            else:
+                face_count = enroll_photos(gallery, username, tracker)
+
+        if face_count < faces_per_user:
+            # 只有系统关闭时才会走到这里；模板不全的用户不算录入
+            print(f"{username} 录入未完成")
+            continue
+        enrolled += 1
+        log_event(EV_ENROLL, gallery, username, frames=face_count)
+        print(f"{username} 录入完成! 共 {face_count} 张照片")
+
+        # 如果是第一个用户录入完成，点亮蓝LED并保持2秒
+        if user_id == 0:  # 第一个用户 (索引为0)
+            print("第一个用户录入完成，点亮蓝色LED")
+            set_led_status('blue')
+            board.clock.sleep_ms(2000)  # 保持2秒
+            print("蓝色LED熄灭，准备录入下一个用户")
             set_led_status('off')
-            current_led_status = 'off'
 
-        # 检查LCD状态 - 15秒后关闭
-        if lcd_active and time.ticks_diff(current_time, last_face_detected_time) > 15000:
-            print("LCD 15秒后关闭显示")
-            lcd_turn_off()  # 熄灭LCD屏幕
-            lcd_active = False
+        memory.collect()
 
-        img = sensor.snapshot()
+    print(f"\n录入阶段完成! 共录入 {enrolled} 位用户")
+    return enrolled
 
-        # 准备显示文本
-        text_lines = [
-            (f"FPS: {clock.fps():.1f}", (255, 255, 255)),
-            ("人脸识别系统", (255, 255, 255))
-        ]
 
-        faces = img.find_features(face_cascade, threshold=0.5, scale_factor=1.25)
+def template_quantized():
+    """按 template_bits 返回 Gallery 的量化维数（LBP 直方图部分）"""
+    return DEFAULT_LBP_SPEC.dim if template_bits == 4 else 0
 
-        if faces:
-            # 检测到人脸，更新时间戳
-            last_face_detected_time = current_time
 
-            # 如果LCD关闭了，重新开启
-            if not lcd_active:
-                print("检测到人脸，重新激活LCD")
-                lcd_wake_up()
-                lcd_active = True
+def load_or_enroll(template_path):
+    """加载已保存的模板，有效时跳过录入阶段；否则录入并保存"""
+    global store_path
+    store_path = template_path
+    open_event_log(template_path)
+    gallery = load_templates(template_path, template_quantized())
+    if gallery is not None and len(gallery) > 0:
+        print(f"已从 {template_path} 加载 {len(gallery.names)} 位用户的 {len(gallery)} 个模板，跳过录入阶段")
+        return gallery
 
-            largest_face = max(faces, key=lambda f: f[2] * f[3])
-            x, y, w, h = largest_face
+    gallery = Gallery(quantized=template_quantized())
+    enrolled = enroll_users(gallery, num_users_to_enroll)
 
-            if current_time - last_recognition_time > 3000:
+    # 保存模板，下次上电直接加载；录入不完整时不保存，下次上电重新录入
+    if enrolled < num_users_to_enroll:
+        print(f"只录入了 {enrolled}/{num_users_to_enroll} 位用户，模板不保存")
+        return gallery
+    try:
+        size = save_templates(gallery, template_path)
+        print(f"模板已保存到 {template_path} ({size} 字节)")
+    except Exception as e:
+        print(f"模板保存失败: {e}")
 
-                if w >= 24 and h >= 24:
-                    print(f"\n[{recognition_count + 1}] 检测到人脸: {w}x{h}")
-                    text_lines.append(("正在识别...", (255, 255, 0)))
+    # 全部用户录入完成，点亮蓝LED并保持2秒
+    print("全部用户录入完成，点亮蓝色LED")
+    set_led_status('blue')
+    board.clock.sleep_ms(2000)  # 保持2秒
+    print("蓝色LED熄灭，开始计算识别基线")
+    set_led_status('off')
+
+    return gallery
 
-                    # 立即显示识别状态
-                    if lcd_active:
-                        safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
 
-                    current_face_roi = img.copy(roi=(x, y, w, h))
-                    current_features = extract_simple_features(current_face_roi)
+def load_impostors():
+    """模板文件旁的陌生人模板集（impostors.bin），没有时返回 None"""
+    if store_path is None:
+        return None
+    return load_templates(impostor_path(store_path))
+
+
+def save_calibration(gallery):
+    try:
+        calibration.save(calibration_path(store_path), gallery)
+    except Exception as e:
+        print(f"标定保存失败: {e}")
 
-                    if current_features:
-                        print("正在进行特征匹配...")
 
-                        best_match = None
-                        best_score = 0
-                        all_results = []
+def persist_updates(gallery):
+    """把在线更新过的模板写入日志，并增量更新这些用户的标定"""
+    try:
+        evicted = updater.evicted
+        indices = updater.flush(store_path, board.clock.ticks_ms())
+        print(f"已保存 {len(indices)} 个更新的模板")
+        if calibration is not None:
+            calibration.add_templates(gallery, indices, load_impostors(), evicted)
+            save_calibration(gallery)
+    except Exception as e:
+        print(f"模板更新保存失败: {e}")
 
-                        for user in user_faces:
-                            user_scores = []
 
-                            for face_features in user["faces"]:
-                                similarity = calculate_balanced_similarity(current_features, face_features)
-                                user_scores.append(similarity)
+def flush_pending(gallery, now, force=False):
+    """限速写入在线更新的模板和事件日志；force 时（进入空闲模式）不等限速，有就写"""
+    if updater is not None and (updater.dirty if force else updater.due(now)):
+        persist_updates(gallery)
+    # 事件日志攒够一页（或超过 event_flush_ms）才写flash
+    if events is not None and (force or events.due(now)):
+        events.flush(now)
 
-                            if user_scores:
-                                avg_score = sum(user_scores) / len(user_scores)
-                                max_score = max(user_scores)
 
-                                all_results.append({
-                                    "name": user['name'],
-                                    "avg_score": avg_score,
-                                    "max_score": max_score,
-                                    "scores": user_scores
-                                })
+def compute_baseline(gallery):
+    """按用户标定阈值，返回默认的 (识别阈值, 拒绝阈值)
 
-                                print(f"  {user['name']}: 平均={avg_score:.3f}, 最高={max_score:.3f}")
+    标定文件与模板库一致时直接加载；否则逐个模板增量标定一遍并保存。
+    """
+    global calibration
+    print("\n计算识别基线...")
+    calibration = Calibration(recognition_threshold)
+    if store_path is not None and calibration.load(calibration_path(store_path), gallery):
+        print(f"已加载 {len(calibration.thresholds)} 位用户的标定阈值")
+    else:
+        impostors = load_impostors()
+        if impostors is not None:
+            print(f"陌生人模板集: {len(impostors)} 个模板")
+        calibration.rebuild(gallery, impostors)
+        impostors = None
+        if store_path is not None:
+            save_calibration(gallery)
+
+    for k, name in enumerate(calibration.names):
+        genuine = calibration.genuine[k]
+        if genuine.count:
+            print(f"{name} 内部相似度: 平均={genuine.mean():.3f}, 最低={genuine.extreme:.3f}, 标准差={genuine.std():.3f}")
+        thresholds = calibration.thresholds.get(name)
+        if thresholds is not None:
+            print(f"{name} 陌生人上界={calibration.impostor_high(k):.3f}, 识别阈值={thresholds[0]:.3f}, 拒绝阈值={thresholds[1]:.3f}")
+        else:
+            print(f"{name} 没有陌生人得分，使用默认阈值")
+    for name in calibration.overlapping():
+        print(f"⚠️ {name} 与陌生人得分重叠，阈值已偏向拒识，建议重新录入")
+
+    baseline_similarity, min_baseline, std_dev = calibration.baseline()
+    if min_baseline is not None:
+        print(f"系统基线: 平均={baseline_similarity:.3f}, 最低={min_baseline:.3f}, 标准差={std_dev:.3f}")
+    print(f"默认阈值: 识别={recognition_threshold}, 拒绝={reject_threshold}")
+
+    return recognition_threshold, reject_threshold
+
+
+async def display_task():
+    """LCD刷新任务：显示识别任务交来的最新画面"""
+    global pending_frame
+    while True:
+        await display_ready.wait()
+        display_ready.clear()
+        img = pending_frame
+        pending_frame = None
+        if img is not None:
+            t = profiler.begin()
+            board.display.show(img)
+            profiler.end("lcd", t)
+            del img
+        if not board.running():
+            break
+
+
+def pump_stats():
+    """stats 命令的报告行按低优先级缓冲区的空余陆续排队，报告再长也不会溢出丢行"""
+    while stats_pending and link.bulk_room() >= FRAME_OVERHEAD + len(stats_pending[0]):
+        link.send(MSG_STATS, stats_pending.pop(0))
+
+
+async def uart_task():
+    """UART任务：收发链路帧（或处理明文命令），有导出请求时随缓冲区空出陆续排队日志记录"""
+    global exporter
+    while board.running():
+        if link is not None:
+            if exporter is not None and exporter.pump():
+                print(f"事件日志导出完成: {exporter.sent} 条")
+                exporter = None
+            pump_stats()
+            link.poll()
+        elif board.uart.any():
+            poll_uart_commands()
+        await board.clock.sleep_async(uart_poll_ms)
+
+
+def enroll_new_user(gallery):
+    """UART命令触发：录入一位新用户并保存模板"""
+    global display_ready
+    event = display_ready
+    display_ready = None  # 录入是阻塞流程，期间直接刷新LCD
+    try:
+        first = len(gallery)
+        if not enroll_users(gallery, 1):
+            print("新用户录入未完成，模板不保存")
+            return
+        size = save_templates(gallery, store_path)
+        print(f"模板已保存到 {store_path} ({size} 字节)")
+
+        # 只重算新用户，其他用户各加入新模板作为异人样本
+        if calibration is not None:
+            impostors = load_impostors()
+            calibration.add_templates(gallery, range(first, len(gallery)), impostors)
+            save_calibration(gallery)
+    except Exception as e:
+        print(f"录入新用户失败: {e}")
+    finally:
+        display_ready = event
 
-                                if avg_score > best_score:
-                                    best_score = avg_score
-                                    best_match = user["name"]
 
-                        print(f"\n=== 识别结果 {recognition_count + 1} ===")
+async def led_task():
+    """LED超时任务：状态灯亮起10秒后熄灭"""
+    while board.running():
+        if led_status != 'off' and board.clock.ticks_diff(board.clock.ticks_ms(), led_status_time) > 10000:
+            print("LED 10秒后自动熄灭")
+            set_led_status('off')
+        await board.clock.sleep_async(led_poll_ms)
 
-                        # 更新显示文本（移除FPS显示以节省内存）
-                        text_lines = [("人脸识别系统", (255, 255, 255))]
 
-                        # 分层判断
-                        if best_score >= recognition_threshold:
-                            # 进一步验证：检查一致性
-                            best_result = next(r for r in all_results if r["name"] == best_match)
-                            high_scores = [s for s in best_result["scores"] if s > reject_threshold]
-                            consistency = len(high_scores) / len(best_result["scores"])
+async def _run_tasks(gallery, recognition_threshold, reject_threshold):
+    global display_ready
+    display_ready = asyncio.Event()
+    try:
+        vision = vision_task(gallery, recognition_threshold, reject_threshold)
+        results = await asyncio.gather(vision, display_task(), uart_task(), led_task())
+    finally:
+        display_ready = None
+    return results[0]
+
+
+def recognition_loop(gallery, recognition_threshold, reject_threshold):
+    """识别阶段：识别、LCD刷新、UART命令、LED超时作为协作任务并发运行"""
+    decision_counts = asyncio.run(_run_tasks(gallery, recognition_threshold, reject_threshold))
+    memory.collect()
+    return decision_counts
+
+
+async def vision_task(gallery, recognition_threshold, reject_threshold):
+    """识别任务：采集、检测、特征提取和判决"""
+    global decision, enroll_requested, updater
+    print("\n开始识别阶段：\n1. 保持正脸朝向镜头\n2. 保持静止\n3. 保持光线充足且均匀")
+    print("使用平衡的特征提取和相似度计算")
+    print(f"识别阈值: {recognition_threshold:.3f}, 拒绝阈值: {reject_threshold:.3f}")
+    if calibration is not None and calibration.thresholds:
+        print(f"按用户标定阈值: {len(calibration.thresholds)} 位用户")
+    print("LED控制: 10s后自动熄灭, LCD: 15s后关闭显示并进入空闲运动检测")
+    print("-" * 50)
+
+    recognition_count = 0
+    last_recognition_time = 0
+    last_face_detected_time = board.clock.ticks_ms()  # 记录最后一次检测到人脸的时间
+    lcd_active = True  # LCD是否激活
+    clock = board.clock.clock()  # 添加FPS计算
+    lcd_update_counter = 0  # LCD更新计数器，降低更新频率
+    tracker = FaceTracker(board.camera, scheduler=detector)  # 跟踪到人脸时只在其附近检测
+    probe_buffer = bytearray(FEATURE_DIM)  # 每次识别复用的特征缓冲区
+    decision = SequentialDecision(recognition_threshold, reject_threshold,
+                                  max_frames=fusion_max_frames, window=fusion_window,
+                                  user_thresholds=calibration.thresholds if calibration else None)
+    updater = None
+    if adapt_enabled and store_path is not None:
+        updater = TemplateUpdater(gallery, board.clock, adapt_pinned, faces_per_user + adapt_slots, adapt_margin,
+                                  adapt_min_interval_ms, adapt_save_interval_ms)
+    motion_gate = MotionGate()  # 空闲模式下的帧差分
+    idle_mode = False  # 是否处于低功耗空闲模式
+    last_activity_time = last_face_detected_time  # 最后一次检测到人脸或运动的时间
+
+    while board.running():
+        try:
+            if enroll_requested:
+                enroll_requested = False
+                enroll_new_user(gallery)
+                decision.reset()
+                tracker.reset()
+                last_face_detected_time = last_activity_time = board.clock.ticks_ms()
+
+            clock.tick()
+            current_time = board.clock.ticks_ms()
+            frame_start = profiler.begin()
+
+            # 检查LCD状态 - 15秒后关闭
+            if lcd_active and board.clock.ticks_diff(current_time, last_face_detected_time) > 15000:
+                print("LCD 15秒后关闭显示")
+                lcd_turn_off()  # 熄灭LCD屏幕
+                lcd_active = False
+
+            # 长时间无人 - 切换到小分辨率灰度，只做帧差分
+            if not idle_mode and board.clock.ticks_diff(current_time, last_activity_time) > idle_timeout_ms:
+                print("进入空闲模式，等待运动")
+                board.camera.set_mode(MODE_IDLE)
+                motion_gate.reset()
+                tracker.reset()
+                idle_mode = True
+                # 空闲可能持续很久，期间断电会丢掉还在RAM里的更新
+                flush_pending(gallery, current_time, force=True)
+
+            if idle_mode:
+                img = board.camera.snapshot()
+                moved = motion_gate.update(img)
+                del img
+
+                if moved:
+                    print(f"检测到运动 ({motion_gate.last_fraction:.2f})，恢复识别模式")
+                    board.camera.set_mode(MODE_ACTIVE)
+                    idle_mode = False
+                    last_activity_time = current_time
+
+                lcd_update_counter += 1
+                flush_pending(gallery, current_time)
+                await board.clock.sleep_async(idle_frame_ms)
+                continue
+
+            t = profiler.begin()
+            img = board.camera.snapshot()
+            profiler.end("snapshot", t)
+
+            # 准备显示文本
+            # LCD关闭时不格式化FPS文字
+            if lcd_active:
+                text_lines = [(f"FPS: {clock.fps():.1f}", WHITE), TITLE_LINE]
+            else:
+                text_lines = [TITLE_LINE]
+
+            t = profiler.begin()
+            faces = tracker.find_faces(img)
+            profiler.end("detect", t)
+
+            if faces:
+                # 检测到人脸，更新时间戳
+                last_face_detected_time = current_time
+                last_activity_time = current_time
+
+                # 如果LCD关闭了，重新开启
+                if not lcd_active:
+                    print("检测到人脸，重新激活LCD")
+                    lcd_wake_up()
+                    lcd_active = True
+
+                largest_face = max(faces, key=lambda f: f[2] * f[3])
+                x, y, w, h = largest_face
+
+                # 做出判决后冷却3秒；判决前每帧都继续累积证据
+                if current_time - last_recognition_time > 3000:
+
+                    problem = face_problem(img, largest_face)
+                    if problem is None:
+                        if decision.frames == 0:
+                            print(f"\n[{recognition_count + 1}] 检测到人脸: {w}x{h}")
+                        text_lines.append(RECOGNIZING_LINE)
+
+                        # 立即显示识别状态
+                        if lcd_active:
+                            safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
+
+                        face = face_scratch.preprocess(profiler)
+                        current_features = extract_simple_features(face, profiler, probe_buffer)
+
+                        if current_features:
+                            print("正在进行特征匹配...")
+
+                            t = profiler.begin()
+                            all_results = gallery.identify(current_features, identify_top_k)
+                            profiler.end("match", t)
+
+                            for result in all_results:
+                                print(f"  {result['name']}: 平均={result['avg_score']:.3f}, 最高={result['max_score']:.3f}")
+                            verdict = decision.update(all_results)
+                        else:
+                            # 没有比较过的帧不算证据：不计入判决，也不触发拒绝
+                            print("⚠️ 特征提取失败")
+                            log_event(EV_NO_FEATURES, frames=decision.frames)
+                            text_lines.append(("特征提取失败", (255, 0, 0)))
+                            if lcd_active:
+                                safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
+                            verdict = None
 
-                            if consistency >= 0.5:  # 至少50%的样本超过拒绝阈值
+                        if verdict is None:
+                            pass
+                        elif verdict == PENDING:
+                            print(f"证据不足，继续采集 (第 {decision.frames} 帧)")
+                        else:
+                            best_match = decision.best_name
+                            best_score = decision.best_score
+                            consistency = decision.best_consistency
+                            print(f"\n=== 识别结果 {recognition_count + 1} ({decision.frames} 帧) ===")
+                            log_event(VERDICT_EVENTS[verdict], gallery, best_match, best_score, consistency,
+                                      decision.frames)
+
+                            # 更新显示文本（移除FPS显示以节省内存）
+                            text_lines = [TITLE_LINE]
+
+                            # 分层判断
+                            if verdict == ACCEPT:
                                 print(f"✅ 身份验证成功!")
                                 print(f"识别用户: {best_match}")
                                 print(f"置信度: {best_score:.3f}")
@@ -619,8 +874,6 @@ while True:
 
                                 # 设置成功LED状态
                                 set_led_status('success')
-                                current_led_status = 'success'
-                                led_status_time = current_time
 
                                 # 成功识别显示
                                 text_lines.extend([
@@ -630,15 +883,25 @@ while True:
                                 if lcd_active:
                                     safe_lcd_display(img, text_lines, largest_face, (0, 255, 0))
 
-                                # 发送UART消息 - 仅在人脸识别成功时发送
-                                try:
-                                    str_buffer = "Hello World"
-                                    uart.write(str_buffer)
-                                    print("UART消息已发送: Hello World")
-                                except Exception as uart_error:
-                                    print(f"UART发送失败: {uart_error}")
-
-                            else:
+                                # 发送UART消息 - 链路协议下排队等UART任务发出，不阻塞识别
+                                if link is not None:
+                                    send_event(MSG_UNLOCK, best_match)
+                                else:
+                                    try:
+                                        str_buffer = "Hello World"
+                                        board.uart.write(str_buffer)
+                                        print("UART消息已发送: Hello World")
+                                    except Exception as uart_error:
+                                        print(f"UART发送失败: {uart_error}")
+
+                                # 有把握的结果用来更新该用户的模板
+                                if updater is not None and current_features:
+                                    index = updater.consider(best_match, current_features, best_score, consistency,
+                                                             decision.thresholds(best_match)[0], current_time)
+                                    if index is not None:
+                                        print(f"已更新 {best_match} 的模板 #{index}")
+
+                            elif verdict == UNSTABLE:
                                 print(f"⚠️ 识别结果不稳定")
                                 print(f"最相似: {best_match} (置信度: {best_score:.3f})")
                                 print(f"一致性不足: {consistency:.2f} < 0.5")
@@ -646,8 +909,7 @@ while True:
 
                                 # 设置不确定LED状态
                                 set_led_status('uncertain')
-                                current_led_status = 'uncertain'
-                                led_status_time = current_time
+                                send_event(MSG_UNCERTAIN, best_match)
 
                                 # 不稳定显示
                                 text_lines.extend([
@@ -657,98 +919,152 @@ while True:
                                 if lcd_active:
                                     safe_lcd_display(img, text_lines, largest_face, (255, 255, 0))
 
-                        elif best_score >= reject_threshold:
-                            print(f"⚠️ 可能是已知用户但置信度不足")
-                            print(f"最相似: {best_match} (置信度: {best_score:.3f})")
-                            print(f"需要重新尝试或改善拍摄条件")
-                            print("🔒 临时拒绝访问")
-
-                            # 设置不确定LED状态
-                            set_led_status('uncertain')
-                            current_led_status = 'uncertain'
-                            led_status_time = current_time
-
-                            # 置信度不足显示
-                            text_lines.extend([
-                                ("置信度不足", (255, 255, 0)),
-                                ("请重新尝试", (255, 255, 0))
-                            ])
-                            if lcd_active:
-                                safe_lcd_display(img, text_lines, largest_face, (255, 255, 0))
-
-                        else:
-                            print(f"❌ 未识别出已知用户")
-                            if best_match:
+                            elif verdict == LOW_CONFIDENCE:
+                                print(f"⚠️ 可能是已知用户但置信度不足")
                                 print(f"最相似: {best_match} (置信度: {best_score:.3f})")
-                            print("🔒 拒绝访问 - 未授权人员")
-
-                            # 设置失败LED状态
-                            set_led_status('fail')
-                            current_led_status = 'fail'
-                            led_status_time = current_time
-
-                            # 拒绝访问显示
-                            text_lines.extend([
-                                ("访问被拒绝", (255, 0, 0)),
-                                ("未授权人员", (255, 0, 0))
-                            ])
-                            if lcd_active:
-                                safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
+                                print(f"需要重新尝试或改善拍摄条件")
+                                print("🔒 临时拒绝访问")
+
+                                # 设置不确定LED状态
+                                set_led_status('uncertain')
+                                send_event(MSG_UNCERTAIN, best_match)
+
+                                # 置信度不足显示
+                                text_lines.extend([
+                                    ("置信度不足", (255, 255, 0)),
+                                    ("请重新尝试", (255, 255, 0))
+                                ])
+                                if lcd_active:
+                                    safe_lcd_display(img, text_lines, largest_face, (255, 255, 0))
+
+                            else:
+                                print(f"❌ 未识别出已知用户")
+                                if best_match:
+                                    print(f"最相似: {best_match} (置信度: {best_score:.3f})")
+                                print("🔒 拒绝访问 - 未授权人员")
 
-                        recognition_count += 1
-                        last_recognition_time = current_time
+                                # 设置失败LED状态
+                                set_led_status('fail')
+                                send_event(MSG_DENY, best_match)
 
-                        print("-" * 50)
+                                # 拒绝访问显示
+                                text_lines.extend([
+                                    ("访问被拒绝", (255, 0, 0)),
+                                    ("未授权人员", (255, 0, 0))
+                                ])
+                                if lcd_active:
+                                    safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
+
+                            recognition_count += 1
+                            if profile_report_every and recognition_count % profile_report_every == 0:
+                                profiler.report()
+                            last_recognition_time = current_time
+                            decision.reset()
+
+                            print("-" * 50)
+
+                        del face
+                        memory.collect_if_low()
                     else:
-                        print("⚠️ 特征提取失败")
-                        text_lines.append(("特征提取失败", (255, 0, 0)))
+                        # 不合格的帧不提取特征、不计入判决，也不触发3秒冷却
+                        print(f"⚠️ {problem}: {w}x{h}")
+                        text_lines.append((problem, (255, 0, 0)))
                         if lcd_active:
                             safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
-
-                    del current_face_roi
-                    gc.collect()
                 else:
-                    print(f"⚠️ 人脸尺寸不足: {w}x{h}")
-                    text_lines.append(("人脸过小", (255, 0, 0)))
-                    if lcd_active:
+                    # 等待状态 - 降低更新频率
+                    if lcd_active and lcd_update_counter % 5 == 0:  # 每5帧更新一次
+                        text_lines.append(WAIT_LINE)
                         safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
             else:
-                # 等待状态 - 降低更新频率
-                if lcd_active and lcd_update_counter % 5 == 0:  # 每5帧更新一次
-                    text_lines.append(("请稍候...", (255, 255, 255)))
-                    safe_lcd_display(img, text_lines, largest_face, (255, 0, 0))
-        else:
-            # 未检测到人脸
-            # 检查是否需要关闭LED（超过10秒）
-            if current_led_status != 'off' and time.ticks_diff(current_time, last_face_detected_time) > 10000:
-                if current_led_status != 'off':  # 避免重复输出
-                    print("10秒未检测到人脸，关闭LED")
-                    set_led_status('off')
-                    current_led_status = 'off'
-
-            # 等待检测人脸 - 降低更新频率
-            if lcd_active and lcd_update_counter % 3 == 0:  # 每3帧更新一次
-                text_lines.append(("等待检测人脸", (255, 255, 255)))
-                safe_lcd_display(img, text_lines)
+                # 未检测到人脸，未完成的多帧判决作废
+                if decision.frames:
+                    print("人脸丢失，重新开始识别")
+                    decision.reset()
+
+                # 等待检测人脸 - 降低更新频率
+                if lcd_active and lcd_update_counter % 3 == 0:  # 每3帧更新一次
+                    text_lines.append(NO_FACE_LINE)
+                    safe_lcd_display(img, text_lines)
 
-        # 立即删除图像对象
-        del img
-        gc.collect()
+            # 立即删除图像对象
+            del img
+            t = profiler.begin()
+            memory.collect_if_low()
+            profiler.end("gc", t)
+
+            lcd_update_counter += 1
+            profiler.end("frame", frame_start)
+
+            flush_pending(gallery, current_time)
+
+        except KeyboardInterrupt:
+            print("\n程序终止")
+            break
+        except Exception as e:
+            print(f"识别异常: {e}")
+            log_event(EV_ERROR)
+            memory.collect()
+
+        # 让出CPU给LCD、UART、LED任务
+        await board.clock.sleep_async(frame_sleep_ms)
+
+    print("\n人脸识别系统关闭")
+    stats = tracker.stats()
+    print(f"人脸检测: 整帧扫描 {stats['full_scans']} 次, ROI扫描 {stats['roi_scans']} 次 (命中 {stats['roi_hits']})")
+    if detector is not None:
+        print(f"检测调度: {detector.stats()}")
+    profiler.report()
+    print(f"识别判决: {decision.counts}")
+    if link is not None:
+        print(f"UART链路: {link.stats()}")
+    if updater is not None:
+        if updater.dirty:
+            persist_updates(gallery)
+        print(f"模板更新: {updater.stats()}")
+    if quality_gate is not None:
+        print(f"质量门控: {quality_gate.stats()}")
+    if events is not None:
+        events.flush(board.clock.ticks_ms())
+        print(f"事件日志: {events.stats()}")
+    mem = memory.stats()
+    print(f"内存回收: {mem['collections']} 次, 跳过 {mem['skipped']} 次, 最低空闲堆 {mem['min_free']}")
+    # 清理资源
+    turn_off_all_leds()
+    if lcd_active:
+        lcd_turn_off()
+    display_ready.set()  # 唤醒LCD任务，使其显示最后一帧后退出
+    return decision.counts
 
-        lcd_update_counter += 1
 
-    except KeyboardInterrupt:
-        print("\n程序终止")
-        break
-    except Exception as e:
-        print(f"识别异常: {e}")
-        gc.collect()
+def setup(hal_board):
+    """绑定外设并创建耗时统计和内存管理"""
+    global board, profiler, memory, face_scratch, link, quality_gate, detector, stats_pending
+    board = hal_board
+    profiler = Profiler(board.clock, enabled=profile_enabled)
+    memory = MemoryManager(gc_low_watermark, always=gc_every_frame)
+    link = UartLink(board.uart, board.clock, on_command=handle_command, max_write=uart_max_write) if uart_framed else None
+    stats_pending = []
+    face_scratch = FaceScratch(board.camera.scratch_image(FACE_SIZE, FACE_SIZE))
+    quality_gate = QualityGate() if quality_gate_enabled else None
+    detector = DetectionScheduler(board.camera, board.clock, budget_ms=detect_budget_ms) if detect_schedule_enabled else None
+
+
+def run(hal_board, template_path=None):
+    """录入 → 基线 → 识别 的完整流程"""
+    setup(hal_board)
+    if template_path is None:
+        template_path = default_path()
+
+    print("准备录入", num_users_to_enroll, "位用户的人脸，每人拍摄", faces_per_user, "张照片")
+    gallery = load_or_enroll(template_path)
+    recognition_threshold, reject_threshold = compute_baseline(gallery)
+
+    board.clock.sleep_ms(2000)
+
+    recognition_loop(gallery, recognition_threshold, reject_threshold)
 
-    time.sleep_ms(50)
 
-print("\n人脸识别系统关闭")
-# 清理资源
-turn_off_all_leds()
-if lcd_active:
-    lcd_turn_off()
-gc.collect()
+if __name__ == "__main__":
+    import hal
+    run(hal.device_board(capture_mode, camera_framebuffers))
@@ -0,0 +1,58 @@
+"""按分配预算管理垃圾回收
+
+原来每次LCD绘制、每帧、每个异常分支都做一次完整的 gc.collect()。
+现在用 gc.threshold() 让运行时在分配了一定字节后自动回收，
+显式回收只在空闲堆低于水位线时才做；阶段切换时仍可强制回收。
+主机上没有 gc.mem_free()，依赖CPython自身的回收，显式回收只做计数。
+"""
+import gc
+
+
+class MemoryManager:
+    """水位线触发的垃圾回收"""
+
+    def __init__(self, low_watermark=48 * 1024, always=False):
+        self.low_watermark = low_watermark  # 空闲堆低于该值才回收（字节）
+        self.always = always                # True 时退回原来的每次都回收
+        self.collections = 0
+        self.skipped = 0
+        self.min_free = None
+        self.has_heap_info = hasattr(gc, "mem_free")
+
+        if self.has_heap_info and hasattr(gc, "threshold"):
+            # 分配超过当前空闲堆的1/4就自动回收，避免堆被耗尽才触发
+            gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
+
+    def free(self):
+        if not self.has_heap_info:
+            return None
+        free = gc.mem_free()
+        if self.min_free is None or free < self.min_free:
+            self.min_free = free
+        return free
+
+    def collect(self):
+        """强制回收（阶段切换、异常恢复后使用）"""
+        gc.collect()
+        self.collections += 1
+        self.free()
+
+    def collect_if_low(self):
+        """空闲堆低于水位线时回收，返回是否回收"""
+        if self.always:
+            self.collect()
+            return True
+        free = self.free()
+        if free is not None and free < self.low_watermark:
+            self.collect()
+            return True
+        self.skipped += 1
+        return False
+
+    def stats(self):
+        return {
+            "collections": self.collections,
+            "skipped": self.skipped,
+            "min_free": self.min_free,
+            "free": self.free(),
+        }
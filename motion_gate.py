@@ -0,0 +1,58 @@
+"""运动检测门控
+
+空闲时摄像头以小分辨率灰度采集，逐帧与缓慢更新的背景做差分，
+变化像素比例超过阈值才认为有人靠近。
+"""
+
+
+class MotionGate:
+    """帧差分 + 运行背景"""
+
+    def __init__(self, threshold=20, min_fraction=0.03, stride=2, learn_shift=3):
+        self.threshold = threshold        # 单像素灰度变化阈值
+        self.min_fraction = min_fraction  # 变化像素比例阈值
+        self.stride = stride              # 隔点采样
+        self.learn_shift = learn_shift    # 背景更新速率 1/2^learn_shift
+        self.background = None
+        self.last_fraction = 0.0
+
+    def reset(self):
+        self.background = None
+        self.last_fraction = 0.0
+
+    def update(self, img):
+        """输入一帧灰度图，返回是否检测到运动"""
+        buf = img.bytearray()
+        width = img.width()
+        height = img.height()
+        stride = self.stride
+
+        background = self.background
+        if background is None or len(background) != len(range(0, width, stride)) * len(range(0, height, stride)):
+            # 第一帧或分辨率变化：只建立背景
+            background = bytearray(len(range(0, width, stride)) * len(range(0, height, stride)))
+            k = 0
+            for y in range(0, height, stride):
+                for p in range(y * width, y * width + width, stride):
+                    background[k] = buf[p]
+                    k += 1
+            self.background = background
+            self.last_fraction = 0.0
+            return False
+
+        threshold = self.threshold
+        shift = self.learn_shift
+        changed = 0
+        k = 0
+        for y in range(0, height, stride):
+            for p in range(y * width, y * width + width, stride):
+                v = buf[p]
+                b = background[k]
+                d = v - b
+                if d > threshold or -d > threshold:
+                    changed += 1
+                background[k] = b + (d >> shift)
+                k += 1
+
+        self.last_fraction = changed / k
+        return self.last_fraction >= self.min_fraction
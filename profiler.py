@@ -0,0 +1,91 @@
+"""分阶段耗时统计
+
+用法:
+    t = profiler.begin()
+    ...
+    profiler.end("detect", t)
+
+每个阶段在固定大小的环形缓冲区里保存最近 window 次耗时（微秒），
+报告时给出滚动的 最小/平均/P95/最大 值。关闭时 begin() 直接返回 0，
+end() 立即返回，几乎没有开销。
+"""
+from array import array
+
+
+class StageStats:
+    """一个阶段最近 window 次耗时的环形缓冲区"""
+
+    def __init__(self, window):
+        self.samples = array('l', [0] * window)
+        self.index = 0
+        self.count = 0   # 累计次数（不受窗口限制）
+
+    def add(self, us):
+        self.samples[self.index] = us
+        self.index += 1
+        if self.index == len(self.samples):
+            self.index = 0
+        self.count += 1
+
+    def last(self):
+        """最近一次耗时（微秒），还没有记录时为 0"""
+        if not self.count:
+            return 0
+        return self.samples[self.index - 1]
+
+    def summary(self):
+        """(次数, 最小, 平均, P95, 最大)，单位微秒"""
+        n = min(self.count, len(self.samples))
+        if n == 0:
+            return self.count, 0, 0, 0, 0
+        values = sorted(self.samples[:n])
+        p95 = values[min(n - 1, (n * 95) // 100)]
+        return self.count, values[0], sum(values) // n, p95, values[-1]
+
+
+class Profiler:
+    """基于 ticks_us 的轻量阶段计时器"""
+
+    def __init__(self, clock, window=32, enabled=True):
+        self.clock = clock
+        self.window = window
+        self.enabled = enabled
+        self.stages = {}
+        self.order = []   # 报告时按首次出现的顺序
+
+    def begin(self):
+        if not self.enabled:
+            return 0
+        return self.clock.ticks_us()
+
+    def end(self, stage, start):
+        if not self.enabled:
+            return
+        us = self.clock.ticks_diff(self.clock.ticks_us(), start)
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = StageStats(self.window)
+            self.stages[stage] = stats
+            self.order.append(stage)
+        stats.add(us)
+
+    def last(self, stage):
+        """阶段 stage 最近一次的耗时（微秒），没有记录时为 0"""
+        stats = self.stages.get(stage)
+        return stats.last() if stats is not None else 0
+
+    def reset(self):
+        self.stages = {}
+        self.order = []
+
+    def report_lines(self):
+        lines = [f"{'阶段':<10} {'次数':>6} {'最小':>8} {'平均':>8} {'P95':>8} {'最大':>8} (us)"]
+        for stage in self.order:
+            count, low, avg, p95, high = self.stages[stage].summary()
+            lines.append(f"{stage:<10} {count:>6} {low:>8} {avg:>8} {p95:>8} {high:>8}")
+        return lines
+
+    def report(self, write=print):
+        """逐行输出报告；write 可以是 print 或 UART 的写函数"""
+        for line in self.report_lines():
+            write(line)
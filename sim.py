@@ -0,0 +1,901 @@
+"""主机端模拟器
+
+用法: python sim.py [帧目录] [--store 模板文件]
+
+在Linux上无头运行 录入 → 基线 → 识别 的完整流程：
+摄像头从磁盘回放PGM/PPM帧（或生成合成画面），LCD画面、LED和UART事件
+只做记录，sleep 推进虚拟时钟而不真正等待，因此流程以全速运行。
+
+帧目录中的 faces.txt 每行为 "文件名 x y w h"，给出该帧的人脸框，
+模拟 find_features 的检测结果；同一文件可以有多行。
+"""
+import asyncio
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+import hal
+import uart_link
+
+GRAYSCALE = "GRAYSCALE"
+FRAME_WIDTH = 320
+FRAME_HEIGHT = 240
+HAAR_WINDOW = 24        # frontalface 级联的检测窗口边长
+HAAR_WINDOW_US = 0.0    # 每个检测窗口的模拟耗时（微秒，20级）；0 表示检测不占虚拟时间
+UART_BAUD = 9600        # 与 hal.device_board 相同；模拟板写串口按此推进虚拟时钟
+
+
+class SimImage:
+    """image.Image 兼容的灰度图"""
+
+    def __init__(self, width, height, data=None, faces=None):
+        self._w = width
+        self._h = height
+        self._data = data if data is not None else bytearray(width * height)
+        self.faces = faces or []   # 该帧的人脸框（模拟检测结果）
+        self.drawn = []            # 绘制记录
+
+    def width(self):
+        return self._w
+
+    def height(self):
+        return self._h
+
+    def format(self):
+        return GRAYSCALE
+
+    def bytearray(self):
+        return self._data
+
+    def get_pixel(self, x, y):
+        return self._data[y * self._w + x]
+
+    def set_pixel(self, x, y, value):
+        self._data[y * self._w + x] = value
+
+    def clear(self):
+        self._data[:] = bytes(len(self._data))
+        return self
+
+    def copy(self, roi=None):
+        if roi is None:
+            return SimImage(self._w, self._h, bytearray(self._data), list(self.faces))
+        x, y, w, h = roi
+        x = max(0, x)
+        y = max(0, y)
+        w = min(w, self._w - x)
+        h = min(h, self._h - y)
+        data = bytearray(w * h)
+        for row in range(h):
+            src = (y + row) * self._w + x
+            data[row * w:(row + 1) * w] = self._data[src:src + w]
+        return SimImage(w, h, data)
+
+    def to_grayscale(self):
+        return self.copy()
+
+    def downscale(self, factor):
+        """按 factor 取块左上角像素缩小"""
+        w = self._w // factor
+        h = self._h // factor
+        data = bytearray(w * h)
+        for y in range(h):
+            src = y * factor * self._w
+            for x in range(w):
+                data[y * w + x] = self._data[src + x * factor]
+        return SimImage(w, h, data)
+
+    def histeq(self):
+        data = self._data
+        total = len(data)
+        hist = [0] * 256
+        for v in data:
+            hist[v] += 1
+        cdf = [0] * 256
+        run = 0
+        for i in range(256):
+            run += hist[i]
+            cdf[i] = run
+        cdf_min = next(c for c in cdf if c > 0)
+        scale = total - cdf_min
+        if scale <= 0:
+            return self
+        lut = bytes(min(255, max(0, ((cdf[i] - cdf_min) * 255 + scale // 2) // scale)) for i in range(256))
+        data[:] = data.translate(lut)
+        return self
+
+    def gaussian(self, size):
+        """(2*size+1) 方形近似高斯核，边缘复制"""
+        if size != 1:
+            raise ValueError("模拟器只实现了 3x3 高斯核")
+        w = self._w
+        h = self._h
+        src = self._data
+        out = bytearray(len(src))
+        for y in range(h):
+            ym = (y - 1 if y > 0 else 0) * w
+            yc = y * w
+            yp = (y + 1 if y < h - 1 else y) * w
+            for x in range(w):
+                xm = x - 1 if x > 0 else 0
+                xp = x + 1 if x < w - 1 else x
+                acc = (src[ym + xm] + 2 * src[ym + x] + src[ym + xp] +
+                       2 * src[yc + xm] + 4 * src[yc + x] + 2 * src[yc + xp] +
+                       src[yp + xm] + 2 * src[yp + x] + src[yp + xp])
+                out[yc + x] = (acc + 8) >> 4
+        src[:] = out
+        return self
+
+    def draw_image(self, image, x, y, x_scale=1.0, y_scale=1.0, roi=None):
+        """最近邻缩放绘制 image 的 roi 区域，原地写入本图"""
+        src = image.bytearray()
+        src_w = image.width()
+        rx, ry, rw, rh = roi if roi is not None else (0, 0, src_w, image.height())
+        dst = self._data
+        w = min(self._w - x, int(rw * x_scale))
+        h = min(self._h - y, int(rh * y_scale))
+        if x_scale == 1 and y_scale == 1:
+            for row in range(h):
+                src_start = (ry + row) * src_w + rx
+                d = (y + row) * self._w + x
+                dst[d:d + w] = src[src_start:src_start + w]
+            return self
+        cols = [rx + min(rw - 1, int(c / x_scale)) for c in range(w)]
+        for row in range(h):
+            base = (ry + min(rh - 1, int(row / y_scale))) * src_w
+            d = (y + row) * self._w + x
+            for c in cols:
+                dst[d] = src[base + c]
+                d += 1
+        return self
+
+    def get_statistics(self):
+        return SimStatistics(self._data)
+
+    def draw_string(self, x, y, text, color=None, scale=1):
+        self.drawn.append(("text", text, color))
+        return self
+
+    def draw_rectangle(self, rect, color=None, thickness=1):
+        self.drawn.append(("rect", tuple(rect), color))
+        return self
+
+    def find_features(self, cascade, threshold=0.5, scale_factor=1.25, roi=None):
+        if roi is None:
+            return list(self.faces)
+        rx, ry, rw, rh = roi
+        return [f for f in self.faces
+                if f[0] >= rx and f[1] >= ry and f[0] + f[2] <= rx + rw and f[1] + f[3] <= ry + rh]
+
+
+class SimStatistics:
+    """image.Statistics 中门控用到的部分"""
+
+    def __init__(self, data):
+        n = len(data)
+        total = sum(data)
+        self._mean = total // n if n else 0
+        self._stdev = int(math.sqrt(max(0, sum(v * v for v in data) / n - (total / n) ** 2))) if n else 0
+        ordered = sorted(data)
+        self._lq = ordered[n // 4] if n else 0
+        self._uq = ordered[3 * n // 4] if n else 0
+
+    def mean(self):
+        return self._mean
+
+    def stdev(self):
+        return self._stdev
+
+    def lq(self):
+        return self._lq
+
+    def uq(self):
+        return self._uq
+
+
+def read_pnm(path):
+    """读取二进制 PGM(P5) / PPM(P6)，彩色转为灰度"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    tokens = []
+    pos = 0
+    while len(tokens) < 4:
+        while raw[pos:pos + 1].isspace():
+            pos += 1
+        if raw[pos:pos + 1] == b"#":
+            while raw[pos:pos + 1] not in (b"\n", b""):
+                pos += 1
+            continue
+        start = pos
+        while not raw[pos:pos + 1].isspace():
+            pos += 1
+        tokens.append(raw[start:pos])
+    pos += 1
+    magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if maxval != 255:
+        raise ValueError(f"{path}: 只支持8位图像")
+    pixels = raw[pos:]
+    if magic == b"P5":
+        return SimImage(width, height, bytearray(pixels[:width * height]))
+    if magic == b"P6":
+        data = bytearray(width * height)
+        for i in range(width * height):
+            r, g, b = pixels[3 * i], pixels[3 * i + 1], pixels[3 * i + 2]
+            data[i] = (r * 77 + g * 150 + b * 29) >> 8
+        return SimImage(width, height, data)
+    raise ValueError(f"{path}: 不支持的格式 {magic!r}")
+
+
+def load_sequence(directory):
+    """按文件名顺序读取帧目录，并附上 faces.txt 中的人脸框"""
+    boxes = {}
+    annotations = os.path.join(directory, "faces.txt")
+    if os.path.exists(annotations):
+        with open(annotations) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 5:
+                    boxes.setdefault(parts[0], []).append(tuple(int(v) for v in parts[1:]))
+
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".pgm", ".ppm")):
+            img = read_pnm(os.path.join(directory, name))
+            img.faces = boxes.get(name, [])
+            frames.append(img)
+    return frames
+
+
+def synthetic_face(size, identity=0, variant=0):
+    """生成带明暗结构和噪声的合成人脸裁剪
+
+    identity 决定五官位置、光照方向和纹理（不同的人），
+    variant 决定噪声（同一人的不同照片）。
+    """
+    rng = random.Random((identity * 7919 + variant) * 1000 + size)
+    shape = random.Random(identity)
+    fx = shape.uniform(0.4, 1.2)
+    fy = shape.uniform(0.3, 1.0)
+    light = shape.uniform(0, 2 * math.pi)
+    eye_x = shape.uniform(0.22, 0.36)
+    eye_y = shape.uniform(0.28, 0.45)
+    mouth_y = shape.uniform(0.65, 0.8)
+    tone = shape.randint(-30, 30)
+
+    blobs = (
+        (eye_x, eye_y, 0.08, -90),
+        (1 - eye_x, eye_y, 0.08, -90),
+        (0.5, mouth_y, 0.12, -60),
+    )
+    data = bytearray(size * size)
+    for y in range(size):
+        v_y = y / size
+        for x in range(size):
+            u = x / size
+            v = 160 + tone - 90 * math.hypot(u - 0.5, v_y - 0.5)
+            v += 40 * ((u - 0.5) * math.cos(light) + (v_y - 0.5) * math.sin(light))
+            v += 20 * math.sin(x * fx) * math.cos(y * fy)
+            for bx, by, r, depth in blobs:
+                d2 = ((u - bx) ** 2 + (v_y - by) ** 2) / (r * r)
+                if d2 < 4:
+                    v += depth * math.exp(-d2)
+            v += rng.randint(-20, 20)
+            data[y * size + x] = max(0, min(255, int(v)))
+    return SimImage(size, size, data)
+
+
+def degrade(img, quality, rng):
+    """模拟欠曝和传感器噪声：亮度乘 quality，叠加 ±140*(1-quality) 的噪声"""
+    amp = int(140 * (1 - quality))
+    data = bytearray(max(0, min(255, int(v * quality) + rng.randint(-amp, amp))) for v in img.bytearray())
+    return SimImage(img.width(), img.height(), data)
+
+
+def relight(img, amount):
+    """模拟光照方向变化：叠加从左到右 ±amount、从上到下 ±amount/2 的亮度梯度"""
+    width, height = img.width(), img.height()
+    src = img.bytearray()
+    data = bytearray(width * height)
+    for y in range(height):
+        row = amount * 0.5 * (2 * y / height - 1)
+        for x in range(width):
+            v = src[y * width + x] + amount * (2 * x / width - 1) + row
+            data[y * width + x] = max(0, min(255, int(v)))
+    return SimImage(width, height, data)
+
+
+def blur(img, passes):
+    """模拟失焦或运动模糊：3x3 高斯核连续作用 passes 次"""
+    out = img.copy()
+    for _ in range(passes):
+        out.gaussian(1)
+    return out
+
+
+def turn(img, amount):
+    """模拟侧脸：按 u' = u + amount*sin(pi*u) 横向重采样，五官整体挤向一侧"""
+    width, height = img.width(), img.height()
+    src = img.bytearray()
+    cols = []
+    for x in range(width):
+        u = x / width
+        cols.append(min(width - 1, max(0, int((u + amount * math.sin(math.pi * u)) * width))))
+    data = bytearray(width * height)
+    for y in range(height):
+        row = y * width
+        for x in range(width):
+            data[row + x] = src[row + cols[x]]
+    return SimImage(width, height, data)
+
+
+def synthetic_sequence(plan, face_size=80, seed=0, offset_y=0):
+    """按 plan [(帧数, 身份或None[, 画质[, 光照[, 模糊[, 侧脸]]]]), ...] 生成整帧画面
+
+    身份为 None 表示无人；画质 1.0 为正常，越低越暗、噪声越大（见 degrade）；
+    光照为亮度梯度的幅度（见 relight），模拟录入之后环境光慢慢变化；
+    模糊为高斯核次数（见 blur），侧脸为横向挤压幅度（见 turn）。
+    offset_y 把人脸整体上下平移（负数向上，如个子更高的人）。
+    """
+    rng = random.Random(seed)
+    background = bytearray(FRAME_WIDTH * FRAME_HEIGHT)
+    for i in range(len(background)):
+        background[i] = 60 + (i % FRAME_WIDTH) // 8
+
+    faces = {}
+    frames = []
+    for entry in plan:
+        count, identity = entry[:2]
+        quality = entry[2] if len(entry) > 2 else 1.0
+        light = entry[3] if len(entry) > 3 else 0
+        passes = entry[4] if len(entry) > 4 else 0
+        yaw = entry[5] if len(entry) > 5 else 0
+        for _ in range(count):
+            img = SimImage(FRAME_WIDTH, FRAME_HEIGHT, bytearray(background))
+            if identity is not None:
+                variant = rng.randrange(8)
+                key = (identity, variant, light, passes, yaw)
+                if key not in faces:
+                    face = synthetic_face(face_size, identity, variant)
+                    if light:
+                        face = relight(face, light)
+                    if passes:
+                        face = blur(face, passes)
+                    if yaw:
+                        face = turn(face, yaw)
+                    faces[key] = face
+                face = faces[key]
+                if quality < 1.0:
+                    face = degrade(face, quality, rng)
+                face = face.bytearray()
+                x = (FRAME_WIDTH - face_size) // 2 + rng.randint(-6, 6)
+                y = (FRAME_HEIGHT - face_size) // 2 + offset_y + rng.randint(-6, 6)
+                for row in range(face_size):
+                    dst = (y + row) * FRAME_WIDTH + x
+                    img.bytearray()[dst:dst + face_size] = face[row * face_size:(row + 1) * face_size]
+                img.faces = [(x, y, face_size, face_size)]
+            frames.append(img)
+    return frames
+
+
+class SimClock:
+    """虚拟时钟：真实耗时 + 累计的 sleep 时间"""
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.slept_ms = 0
+        self._waiting = []   # 协作任务的唤醒时刻
+
+    def ticks_ms(self):
+        return int((time.perf_counter() - self._start) * 1000 + self.slept_ms)
+
+    def ticks_us(self):
+        return int((time.perf_counter() - self._start) * 1000000 + self.slept_ms * 1000)
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+    def sleep_ms(self, ms):
+        self.slept_ms += ms
+
+    async def sleep_async(self, ms):
+        """协作式休眠：先让出一次；所有任务都在等待时直接跳到最早的唤醒时刻"""
+        deadline = self.ticks_ms() + ms
+        self._waiting.append(deadline)
+        try:
+            await asyncio.sleep(0)
+            while self.ticks_ms() < deadline:
+                if deadline <= min(self._waiting):
+                    self.slept_ms += deadline - self.ticks_ms()
+                else:
+                    await asyncio.sleep(0)
+        finally:
+            self._waiting.remove(deadline)
+
+    def clock(self):
+        return SimFPSClock(self)
+
+
+class SimFPSClock:
+    """time.clock() 兼容的帧率计"""
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._last = None
+        self._fps = 0.0
+
+    def tick(self):
+        now = self._clock.ticks_us()
+        if self._last is not None and now > self._last:
+            self._fps = 1000000 / (now - self._last)
+        self._last = now
+
+    def fps(self):
+        return self._fps
+
+
+def haar_windows(width, height, scale_factor, window=None):
+    """Haar级联在 width x height 上逐级放大扫描的窗口总数（步长随尺度增大）"""
+    window = window or HAAR_WINDOW
+    total = 0
+    scale = 1.0
+    while int(window * scale) <= min(width, height):
+        size = int(window * scale)
+        step = max(1, int(scale))
+        total += ((width - size) // step + 1) * ((height - size) // step + 1)
+        scale *= scale_factor
+    return total
+
+
+class SimCamera:
+    """按顺序回放帧；回放完毕后 exhausted 为 True
+
+    帧本身总是灰度的；capture 只决定按什么格式统计采集字节数，
+    以及显示时是否要转换到彩色画布。
+    传感器每 frame_period_ms 出一帧：单缓冲时 snapshot() 调用后才开始曝光，
+    要等满一个帧周期；多缓冲时曝光与处理重叠，只需等到下一帧完成。
+    """
+
+    def __init__(self, frames, capture=hal.CAPTURE_RGB, framebuffers=1, frame_period_ms=33):
+        self.frames = frames
+        self.capture = capture
+        self.framebuffers = framebuffers
+        self.frame_period_ms = frame_period_ms
+        self._last_ready = 0
+        self.index = 0
+        self.exhausted = not frames
+        self.face_cascade = None
+        self.mode = hal.MODE_ACTIVE
+        self.mode_switches = 0
+        self.idle_frames = 0
+        self.detect_calls = 0
+        self.scanned_pixels = 0   # Haar检测扫过的像素数，衡量检测工作量
+        self.detect_windows = 0   # Haar检测评估的窗口数（见 haar_windows）
+        self.detect_us = 0.0      # 按 HAAR_WINDOW_US 模拟的检测总耗时
+        self.face_frames = 0      # 识别模式下画面中有人脸的帧数
+        self.found_frames = 0     # 其中至少一次检测找到人脸的帧数（召回）
+        self.face_indices = []    # 上面两类帧的下标，供按段统计召回
+        self.found_indices = []
+        self._found_index = -1
+        self.stages = 20
+        self.frame_bytes = 0      # 识别模式下采集的帧缓冲字节数
+        self.frame_times = []     # 每帧的采集时刻（虚拟毫秒），按帧序号
+        self.clock = None         # 由 SimBoard 设置
+        self.display_conversions = 0
+        self._canvas = None
+
+    def snapshot(self):
+        frame = self.frames[min(self.index, len(self.frames) - 1)]
+        if self.clock is not None:
+            self._wait_exposure()
+            self.frame_times.append(self.clock.ticks_ms())
+        self.index += 1
+        if self.index >= len(self.frames):
+            self.exhausted = True
+        if self.mode == hal.MODE_IDLE:
+            # 空闲模式：QVGA → QQQVGA 灰度
+            self.idle_frames += 1
+            return frame.downscale(4)
+        self.frame_bytes += frame.width() * frame.height() * (1 if self.capture == hal.CAPTURE_GRAY else 2)
+        if frame.faces:
+            self.face_frames += 1
+            self.face_indices.append(self.index - 1)
+        return frame.copy()
+
+    def _wait_exposure(self):
+        period = self.frame_period_ms
+        if not period:
+            return
+        if self.framebuffers <= 1:
+            self.clock.sleep_ms(period)
+            return
+        now = self.clock.ticks_ms()
+        latest = now - now % period   # 最近一帧曝光完成的时刻
+        if latest > self._last_ready:
+            self._last_ready = latest  # 已有新帧，立即返回
+        else:
+            self.clock.sleep_ms(self._last_ready + period - now)
+            self._last_ready += period
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            self.mode = mode
+            self.mode_switches += 1
+
+    def width(self):
+        return self.frames[0].width() if self.frames else FRAME_WIDTH
+
+    def height(self):
+        return self.frames[0].height() if self.frames else FRAME_HEIGHT
+
+    def blank_image(self):
+        return SimImage(self.width(), self.height())
+
+    def scratch_image(self, width, height):
+        return SimImage(width, height)
+
+    def display_frame(self, img):
+        if self.capture != hal.CAPTURE_GRAY:
+            return img
+        if self._canvas is None:
+            self._canvas = SimImage(img.width(), img.height())
+        self._canvas.draw_image(img, 0, 0)
+        self._canvas.drawn = []
+        self.display_conversions += 1
+        return self._canvas
+
+    def set_stages(self, stages):
+        self.stages = stages
+
+    def find_faces(self, img, threshold=0.5, scale_factor=1.25, roi=None, pool=1):
+        """按 roi 和缩小倍数模拟Haar检测的工作量和召回
+
+        缩小后不足一个检测窗口的人脸找不到；HAAR_WINDOW_US 非零时按窗口数推进虚拟时钟。
+        """
+        self.detect_calls += 1
+        width, height = (roi[2], roi[3]) if roi else (img.width(), img.height())
+        self.scanned_pixels += width * height
+        windows = haar_windows(int(width / pool), int(height / pool), scale_factor)
+        self.detect_windows += windows
+        cost = windows * HAAR_WINDOW_US * (0.5 + 0.5 * self.stages / 20)
+        self.detect_us += cost
+        if cost and self.clock is not None:
+            self.clock.sleep_ms(cost / 1000)
+        faces = img.find_features(self.face_cascade, threshold=threshold, scale_factor=scale_factor, roi=roi)
+        faces = [f for f in faces if f[2] / pool >= HAAR_WINDOW and f[3] / pool >= HAAR_WINDOW]
+        if faces and self._found_index != self.index:
+            self._found_index = self.index
+            self.found_frames += 1
+            self.found_indices.append(self.index - 1)
+        return faces
+
+
+class SimDisplay:
+    """记录每次显示时画面上的文字"""
+
+    def __init__(self, clock):
+        self._clock = clock
+        self.frames = []
+
+    def show(self, img):
+        texts = [d[1] for d in getattr(img, "drawn", []) if d[0] == "text"]
+        self.frames.append((self._clock.ticks_ms(), texts))
+
+
+class SimLED:
+    """记录亮灭事件的LED"""
+
+    def __init__(self, name, events, clock):
+        self.name = name
+        self.state = False
+        self._events = events
+        self._clock = clock
+
+    def on(self):
+        if not self.state:
+            self.state = True
+            self._events.append((self._clock.ticks_ms(), self.name, True))
+
+    def off(self):
+        if self.state:
+            self.state = False
+            self._events.append((self._clock.ticks_ms(), self.name, False))
+
+
+class SimUART:
+    """记录发送内容，接收数据由 inject() 注入
+
+    connect() 后写出的数据同时送到对端的接收缓冲区（内存回环），
+    loss > 0 时按该概率随机丢弃字节，用来测试链路层的重发。
+    baud 非零时 write() 像 pyb 的 UART 一样等字节发完才返回（推进虚拟时钟）。
+    """
+
+    def __init__(self, clock, loss=0.0, seed=0):
+        self._clock = clock
+        self.tx = []
+        self.rx = bytearray()
+        self._scheduled = []   # (到达时刻, 数据)
+        self.peer = None
+        self.on_poll = None    # any() 时先调用，用来驱动对端
+        self.loss = loss
+        self.baud = 0
+        self._rng = random.Random(seed)
+
+    def connect(self, peer):
+        self.peer = peer
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        data = bytes(data)
+        if self.baud:
+            self._clock.sleep_ms(len(data) * 10000 / self.baud)   # 8N1 每字节 10 位
+        self.tx.append((self._clock.ticks_ms(), data))
+        if self.peer is not None:
+            if self.loss:
+                data = bytes(v for v in data if self._rng.random() >= self.loss)
+            self.peer.rx.extend(data)
+        return len(self.tx[-1][1])
+
+    def inject(self, data, at_ms=None):
+        """注入接收数据；给出 at_ms 时到该虚拟时刻才可读"""
+        if at_ms is None:
+            self.rx.extend(data)
+        else:
+            self._scheduled.append((at_ms, bytes(data)))
+
+    def _deliver(self):
+        now = self._clock.ticks_ms()
+        while self._scheduled and self._scheduled[0][0] <= now:
+            self.rx.extend(self._scheduled.pop(0)[1])
+
+    def any(self):
+        if self.on_poll is not None:
+            self.on_poll()
+        self._deliver()
+        return len(self.rx)
+
+    def read(self, n=None):
+        self._deliver()
+        if not self.rx:
+            return None
+        n = len(self.rx) if n is None else min(n, len(self.rx))
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+
+def loopback_pair(clock, loss=0.0, seed=0):
+    """两端互连的内存UART"""
+    a = SimUART(clock, loss, seed)
+    b = SimUART(clock, loss, seed + 1)
+    a.connect(b)
+    b.connect(a)
+    return a, b
+
+
+class PtyUART:
+    """伪终端上的UART：主机端对 master 读写，slave_name 可交给其它程序（或另一个 PtyUART）"""
+
+    def __init__(self, fd=None):
+        import tty
+        if fd is None:
+            fd, slave = os.openpty()
+            tty.setraw(slave)
+            self.slave_fd = slave
+            self.slave_name = os.ttyname(slave)
+        self.fd = fd
+        os.set_blocking(fd, False)
+        self._buf = bytearray()
+
+    @classmethod
+    def pair(cls):
+        """(master端, slave端) 两个互通的 PtyUART"""
+        master = cls()
+        slave = cls(master.slave_fd)
+        return master, slave
+
+    def _fill(self):
+        try:
+            while True:
+                chunk = os.read(self.fd, 4096)
+                if not chunk:
+                    break
+                self._buf.extend(chunk)
+        except (BlockingIOError, OSError):
+            pass
+
+    def any(self):
+        self._fill()
+        return len(self._buf)
+
+    def read(self, n=None):
+        self._fill()
+        if not self._buf:
+            return None
+        n = len(self._buf) if n is None else min(n, len(self._buf))
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def write(self, data):
+        try:
+            return os.write(self.fd, bytes(data))
+        except BlockingIOError:
+            return 0
+
+
+class SimController:
+    """门锁控制器一端：用同样的链路协议确认事件、发送命令，并记录收到的消息"""
+
+    def __init__(self, clock, uart):
+        self.clock = clock
+        self.uart = uart
+        self.link = uart_link.UartLink(uart, clock, heartbeat_ms=0)
+        self.link.on_message = self._on_message
+        self.events = []      # (时刻, 类型, 载荷)
+        self._commands = []   # (发送时刻, 命令文本)
+
+    def command(self, text, at_ms=None):
+        """在 at_ms（默认立即）发送一条命令"""
+        self._commands.append((self.clock.ticks_ms() if at_ms is None else at_ms, text))
+        self._commands.sort()
+
+    def poll(self):
+        now = self.clock.ticks_ms()
+        while self._commands and self._commands[0][0] <= now:
+            self.link.send(uart_link.MSG_COMMAND, self._commands.pop(0)[1])
+        self.link.poll()
+
+    def _on_message(self, msg_type, payload):
+        self.events.append((self.clock.ticks_ms(), msg_type, payload))
+
+    def times(self, msg_type):
+        return [t for t, kind, _ in self.events if kind == msg_type]
+
+
+def unlock_times(board):
+    """模拟中每次解锁消息到达控制器的时刻（明文协议时为发出 "Hello World" 的时刻）"""
+    times = board.controller.times(uart_link.MSG_UNLOCK)
+    if times:
+        return times
+    return [t for t, data in board.uart.tx if data == b"Hello World"]
+
+
+class SimBoard(hal.Board):
+    """主机模拟板：帧回放完毕时主循环结束"""
+
+    def __init__(self, frames, capture=hal.CAPTURE_RGB, framebuffers=1):
+        clock = SimClock()
+        self.led_events = []
+        uart, controller_uart = loopback_pair(clock)
+        uart.baud = UART_BAUD   # 控制器是另一块板子，它的写出不占本机时间
+        self.controller = SimController(clock, controller_uart)
+        uart.on_poll = self.controller.poll
+        super().__init__(
+            SimCamera(frames, capture, framebuffers),
+            SimDisplay(clock),
+            SimLED("red", self.led_events, clock),
+            SimLED("green", self.led_events, clock),
+            SimLED("blue", self.led_events, clock),
+            uart,
+            clock,
+        )
+        self.camera.clock = clock
+
+    def running(self):
+        return not self.camera.exhausted
+
+
+def default_scenario():
+    """一位用户录入，随后本人、无人、陌生人交替出现，中间有一段长时间无人"""
+    return synthetic_sequence([
+        (6, 0),       # 录入: 用户1 的6张照片
+        (20, None),
+        (5, 0),       # 本人
+        (100, None),  # 超过3秒冷却（约30帧/秒）
+        (5, 1),       # 陌生人
+        (100, None),
+        (5, 0),
+        (500, None),  # 长时间无人，进入空闲模式
+        (5, 0),
+        (20, None),
+    ])
+
+
+def synthetic_impostors(people=8, faces=4, first_identity=100):
+    """合成的陌生人模板集（Gallery），按设备路径提取特征"""
+    import io
+    from face_features import FACE_SIZE, FaceScratch, extract_simple_features
+    from face_matcher import Gallery
+
+    scratch = FaceScratch(SimImage(FACE_SIZE, FACE_SIZE))
+    gallery = Gallery()
+    saved_stdout = sys.stdout
+    sys.stdout = io.StringIO()  # extract_simple_features 每次都打印特征维度
+    try:
+        for identity in range(first_identity, first_identity + people):
+            for variant in range(faces):
+                face = synthetic_face(80, identity, variant)
+                features = extract_simple_features(scratch.load(face, (0, 0, 80, 80)))
+                if features is not None:
+                    gallery.add(f"陌生人{identity}", list(features))
+    finally:
+        sys.stdout = saved_stdout
+    return gallery
+
+
+def run(frames, template_path=None, capture=None, framebuffers=None, impostors=True):
+    """在模拟板上运行完整流程，返回 (board, 各阶段耗时ms)
+
+    capture、framebuffers 默认取 lock.capture_mode、lock.camera_framebuffers。
+    使用临时模板文件且 impostors 为 True 时，旁边放一份合成的陌生人模板集供标定使用。
+    """
+    import lock
+    from calibration import impostor_path
+    from template_store import save_templates
+
+    if framebuffers is None:
+        framebuffers = lock.camera_framebuffers
+    board = SimBoard(frames, capture or lock.capture_mode, framebuffers)
+    lock.setup(board)
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = template_path or os.path.join(tmp, "faces.bin")
+        if template_path is None and impostors:
+            save_templates(synthetic_impostors(), impostor_path(path))
+
+        start = time.perf_counter()
+        gallery = lock.load_or_enroll(path)
+        timings["录入/加载"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        recognition_threshold, reject_threshold = lock.compute_baseline(gallery)
+        timings["基线"] = (time.perf_counter() - start) * 1000
+
+        first_frame = board.camera.index
+        start = time.perf_counter()
+        timings["判决"] = lock.recognition_loop(gallery, recognition_threshold, reject_threshold)
+        timings["识别"] = (time.perf_counter() - start) * 1000
+        timings["识别帧数"] = board.camera.index - first_frame
+    return board, timings
+
+
+def main(argv):
+    template_path = None
+    if "--store" in argv:
+        i = argv.index("--store")
+        template_path = argv[i + 1]
+        argv = argv[:i] + argv[i + 2:]
+
+    frames = load_sequence(argv[0]) if argv else default_scenario()
+    board, timings = run(frames, template_path)
+
+    print("=" * 50)
+    print("模拟结果")
+    for stage in ("录入/加载", "基线", "识别"):
+        print(f"  {stage}: {timings[stage]:.1f} ms")
+    frames_done = timings["识别帧数"]
+    if frames_done and timings["识别"] > 0:
+        print(f"  识别帧数: {frames_done}, 主机吞吐: {frames_done * 1000 / timings['识别']:.1f} 帧/秒")
+    camera = board.camera
+    print(f"  人脸检测: {camera.detect_calls} 次, 平均扫描 {camera.scanned_pixels // max(1, camera.detect_calls)} 像素/次, "
+          f"{camera.detect_windows // max(1, camera.detect_calls)} 窗口/次")
+    print(f"  空闲帧: {camera.idle_frames}, 模式切换: {camera.mode_switches} 次")
+    print(f"  采集格式: {camera.capture}, 帧缓冲 {camera.frame_bytes // 1024} KB, 显示转换 {camera.display_conversions} 次")
+    print(f"  LCD刷新: {len(board.display.frames)} 次")
+    print(f"  LED事件: {len(board.led_events)}")
+    print(f"  识别判决: {timings['判决']}")
+    names = {v: k[4:] for k, v in vars(uart_link).items() if k.startswith("MSG_")}
+    events = [(names.get(kind, kind), payload.decode(errors="replace")) for _, kind, payload in board.controller.events
+              if kind != uart_link.MSG_HEARTBEAT]
+    if events:
+        print(f"  控制器收到: {events}")
+    else:
+        print(f"  UART发送: {[data for _, data in board.uart.tx]}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
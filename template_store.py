@@ -0,0 +1,233 @@
+"""录入模板的持久化存储
+
+文件格式（小端）：
+    头部 16 字节: 魔数 b"VBFT", 版本(B), 保留(B), 维度(H),
+                  用户数(H), 模板数(H), 正文校验和(I)
+    正文: 每个用户 名字长度(B) + UTF-8名字；
+          每个模板 用户下标(B) + 维度个 uint8 特征
+写入先落到临时文件再改名，校验和不符的文件一律视为无效，
+这样写到一半断电也不会留下一个把所有人锁在门外的模板库。
+
+在线更新的模板追加到旁边的日志文件（faces.upd），每条记录
+    模板下标(H) + 用户下标(B) + 维度个 uint8 特征 + 记录校验和(I)
+加载时按顺序重放（下标等于模板数为新增，否则为替换），遇到写了一半的
+记录就停下。日志攒够 JOURNAL_LIMIT 条后 save_templates 整体重写模板文件并删除日志。
+写了一半的记录留在日志末尾会让之后追加的记录全部错位，所以重放提前停下时
+立即合并；追加前发现日志长度不是整条记录时也先合并（内存中的模板库是完整的）。
+"""
+import os
+import struct
+
+from face_matcher import Gallery
+
+MAGIC = b"VBFT"
+VERSION = 2  # 2: 人脸先缩放到 FACE_SIZE 再提取特征，旧模板需重新录入
+HEADER_FORMAT = "<4sBBHHHI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TEMPLATE_FILE = "faces.bin"
+JOURNAL_FORMAT = "<HB"
+JOURNAL_HEADER = struct.calcsize(JOURNAL_FORMAT)
+JOURNAL_LIMIT = 32  # 日志记录数达到该值时合并进模板文件
+
+
+def checksum(data):
+    """Adler-32 校验和（设备与主机结果一致）"""
+    a = 1
+    b = 0
+    for v in data:
+        a = (a + v) % 65521
+        b = (b + a) % 65521
+    return (b << 16) | a
+
+
+def default_path():
+    """优先存到SD卡，否则存到板载flash"""
+    for root in ("/sd", "/flash"):
+        try:
+            os.stat(root)
+            return root + "/" + TEMPLATE_FILE
+        except OSError:
+            pass
+    return TEMPLATE_FILE
+
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def encode_templates(gallery):
+    """把模板库编码为 bytes"""
+    if len(gallery.names) > 255:
+        raise ValueError("用户数超过 255")
+
+    body = bytearray()
+    for name in gallery.names:
+        raw = name.encode("utf-8")
+        body.append(len(raw))
+        body.extend(raw)
+
+    dim = gallery.dim or 0
+    for index, label in enumerate(gallery.labels):
+        body.append(label)
+        for v in gallery.template(index):
+            body.append(min(255, max(0, v)))
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, dim,
+                         len(gallery.names), len(gallery.labels), checksum(body))
+    return header + body
+
+
+def decode_templates(data, quantized=0):
+    """从 bytes 解码模板库，格式或校验和不符时抛出 ValueError
+
+    quantized > 0 时载入为前 quantized 维4位量化的紧凑模板库（文件格式不变）。
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("文件过短")
+
+    magic, version, _, dim, n_users, n_templates, crc = struct.unpack(
+        HEADER_FORMAT, data[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise ValueError("魔数不符")
+    if version != VERSION:
+        raise ValueError(f"不支持的版本: {version}")
+
+    body = memoryview(data)[HEADER_SIZE:]
+    if checksum(body) != crc:
+        raise ValueError("校验和不符")
+
+    pos = 0
+    names = []
+    for _ in range(n_users):
+        length = body[pos]
+        names.append(str(bytes(body[pos + 1:pos + 1 + length]), "utf-8"))
+        pos += 1 + length
+
+    if len(body) - pos != n_templates * (dim + 1):
+        raise ValueError("模板数据长度不符")
+
+    gallery = Gallery(dim or None, quantized)
+    for name in names:
+        gallery.names.append(name)
+    for _ in range(n_templates):
+        label = body[pos]
+        if label >= n_users:
+            raise ValueError("用户下标越界")
+        gallery.add(names[label], list(body[pos + 1:pos + 1 + dim]))
+        pos += 1 + dim
+    return gallery
+
+
+def write_atomic(path, data):
+    """先写临时文件，再替换正式文件"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    if _exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+def save_templates(gallery, path=None):
+    """保存模板库：先写临时文件，再替换正式文件
+
+    完整的模板文件已包含全部更新，随后删除更新日志。
+    """
+    if path is None:
+        path = default_path()
+    data = encode_templates(gallery)
+    write_atomic(path, data)
+    journal = journal_path(path)
+    if _exists(journal):
+        os.remove(journal)
+    return len(data)
+
+
+def journal_path(path):
+    """faces.bin -> faces.upd"""
+    base = path[:-4] if path.endswith(".bin") else path
+    return base + ".upd"
+
+
+def _record_size(dim):
+    return JOURNAL_HEADER + dim + 4
+
+
+def append_update(gallery, index, path=None):
+    """把模板 index 的当前内容追加到日志，返回日志中的记录数"""
+    if path is None:
+        path = default_path()
+    record = bytearray(struct.pack(JOURNAL_FORMAT, index, gallery.labels[index]))
+    for v in gallery.template(index):
+        record.append(min(255, max(0, v)))
+    record.extend(struct.pack("<I", checksum(record)))
+    journal = journal_path(path)
+    if _exists(journal) and os.stat(journal)[6] % len(record):
+        # 上次写到一半断电：接着追加会错位，直接整体重写（已包含这次的更新）
+        print("模板更新日志末尾不完整，合并进模板文件")
+        save_templates(gallery, path)
+        return 0
+    with open(journal, "ab") as f:
+        f.write(record)
+    return os.stat(journal)[6] // len(record)
+
+
+def replay_updates(gallery, path):
+    """把日志中的更新应用到刚加载的模板库
+
+    返回 (应用的记录数, 是否提前停下)。
+    """
+    try:
+        with open(journal_path(path), "rb") as f:
+            data = f.read()
+    except OSError:
+        return 0, False
+    size = _record_size(gallery.dim)
+    applied = 0
+    for pos in range(0, len(data) - size + 1, size):
+        record = memoryview(data)[pos:pos + size]
+        if checksum(record[:-4]) != struct.unpack("<I", record[-4:])[0]:
+            break  # 断电时写了一半的记录
+        index, label = struct.unpack(JOURNAL_FORMAT, record[:JOURNAL_HEADER])
+        features = list(record[JOURNAL_HEADER:-4])
+        if label >= len(gallery.names) or index > len(gallery):
+            break
+        if index == len(gallery):
+            gallery.add(gallery.names[label], features)
+        elif gallery.labels[index] == label:
+            gallery.replace(index, features)
+        else:
+            break
+        applied += 1
+    return applied, applied * size != len(data)
+
+
+def load_templates(path=None, quantized=0):
+    """加载模板库，文件不存在或无效时返回 None"""
+    if path is None:
+        path = default_path()
+    # 正式文件损坏时，尝试上次改名前断电留下的临时文件
+    for candidate in (path, path + ".tmp"):
+        if not _exists(candidate):
+            continue
+        try:
+            with open(candidate, "rb") as f:
+                gallery = decode_templates(f.read(), quantized)
+            applied, torn = replay_updates(gallery, path)
+            if applied:
+                print(f"已重放 {applied} 条模板更新")
+            if torn:
+                # 不合并的话，之后追加的记录都接在坏记录后面，下次加载全部丢掉
+                print("模板更新日志有损坏的记录，合并进模板文件")
+                try:
+                    save_templates(gallery, path)
+                except OSError as e:
+                    print(f"合并失败: {e}")
+            return gallery
+        except (OSError, ValueError) as e:
+            print(f"模板文件无效 {candidate}: {e}")
+    return None
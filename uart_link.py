@@ -0,0 +1,324 @@
+"""UART 链路层
+
+帧格式（小端）：
+    0xA5 | 类型(B) | 序号(B) | 长度(B) | 头校验(B) | 载荷(长度字节) | CRC16(H)
+头校验 = 类型 ^ 序号 ^ 长度 ^ 0xFF，长度字节出错时立即重新找帧头，
+不会把后面几帧当成载荷吞掉；CRC16-CCITT 覆盖 类型..载荷。需要确认的消息（解锁、拒绝、不确定、命令）
+由对端回 ACK（载荷为被确认的序号），超时未确认时重发，重发 max_retries 次后放弃。
+
+发送先写入环形缓冲区，poll() 每次最多写出 max_write 字节。pyb 的 UART.write
+要等字节发完才返回，9600 波特率下每字节约 1.04 ms，所以 poll 有数据要发时
+会阻塞约 max_write 毫秒（默认 4 字节约 4 ms，10 ms 轮询时约 400 字节/秒）；
+uart 有 txdone() 时，上一次写出的字节还没发完就先不写。
+统计和心跳走单独的低优先级缓冲区，只在帧边界切换，大段统计不会推迟解锁事件。
+接收按字节跑状态机，CRC 错误时从坏帧帧头之后重新找帧头，
+丢了字节的帧不会连带吞掉紧随其后的好帧；半帧停顿超过 rx_timeout_ms
+（长度字节丢失时会一直等不够字节）也按坏帧处理。
+
+设备和主机共用这份代码：主机上可以接伪终端（sim.PtyUART）或内存回环（sim.loopback_pair）。
+"""
+
+SOF = 0xA5
+
+# 消息类型
+MSG_UNLOCK = 0x01     # 载荷: 用户名
+MSG_DENY = 0x02       # 载荷: 最相似的用户名（可为空）
+MSG_UNCERTAIN = 0x03  # 载荷: 最相似的用户名
+MSG_HEARTBEAT = 0x04  # 载荷: 运行秒数 (I)
+MSG_STATS = 0x05      # 载荷: 一行统计文本
+MSG_ACK = 0x06        # 载荷: 被确认的序号 (B)
+MSG_EVENTS = 0x07     # 载荷: 若干条事件日志记录（见 event_log），空载荷表示导出结束
+MSG_COMMAND = 0x10    # 载荷: 命令文本，如 b"stats"、b"enroll"、b"events"、b"threshold 0.9 0.89"
+MSG_REPLY = 0x11      # 载荷: 一行命令回复文本
+
+# 需要对端确认的消息
+RELIABLE = (MSG_UNLOCK, MSG_DENY, MSG_UNCERTAIN, MSG_COMMAND)
+# 低优先级（批量）消息
+BULK = (MSG_STATS, MSG_HEARTBEAT, MSG_EVENTS)
+
+MAX_PAYLOAD = 255
+RECENT_RX = 16   # 记住最近多少个已收序号
+HEADER_SIZE = 5
+FRAME_OVERHEAD = HEADER_SIZE + 2
+
+
+def crc16(data, crc=0xFFFF):
+    """CRC16-CCITT (多项式 0x1021, 初值 0xFFFF)"""
+    for v in data:
+        crc ^= v << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def header_check(msg_type, seq, length):
+    return msg_type ^ seq ^ length ^ 0xFF
+
+
+def encode_frame(msg_type, seq, payload=b""):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"载荷过长: {len(payload)}")
+    frame = bytearray(FRAME_OVERHEAD + len(payload))
+    frame[0] = SOF
+    frame[1] = msg_type
+    frame[2] = seq
+    frame[3] = len(payload)
+    frame[4] = header_check(msg_type, seq, len(payload))
+    frame[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+    crc = crc16(frame[1:HEADER_SIZE + len(payload)])
+    frame[-2] = crc & 0xFF
+    frame[-1] = crc >> 8
+    return frame
+
+
+class FrameParser:
+    """逐字节解析接收流，完整且校验通过的帧交给 on_frame(类型, 序号, 载荷)"""
+
+    def __init__(self, on_frame):
+        self.on_frame = on_frame
+        self.buf = bytearray(FRAME_OVERHEAD + MAX_PAYLOAD)
+        self.pos = 0
+        self.need = 0
+        self.frames = 0
+        self.errors = 0
+
+    def feed(self, data):
+        while data:
+            data = self._scan(data)
+
+    def _scan(self, data):
+        """逐字节推进状态机；遇到坏帧时返回需要重新扫描的字节，否则返回 None"""
+        buf = self.buf
+        for k, v in enumerate(data):
+            if self.pos == 0:
+                if v == SOF:
+                    buf[0] = v
+                    self.pos = 1
+                continue
+            buf[self.pos] = v
+            self.pos += 1
+            if self.pos == HEADER_SIZE:
+                if buf[4] != header_check(buf[1], buf[2], buf[3]):
+                    return self._restart(data, k + 1)
+                self.need = FRAME_OVERHEAD + buf[3]
+            elif self.pos > HEADER_SIZE and self.pos == self.need:
+                if not self._complete():
+                    return self._restart(data, k + 1)
+        return None
+
+    def _complete(self):
+        buf = self.buf
+        end = self.need - 2
+        if crc16(buf[1:end]) != buf[end] | (buf[end + 1] << 8):
+            return False
+        self.pos = 0
+        self.frames += 1
+        self.on_frame(buf[1], buf[2], bytes(buf[HEADER_SIZE:end]))
+        return True
+
+    def _restart(self, data, consumed):
+        """丢弃当前帧头，返回其后的字节加上 data 中未处理的部分（坏帧可能吃进了下一帧的开头）
+
+        由 feed() 循环重新扫描而不是递归：线路噪声里连续的假帧头不会耗尽设备上很浅的栈。
+        """
+        replay = bytes(self.buf[1:self.pos]) + bytes(data[consumed:])
+        self.pos = 0
+        self.errors += 1
+        return replay
+
+    def resync(self):
+        """丢弃当前帧头，从其后重新找帧头（半帧超时时调用）"""
+        self.feed(self._restart(b"", 0))
+
+
+class TxRing:
+    """发送环形缓冲区，按整帧写入"""
+
+    def __init__(self, size):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)   # 写出时切片不复制
+        self.head = 0    # 下一个写入位置
+        self.tail = 0    # 下一个发出位置
+        self.count = 0
+
+    def put(self, frame):
+        size = len(self.buf)
+        n = len(frame)
+        if n > size - self.count:
+            return False
+        head = self.head
+        first = min(n, size - head)
+        self.buf[head:head + first] = frame[:first]
+        if first < n:
+            self.buf[:n - first] = frame[first:]
+        self.head = (head + n) % size
+        self.count += n
+        return True
+
+    def frame_size(self):
+        """tail 处那一帧的总字节数"""
+        return FRAME_OVERHEAD + self.buf[(self.tail + 3) % len(self.buf)]
+
+
+class UartLink:
+    """带确认重发的帧收发
+
+    uart 只需要 any() / read() / write()（可选 txdone()）；clock 提供 ticks_ms / ticks_diff。
+    on_command(文本) 返回回复行列表，每行作为一个 MSG_REPLY 发回。
+    """
+
+    def __init__(self, uart, clock, on_command=None, tx_size=512, bulk_size=1024, max_write=4,
+                 ack_timeout_ms=300, max_retries=3, heartbeat_ms=5000, rx_timeout_ms=100):
+        self.uart = uart
+        self.clock = clock
+        self.on_command = on_command
+        self.on_message = None   # 可选：收到其它消息时调用 on_message(类型, 载荷)
+        self.max_write = max_write
+        self._txdone = getattr(uart, "txdone", None)
+        self.ack_timeout_ms = ack_timeout_ms
+        self.max_retries = max_retries
+        self.heartbeat_ms = heartbeat_ms
+        self.rx_timeout_ms = rx_timeout_ms
+
+        # 发送缓冲区：事件/确认/回复优先，统计和心跳其次
+        self.tx = TxRing(tx_size)
+        self.bulk = TxRing(bulk_size)
+        self._current = None     # 正在写出的缓冲区
+        self._remaining = 0      # 当前帧还剩的字节数
+
+        self.seq = 0
+        self.pending = {}  # 序号 -> [帧, 发送时刻, 已重发次数]
+        self.recent_rx = []  # 最近收到的需确认消息序号，用于丢弃对端的重发
+        self.parser = FrameParser(self._on_frame)
+        self.started = clock.ticks_ms()
+        self.last_heartbeat = self.started
+        self.last_rx = self.started
+
+        # 统计
+        self.sent = 0
+        self.acked = 0
+        self.retries = 0
+        self.dropped = 0      # 重发用尽仍未确认
+        self.overflows = 0    # 缓冲区满而丢弃的帧
+
+    def send(self, msg_type, payload=b""):
+        """排队一帧，返回序号；缓冲区满时返回 None"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        seq = self.seq
+        self.seq = (seq + 1) & 0xFF
+        frame = encode_frame(msg_type, seq, payload[:MAX_PAYLOAD])
+        ring = self.bulk if msg_type in BULK else self.tx
+        if not ring.put(frame):
+            self.overflows += 1
+            return None
+        self.sent += 1
+        if msg_type in RELIABLE:
+            self.pending[seq] = [frame, self.clock.ticks_ms(), 0]
+        return seq
+
+    def poll(self):
+        """收取并解析输入、处理超时重发和心跳、写出一小段发送缓冲区"""
+        now = self.clock.ticks_ms()
+        n = self.uart.any()
+        if n:
+            data = self.uart.read(n)
+            if data:
+                self.last_rx = now
+                self.parser.feed(data)
+        elif self.parser.pos and self.clock.ticks_diff(now, self.last_rx) >= self.rx_timeout_ms:
+            self.parser.resync()
+
+        for seq in list(self.pending):
+            entry = self.pending[seq]
+            if self.clock.ticks_diff(now, entry[1]) < self.ack_timeout_ms:
+                continue
+            if entry[2] >= self.max_retries:
+                del self.pending[seq]
+                self.dropped += 1
+            elif self.tx.put(entry[0]):
+                entry[1] = now
+                entry[2] += 1
+                self.retries += 1
+
+        if self.heartbeat_ms and self.clock.ticks_diff(now, self.last_heartbeat) >= self.heartbeat_ms:
+            self.last_heartbeat = now
+            uptime = self.clock.ticks_diff(now, self.started) // 1000
+            self.send(MSG_HEARTBEAT, uptime.to_bytes(4, "little"))
+
+        self._drain()
+
+    def _drain(self):
+        if self._txdone is not None and not self._txdone():
+            return  # 上次写出的还在移位发送，现在写会一直等到它发完
+        budget = self.max_write
+        while budget > 0:
+            if not self._remaining:
+                # 帧边界：优先缓冲区有数据就先发它
+                if self.tx.count:
+                    self._current = self.tx
+                elif self.bulk.count:
+                    self._current = self.bulk
+                else:
+                    return
+                self._remaining = self._current.frame_size()
+            ring = self._current
+            size = len(ring.buf)
+            n = min(self._remaining, budget, size - ring.tail)
+            written = self.uart.write(ring.view[ring.tail:ring.tail + n])
+            if not written:
+                return
+            ring.tail = (ring.tail + written) % size
+            ring.count -= written
+            self._remaining -= written
+            budget -= written
+
+    def bulk_room(self):
+        """低优先级缓冲区的剩余字节数"""
+        return len(self.bulk.buf) - self.bulk.count
+
+    def idle(self):
+        """发送缓冲区已空且没有待确认的消息"""
+        return not self.tx.count and not self.bulk.count and not self.pending
+
+    def _on_frame(self, msg_type, seq, payload):
+        if msg_type == MSG_ACK:
+            if payload and payload[0] in self.pending:
+                del self.pending[payload[0]]
+                self.acked += 1
+            return
+
+        if msg_type in RELIABLE:
+            self.tx.put(encode_frame(MSG_ACK, self.seq, bytes((seq,))))
+            self.seq = (self.seq + 1) & 0xFF
+            if seq in self.recent_rx:
+                return  # 我们的ACK丢了，对端重发：只补发ACK
+            self.recent_rx.append(seq)
+            if len(self.recent_rx) > RECENT_RX:
+                self.recent_rx.pop(0)
+
+        if msg_type == MSG_COMMAND:
+            if self.on_command is not None:
+                try:
+                    text = payload.decode()
+                except UnicodeError:
+                    self.send(MSG_REPLY, "ERR 命令不是UTF-8文本")
+                    return
+                for line in self.on_command(text):
+                    self.send(MSG_REPLY, line)
+        elif self.on_message is not None:
+            self.on_message(msg_type, payload)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "acked": self.acked,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "overflows": self.overflows,
+            "rx_frames": self.parser.frames,
+            "rx_errors": self.parser.errors,
+        }